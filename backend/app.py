@@ -1,31 +1,92 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, request, jsonify, send_file, Response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, timezone
-import qrcode
 import io
 import base64
+import hmac
+import socket
 import os
+import sys
 from dotenv import load_dotenv
 import json
-import requests
+import csv
+import click
+import atexit
+from collections import namedtuple
+from functools import partial, wraps
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from blob_store import BlobStore
+from log_setup import configure_logging
+import metrics
+from lru_cache import LRUCache
+from scan_debounce import ScanDebouncer
+from event_hub import EventHub, PostgresRelay, SocketRelay, SubscriberLimitReached
+from gate_dispatch import GateDispatcher, GateHealthMonitor
+from thumbnails import THUMBNAIL_SIZES, render_thumbnails
+from qr_codes import render_qr_png, render_qr_pngs
+import qr_sheets
+import pg_copy
+from qr_signing import QRSigner
+from render_pool import RenderPool
+import migrations
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///gate_security.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# LOG_LEVEL=WARNING quiets per-scan logging in production; LOG_FORMAT=json for log shippers
+logger = configure_logging(os.getenv('LOG_LEVEL', 'INFO'), os.getenv('LOG_FORMAT', 'text'))
 
-# JWT Configuration - MUST be set before JWTManager initialization
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-# Flask-JWT-Extended defaults to looking for tokens in Authorization header with Bearer format
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 
-db = SQLAlchemy(app)
-CORS(app, supports_credentials=True, allow_headers=['Content-Type', 'Authorization'])
-jwt = JWTManager(app)
+def engine_options(uri):
+    """SQLAlchemy engine options for a database URI."""
+    # In-memory SQLite keeps its single-connection pool
+    if ':memory:' in uri:
+        return {}
+    # Connections per process; size it to at least the server's threads per worker
+    options = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    }
+    if uri.startswith('postgresql'):
+        options.update({
+            # Connections dropped by a server restart or an idle timeout are replaced before use
+            'pool_pre_ping': True,
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+            # Timestamps are converted to UTC before they are stored (SQLite keeps the naive
+            # UTC value), so the session zone is pinned: date_trunc and "today" mean UTC
+            'connect_args': {'options': '-c timezone=UTC'}
+        })
+    return options
+
+# Extensions and the blueprint holding every route and CLI command; create_app() binds
+# them to an app. cli_group=None keeps the commands top-level (flask --app app db-upgrade).
+db = SQLAlchemy()
+jwt = JWTManager()
+api = Blueprint('api', __name__, cli_group=None)
+# The current app's store (BLOB_STORAGE_PATH)
+blob_store = LocalProxy(lambda: current_app.extensions['blob_store'])
+
+# Signed QR payloads. QR_SIGNING_KEYS='2:new-secret,1:old-secret' lists every accepted key
+# version; new codes use QR_SIGNING_KEY_VERSION (default: the highest). Without keys,
+# version 1 is derived from the JWT secret.
+qr_signer = QRSigner.from_config(
+    os.getenv('QR_SIGNING_KEYS'),
+    os.getenv('QR_SIGNING_KEY_VERSION'),
+    fallback_secret=JWT_SECRET_KEY
+)
+# Migration mode: keep accepting unsigned VEHICLE:... codes until every sticker is reissued
+QR_ACCEPT_LEGACY = os.getenv('QR_ACCEPT_LEGACY', 'true').lower() in ('1', 'true', 'yes')
 
 # JWT Error Handlers
 @jwt.expired_token_loader
@@ -34,16 +95,75 @@ def expired_token_callback(jwt_header, jwt_payload):
 
 @jwt.invalid_token_loader
 def invalid_token_callback(error):
-    print(f"Invalid token error: {str(error)}")
-    print(f"Request headers: {request.headers}")
+    logger.info('Invalid token', extra={'path': request.path, 'error': str(error)})
     return jsonify({'message': f'Invalid token: {str(error)}'}), 422
 
 @jwt.unauthorized_loader
 def missing_token_callback(error):
-    print(f"Missing token error: {str(error)}")
-    print(f"Request headers: {request.headers}")
+    logger.info('Missing token', extra={'path': request.path, 'error': str(error)})
     return jsonify({'message': 'Authorization token is missing'}), 401
 
+# Metrics, exposed on /metrics in Prometheus text format. Routes are labelled by their URL
+# rule (e.g. /api/vehicles/<int:vehicle_id>) so the number of series stays bounded.
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by route and status.', ('method', 'endpoint', 'status')
+)
+DB_QUERIES_PER_REQUEST = metrics.histogram(
+    'db_queries_per_request', 'SQL statements executed per request.', ('endpoint',),
+    buckets=metrics.QUERY_COUNT_BUCKETS
+)
+DB_SECONDS_PER_REQUEST = metrics.histogram(
+    'db_time_per_request_seconds', 'Time spent executing SQL per request.', ('endpoint',)
+)
+DB_QUERIES = metrics.counter('db_queries', 'SQL statements executed, including background work.')
+SCANS = metrics.counter(
+    'scans', 'Scans by location and result (in, out, duplicate, rejected, replayed).', ('location', 'result')
+)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# SQLite settings for concurrent use. WAL lets dashboard reads run alongside scan writes;
+# synchronous=NORMAL is still crash-safe in WAL mode (only the last commits can be lost
+# on power failure); busy_timeout makes a writer wait for the lock instead of failing
+# with "database is locked" when several workers write at once.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '15000'))
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    DB_QUERIES.inc()
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+@api.after_app_request
+def record_request_metrics(response):
+    # Streaming responses (events, QR sheets) are measured up to their first byte
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                     endpoint=endpoint, status=response.status_code)
+        DB_QUERIES_PER_REQUEST.observe(g.db_queries, endpoint=endpoint)
+        DB_SECONDS_PER_REQUEST.observe(g.db_seconds, endpoint=endpoint)
+    return response
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -52,7 +172,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     full_name = db.Column(db.String(200), nullable=False)
     role = db.Column(db.String(50), default='user')  # admin, user
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     
     vehicles = db.relationship('Vehicle', backref='owner', lazy=True)
 
@@ -63,9 +183,10 @@ class Vehicle(db.Model):
     make = db.Column(db.String(100))
     model = db.Column(db.String(100))
     color = db.Column(db.String(50))
-    qr_code = db.Column(db.Text, unique=True, nullable=False)  # Base64 QR code
+    qr_code = db.Column(db.Text, unique=True, nullable=False)  # Blob reference (blob:<sha256>) to the QR PNG
+    qr_key_version = db.Column(db.Integer)  # Signing key of the QR payload; NULL for unsigned legacy codes
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     
     entries = db.relationship('EntryLog', backref='vehicle', lazy=True, order_by='EntryLog.timestamp.desc()')
     images = db.relationship('VehicleImage', backref='vehicle', lazy=True, cascade='all, delete-orphan')
@@ -73,55 +194,902 @@ class Vehicle(db.Model):
 class VehicleImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
-    image_data = db.Column(db.Text, nullable=False)  # Base64 encoded image
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    image_data = db.Column(db.Text, nullable=False)  # Blob reference (blob:<sha256>)
+    # Resized copies (blob references), filled in by the thumbnail pool after upload
+    thumbnail_small = db.Column(db.String(80))
+    thumbnail_medium = db.Column(db.String(80))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
 class EntryLog(db.Model):
+    # Existing databases get these through migrations.py (create_all won't add them)
+    __table_args__ = (
+        # Last entry per vehicle (scan path) and per-vehicle history
+        db.Index('ix_entry_log_vehicle_timestamp', 'vehicle_id', 'timestamp'),
+        # Date-range listing and stats, filtered by entry type
+        db.Index('ix_entry_log_timestamp_type', 'timestamp', 'entry_type'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
     entry_type = db.Column(db.String(10), nullable=False)  # 'in' or 'out'
-    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    timestamp = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     location = db.Column(db.String(100), default='Main Gate')
     notes = db.Column(db.Text)
 
-# Initialize database
-with app.app_context():
+class GateController(db.Model):
+    # An ESP32 gate controller; scans at `location` are routed to it
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    location = db.Column(db.String(100), unique=True, nullable=False)
+    base_url = db.Column(db.String(255), nullable=False)  # e.g. http://192.168.1.50
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class GateCommand(db.Model):
+    # Delivery record for each open/close command sent to the ESP32 on behalf of a scan
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, db.ForeignKey('entry_log.id'), nullable=False, index=True)
+    action = db.Column(db.String(10), nullable=False)  # 'open' or 'close'
+    url = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, delivered, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    completed_at = db.Column(db.DateTime(timezone=True))
+
+class ScanReceipt(db.Model):
+    # Client-generated IDs of scans already recorded, so replayed offline batches never duplicate
+    # entries. Kept for SCAN_RECEIPT_RETENTION_DAYS; entry_id isn't a foreign key because
+    # archive_entries may move the entry out of entry_log before then.
+    client_scan_id = db.Column(db.String(64), primary_key=True)
+    entry_id = db.Column(db.Integer, nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class Blob(db.Model):
+    # Metadata for a file in the content-addressed blob store; the bytes live on disk
+    sha256 = db.Column(db.String(64), primary_key=True)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class EntryLogArchive(db.Model):
+    # Catalog of monthly archive tables holding EntryLog rows past the archive horizon
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    table_name = db.Column(db.String(64), nullable=False)
+    period_start = db.Column(db.DateTime(timezone=True), nullable=False)
+    period_end = db.Column(db.DateTime(timezone=True), nullable=False)  # exclusive
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    in_count = db.Column(db.Integer, nullable=False, default=0)
+    out_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+class VehiclePresence(db.Model):
+    # One row per vehicle that has ever been scanned, kept in step with EntryLog by
+    # scan_qr_code so "who is inside" never has to walk the whole log.
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), primary_key=True)
+    state = db.Column(db.String(10), nullable=False, index=True)  # 'in' or 'out'
+    last_entry_id = db.Column(db.Integer, db.ForeignKey('entry_log.id'))
+    last_timestamp = db.Column(db.DateTime(timezone=True))
+    last_location = db.Column(db.String(100))
+    
+    vehicle = db.relationship('Vehicle', backref=db.backref('presence', uselist=False, cascade='all, delete-orphan'))
+
+class VehicleVisit(db.Model):
+    # One stay on site: an 'in' entry paired with the 'out' that follows it, open while
+    # exited_at is NULL. Derived from EntryLog: scan_qr_code keeps it current and
+    # rebuild_vehicle_visits recomputes it. Entry ids aren't foreign keys because
+    # archive_entries moves old entries out of entry_log; visits stay.
+    __table_args__ = (
+        # A vehicle's stays, newest first
+        db.Index('ix_vehicle_visit_vehicle_entered', 'vehicle_id', 'entered_at'),
+        # Dwell reports over visits that ended in a period, without touching the table;
+        # exited_at IS NULL seeks the open visits (at most one per vehicle) for overstays
+        db.Index('ix_vehicle_visit_exited_duration', 'exited_at', 'duration_seconds'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    entry_id = db.Column(db.Integer, nullable=False, unique=True)
+    exit_id = db.Column(db.Integer)
+    entered_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    exited_at = db.Column(db.DateTime(timezone=True))
+    duration_seconds = db.Column(db.Integer)  # set when the visit closes
+    entry_location = db.Column(db.String(100))
+    exit_location = db.Column(db.String(100))
+    
+    vehicle = db.relationship('Vehicle', backref=db.backref('visits', lazy=True, cascade='all, delete-orphan'))
+
+def _utc(ts):
+    # Timestamps are stored in UTC. PostgreSQL hands them back aware; SQLite has no time zone
+    # type and hands back the naive UTC wall-clock value, which gets its tzinfo here.
+    if ts is None:
+        return None
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def record_presence(vehicle_id, entry):
+    """Advance the vehicle's presence row to `entry` unless a later entry already owns it.
+    
+    Must be called inside the same transaction as the EntryLog insert; the caller commits.
+    """
+    presence = db.session.get(VehiclePresence, vehicle_id)
+    if presence is None:
+        presence = VehiclePresence(vehicle_id=vehicle_id)
+        db.session.add(presence)
+    elif presence.last_timestamp is not None and _utc(entry.timestamp) < _utc(presence.last_timestamp):
+        return presence
+    
+    presence.state = entry.entry_type
+    presence.last_entry_id = entry.id
+    presence.last_timestamp = entry.timestamp
+    presence.last_location = entry.location
+    return presence
+
+def record_visit(vehicle_id, entry):
+    """Open a visit for an 'in' entry, or close the vehicle's open visit with an 'out'.
+    
+    Must be called inside the same transaction as the EntryLog insert; the caller commits.
+    """
+    if entry.entry_type == 'in':
+        db.session.add(VehicleVisit(vehicle_id=vehicle_id, entry_id=entry.id,
+                                    entered_at=entry.timestamp, entry_location=entry.location))
+        return
+    visit = VehicleVisit.query.filter(
+        VehicleVisit.vehicle_id == vehicle_id,
+        VehicleVisit.exited_at.is_(None)
+    ).order_by(VehicleVisit.entered_at.desc()).first()
+    if visit is None:
+        return
+    visit.exit_id = entry.id
+    visit.exited_at = entry.timestamp
+    visit.exit_location = entry.location
+    visit.duration_seconds = max(round((_utc(entry.timestamp) - _utc(visit.entered_at)).total_seconds()), 0)
+
+def rebuild_vehicle_presence():
+    """Recompute every VehiclePresence row from the EntryLog history. Returns the row count."""
+    latest = db.session.query(
+        EntryLog.vehicle_id,
+        EntryLog.id,
+        EntryLog.entry_type,
+        EntryLog.timestamp,
+        EntryLog.location,
+        db.func.row_number().over(
+            partition_by=EntryLog.vehicle_id,
+            order_by=(EntryLog.timestamp.desc(), EntryLog.id.desc())
+        ).label('rn')
+    ).subquery()
+    
+    rows = db.session.query(latest).filter(latest.c.rn == 1).all()
+    
+    VehiclePresence.query.delete()
+    db.session.bulk_insert_mappings(VehiclePresence, [{
+        'vehicle_id': r.vehicle_id,
+        'state': r.entry_type,
+        'last_entry_id': r.id,
+        'last_timestamp': r.timestamp,
+        'last_location': r.location
+    } for r in rows])
+    db.session.commit()
+    return len(rows)
+
+@api.cli.command('rebuild-presence')
+def rebuild_presence_command():
+    """Recompute the vehicles-inside table from the entry log."""
+    count = rebuild_vehicle_presence()
+    click.echo(f"Rebuilt presence for {count} vehicles")
+
+@api.cli.command('migrate-blobs')
+@click.option('--vacuum', is_flag=True, help='Reclaim the freed space in the SQLite file afterwards.')
+def migrate_blobs_command(vacuum):
+    """Move base64 images and QR codes out of the database into the blob store."""
+    count = migrate_legacy_blobs()
+    click.echo(f"Moved {count} images and QR codes to {current_app.config['BLOB_STORAGE_PATH']}")
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+        click.echo("Database vacuumed")
+
+def count_where(condition):
+    """Count of rows matching `condition` as an aggregate: COUNT(*) FILTER (WHERE ...) on
+    PostgreSQL, SUM(CASE ...) elsewhere (NULL over no rows, so callers use `or 0`)."""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.count().filter(condition)
+    return db.func.sum(db.case((condition, 1), else_=0))
+
+def seconds_between(start, end):
+    """Whole seconds from `start` to `end` as a SQL expression."""
+    if db.engine.dialect.name == 'postgresql':
+        return db.cast(db.extract('epoch', end - start), db.Integer)
+    return db.cast(db.func.round((db.func.julianday(end) - db.func.julianday(start)) * 86400), db.Integer)
+
+# EntryLog archival: whole months older than the horizon move into entry_log_archive_YYYYMM
+# tables so the hot table (and every scan against it) stays small
+ENTRY_ARCHIVE_HORIZON_DAYS = int(os.getenv('ENTRY_ARCHIVE_HORIZON_DAYS', '180'))
+# How long a device may keep resending an offline batch and still get duplicates recognized
+SCAN_RECEIPT_RETENTION_DAYS = int(os.getenv('SCAN_RECEIPT_RETENTION_DAYS', '90'))
+ENTRY_LOG_COLUMNS = ('id', 'vehicle_id', 'entry_type', 'timestamp', 'location', 'notes')
+archive_metadata = db.MetaData()
+
+def entry_archive_table(month):
+    """Table object for a month ('YYYY-MM'), same columns and indexes as entry_log."""
+    name = f"entry_log_archive_{month.replace('-', '')}"
+    if name in archive_metadata.tables:
+        return archive_metadata.tables[name]
+    return db.Table(
+        name, archive_metadata,
+        *[db.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+          for c in EntryLog.__table__.columns],
+        db.Index(f'ix_{name}_vehicle_timestamp', 'vehicle_id', 'timestamp'),
+        db.Index(f'ix_{name}_timestamp_type', 'timestamp', 'entry_type')
+    )
+
+def _month_start(ts):
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+def _next_month(ts):
+    return datetime(ts.year + (ts.month == 12), ts.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+def archive_entries(horizon_days=ENTRY_ARCHIVE_HORIZON_DAYS):
+    """Move whole months of EntryLog rows older than the horizon into archive tables.
+    
+    The latest entry of each vehicle stays hot because VehiclePresence points at it.
+    Each month is moved in its own transaction. Returns {month: rows moved}.
+    """
+    cutoff = _month_start(datetime.now(timezone.utc) - timedelta(days=horizon_days))
+    pinned = db.select(VehiclePresence.last_entry_id).filter(VehiclePresence.last_entry_id.isnot(None))
+    movable = db.and_(EntryLog.timestamp < cutoff, EntryLog.id.notin_(pinned))
+    moved = {}
+    
+    while True:
+        oldest = db.session.query(db.func.min(EntryLog.timestamp)).filter(movable).scalar()
+        if oldest is None:
+            break
+        period_start = _month_start(oldest)
+        period_end = _next_month(oldest)
+        month = period_start.strftime('%Y-%m')
+        in_month = db.and_(movable, EntryLog.timestamp >= period_start, EntryLog.timestamp < period_end)
+        
+        table = entry_archive_table(month)
+        table.create(db.engine, checkfirst=True)
+        columns = [EntryLog.__table__.c[name] for name in ENTRY_LOG_COLUMNS]
+        db.session.execute(table.insert().from_select(ENTRY_LOG_COLUMNS, db.select(*columns).where(in_month)))
+        
+        counts = db.session.query(
+            db.func.count(EntryLog.id),
+            count_where(EntryLog.entry_type == 'in'),
+            count_where(EntryLog.entry_type == 'out')
+        ).filter(in_month).one()
+        
+        # Delivery records are only meaningful while the entry is hot; scan receipts stay
+        # for prune_scan_receipts, so a late resend of an archived scan is still a duplicate
+        archived_ids = db.select(EntryLog.id).where(in_month)
+        GateCommand.query.filter(GateCommand.entry_id.in_(archived_ids)).delete(synchronize_session=False)
+        EntryLog.query.filter(in_month).delete(synchronize_session=False)
+        
+        catalog = db.session.get(EntryLogArchive, month)
+        if catalog is None:
+            catalog = EntryLogArchive(month=month, table_name=table.name, period_start=period_start,
+                                      period_end=period_end, row_count=0, in_count=0, out_count=0)
+            db.session.add(catalog)
+        catalog.row_count += counts[0]
+        catalog.in_count += counts[1] or 0
+        catalog.out_count += counts[2] or 0
+        catalog.archived_at = datetime.now(timezone.utc)
+        db.session.commit()
+        moved[month] = counts[0]
+    
+    return moved
+
+def prune_scan_receipts(retention_days=SCAN_RECEIPT_RETENTION_DAYS):
+    """Delete scan receipts recorded more than `retention_days` ago. Returns the number deleted."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = ScanReceipt.query.filter(ScanReceipt.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def entry_log_source(start=None, end=None):
+    """Entity to query entries through: EntryLog itself, or EntryLog aliased over a UNION ALL
+    of the hot table and every archive month overlapping [start, end)."""
+    partitions = EntryLogArchive.query
+    if start:
+        partitions = partitions.filter(EntryLogArchive.period_end > start)
+    if end:
+        partitions = partitions.filter(EntryLogArchive.period_start < end)
+    partitions = partitions.order_by(EntryLogArchive.month).all()
+    if not partitions:
+        return EntryLog
+    
+    selects = [db.select(*[EntryLog.__table__.c[name] for name in ENTRY_LOG_COLUMNS])]
+    for partition in partitions:
+        table = entry_archive_table(partition.month)
+        selects.append(db.select(*[table.c[name] for name in ENTRY_LOG_COLUMNS]))
+    return db.aliased(EntryLog, db.union_all(*selects).subquery('entry_log_all'))
+
+@api.cli.command('archive-entries')
+@click.option('--horizon-days', default=ENTRY_ARCHIVE_HORIZON_DAYS, show_default=True,
+              help='Keep at least this many days of entries in the hot table.')
+@click.option('--receipt-days', default=SCAN_RECEIPT_RETENTION_DAYS, show_default=True,
+              help='Keep batch scan receipts (duplicate detection) this many days.')
+def archive_entries_command(horizon_days, receipt_days):
+    """Move old entry log months into archive tables and drop expired scan receipts."""
+    moved = archive_entries(horizon_days)
+    for month, count in moved.items():
+        click.echo(f"Archived {count} entries from {month}")
+    if not moved:
+        click.echo("Nothing to archive")
+    pruned = prune_scan_receipts(receipt_days)
+    if pruned:
+        click.echo(f"Deleted {pruned} expired scan receipts")
+
+def rebuild_vehicle_visits():
+    """Recompute every VehicleVisit row from the entry log (archived months included) in one
+    INSERT ... SELECT: each 'in' entry becomes a visit, closed by the vehicle's next entry
+    when that one is an 'out'. Returns the number of visits written; the caller commits.
+    """
+    Entry = entry_log_source()
+    window = {'partition_by': Entry.vehicle_id, 'order_by': (Entry.timestamp, Entry.id)}
+    entries = db.session.query(
+        Entry.vehicle_id,
+        Entry.id,
+        Entry.entry_type,
+        Entry.timestamp,
+        Entry.location,
+        db.func.lead(Entry.id).over(**window).label('next_id'),
+        db.func.lead(Entry.entry_type).over(**window).label('next_type'),
+        db.func.lead(Entry.timestamp).over(**window).label('next_timestamp'),
+        db.func.lead(Entry.location).over(**window).label('next_location')
+    )
+    paired = entries.subquery()
+    
+    closed = paired.c.next_type == 'out'
+    visits = db.select(
+        paired.c.vehicle_id,
+        paired.c.id,
+        db.case((closed, paired.c.next_id)),
+        paired.c.timestamp,
+        db.case((closed, paired.c.next_timestamp)),
+        db.case((closed, seconds_between(paired.c.timestamp, paired.c.next_timestamp))),
+        paired.c.location,
+        db.case((closed, paired.c.next_location))
+    ).where(paired.c.entry_type == 'in')
+    
+    VehicleVisit.query.delete(synchronize_session=False)
+    result = db.session.execute(VehicleVisit.__table__.insert().from_select(
+        ['vehicle_id', 'entry_id', 'exit_id', 'entered_at', 'exited_at', 'duration_seconds',
+         'entry_location', 'exit_location'],
+        visits
+    ))
+    return result.rowcount
+
+def resync_vehicle_visits(vehicle_id, since):
+    """Bring one vehicle's visits in line with its entries after entries from `since` on
+    were added. Visits are updated in place, so their ids stay; returns the number of
+    visits inserted, updated or deleted. The caller commits.
+    """
+    # Start at the visit in progress at `since`, whose exit may have changed
+    anchor = db.session.query(db.func.max(VehicleVisit.entered_at)).filter(
+        VehicleVisit.vehicle_id == vehicle_id,
+        VehicleVisit.entered_at <= since
+    ).scalar()
+    start = anchor if anchor is not None else since
+    Entry = entry_log_source(start)
+    entries = db.session.query(Entry.id, Entry.entry_type, Entry.timestamp, Entry.location).filter(
+        Entry.vehicle_id == vehicle_id,
+        Entry.timestamp >= start
+    ).order_by(Entry.timestamp, Entry.id).all()
+    
+    wanted = {}
+    for entry, following in zip(entries, entries[1:] + [None]):
+        if entry.entry_type != 'in':
+            continue
+        closed = following is not None and following.entry_type == 'out'
+        wanted[entry.id] = {
+            'entered_at': _utc(entry.timestamp),
+            'entry_location': entry.location,
+            'exit_id': following.id if closed else None,
+            'exited_at': _utc(following.timestamp) if closed else None,
+            'exit_location': following.location if closed else None,
+            'duration_seconds': max(round((_utc(following.timestamp) - _utc(entry.timestamp)).total_seconds()), 0)
+                                if closed else None
+        }
+    
+    changed = 0
+    visits = VehicleVisit.query.filter(VehicleVisit.vehicle_id == vehicle_id, VehicleVisit.entered_at >= start)
+    for visit in visits:
+        values = wanted.pop(visit.entry_id, None)
+        if values is None:
+            db.session.delete(visit)
+            changed += 1
+            continue
+        current = {name: getattr(visit, name) for name in values}
+        current['entered_at'], current['exited_at'] = _utc(visit.entered_at), _utc(visit.exited_at)
+        if current != values:
+            for name, value in values.items():
+                setattr(visit, name, value)
+            changed += 1
+    for entry_id, values in wanted.items():
+        db.session.add(VehicleVisit(vehicle_id=vehicle_id, entry_id=entry_id, **values))
+        changed += 1
+    return changed
+
+@api.cli.command('rebuild-visits')
+def rebuild_visits_command():
+    """Recompute the visit (dwell time) table from the entry log."""
+    count = rebuild_vehicle_visits()
+    db.session.commit()
+    click.echo(f"Rebuilt {count} visits")
+
+# Gate command dispatch: runs off the request thread so scans never wait on the ESP32.
+# The dispatcher and health monitor threads work in the app create_app() binds them to.
+def record_gate_result(app, command_id, delivered, attempts, error):
+    with app.app_context():
+        command = db.session.get(GateCommand, command_id)
+        if not command:
+            return
+        command.status = 'delivered' if delivered else 'failed'
+        command.attempts = attempts
+        command.last_error = error
+        command.completed_at = datetime.now(timezone.utc)
+        db.session.commit()
+    if not delivered:
+        logger.warning('Gate command failed', extra={'command_id': command_id, 'attempts': attempts, 'error': error})
+
+gate_dispatcher = GateDispatcher(
+    on_result=None,
+    workers=int(os.getenv('GATE_DISPATCH_WORKERS', '4')),
+    retries=int(os.getenv('GATE_DISPATCH_RETRIES', '3')),
+    timeout=float(os.getenv('GATE_DISPATCH_TIMEOUT', '5'))
+)
+atexit.register(gate_dispatcher.stop, 1)
+metrics.gauge('gate_dispatch_queue_depth', 'Gate commands waiting for a dispatch worker.',
+              lambda: gate_dispatcher.queue.qsize())
+
+def enabled_gate_controllers(app):
+    with app.app_context():
+        return [(c.id, c.base_url) for c in GateController.query.filter_by(enabled=True).all()]
+
+gate_health = GateHealthMonitor(
+    get_controllers=None,
+    interval=float(os.getenv('GATE_HEALTH_INTERVAL', '15')),
+    timeout=float(os.getenv('GATE_HEALTH_TIMEOUT', '2'))
+)
+atexit.register(gate_health.stop, 1)
+
+# location -> (controller_id, base_url), refreshed every GATE_ROUTE_TTL seconds or on change,
+# so routing a scan never costs a query
+GATE_ROUTE_TTL = 30
+_gate_routes = {'loaded_at': 0.0, 'by_location': {}}
+
+def invalidate_gate_routes():
+    _gate_routes['loaded_at'] = 0.0
+    gate_health.refresh()
+
+def resolve_gate(location):
+    """Return (controller_id, base_url) for a scan location.
+    
+    Locations without a registered controller fall back to the single ESP32_IP gate
+    (controller_id None) so single-gate installs keep working unchanged.
+    """
+    gate_health.start()
+    if time.time() - _gate_routes['loaded_at'] > GATE_ROUTE_TTL:
+        _gate_routes['by_location'] = {
+            c.location: (c.id, c.base_url)
+            for c in GateController.query.filter_by(enabled=True).all()
+        }
+        _gate_routes['loaded_at'] = time.time()
+    route = _gate_routes['by_location'].get(location)
+    if route:
+        return route
+    esp32_ip = os.getenv('ESP32_IP')
+    return (None, esp32_ip) if esp32_ip else None
+
+def serialize_gate_controller(controller):
+    health = gate_health.get(controller.id)
+    if health:
+        health['checked_at'] = datetime.fromtimestamp(health['checked_at'], timezone.utc).isoformat()
+    return {
+        'id': controller.id,
+        'name': controller.name,
+        'location': controller.location,
+        'base_url': controller.base_url,
+        'enabled': controller.enabled,
+        'created_at': _utc(controller.created_at).isoformat() if controller.created_at else None,
+        'health': health
+    }
+
+def serialize_gate_command(command):
+    return {
+        'id': command.id,
+        'entry_id': command.entry_id,
+        'action': command.action,
+        'status': command.status,
+        'attempts': command.attempts,
+        'error': command.last_error,
+        'created_at': _utc(command.created_at).isoformat() if command.created_at else None,
+        'completed_at': _utc(command.completed_at).isoformat() if command.completed_at else None
+    }
+
+@api.cli.command('copy-from-sqlite')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-rows', type=int, default=50000, show_default=True, help='Rows per COPY batch.')
+@click.option('--force', is_flag=True, help='Replace data already in the target database.')
+@click.option('--source-utc-offset', help='UTC offset of the scanners (e.g. +08:00) when the source still '
+              'stores scan times as local time (last upgraded before they were stored in UTC).')
+def copy_from_sqlite_command(source, batch_rows, force, source_utc_offset):
+    """Copy every table of a SQLite database into the configured PostgreSQL database."""
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('DATABASE_URL must point at PostgreSQL')
+    if not force and (db.session.query(Vehicle.id).first() or db.session.query(EntryLog.id).first()):
+        raise click.ClickException('The target database already has vehicles or entries; pass --force to replace them')
+    
+    source_engine = db.create_engine(f'sqlite:///{os.path.abspath(source)}')
+    # Scan times of a source not yet migrated to UTC are local; their offset has to be given
+    with source_engine.connect() as conn:
+        local_columns = migrations.local_scan_time_columns(conn)
+    zone = None
+    if source_utc_offset:
+        if not local_columns:
+            raise click.ClickException('The source already stores scan times in UTC; drop --source-utc-offset')
+        try:
+            zone = migrations.parse_utc_offset(source_utc_offset)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--source-utc-offset')
+    elif local_columns:
+        raise click.ClickException('The source stores scan times as local time; pass --source-utc-offset '
+                                   '(e.g. +08:00) or run init-db against it first')
+    tables = [table for table in db.metadata.sorted_tables if table.name != 'schema_migration']
+    # Archive months of both sides: the source's are copied, the target's own are emptied
+    months = set()
+    for name in db.inspect(db.engine).get_table_names():
+        suffix = name.removeprefix('entry_log_archive_')
+        if suffix != name and suffix.isdigit():
+            months.add(f'{suffix[:4]}-{suffix[4:]}')
+    db.session.close()
+    if db.inspect(source_engine).has_table(EntryLogArchive.__tablename__):
+        with source_engine.connect() as conn:
+            months.update(conn.execute(db.select(EntryLogArchive.month)).scalars())
+    for month in sorted(months):
+        table = entry_archive_table(month)
+        table.create(db.engine, checkfirst=True)
+        tables.append(table)
+    
+    started = time.monotonic()
+    pg_copy.copy_database(source_engine, db.engine, tables, batch_rows,
+                          on_table=lambda name, count: click.echo(f"{name}: {count} rows"),
+                          local_columns=local_columns, zone=zone)
+    source_engine.dispose()
+    vehicle_cache.clear()
+    principal_cache.clear()
+    click.echo(f"Copied {len(tables)} tables in {time.monotonic() - started:.1f}s")
+
+@api.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create missing tables and apply pending schema migrations."""
     db.create_all()
+    try:
+        applied = migrations.upgrade(db.engine)
+    except migrations.MigrationError as e:
+        raise click.ClickException(str(e))
+    for name in applied:
+        click.echo(f"Applied migration: {name}")
+    if not applied:
+        click.echo("Schema is up to date")
+
+def bootstrap_database(admin_password='admin123'):
+    """Create missing tables, apply migrations, backfill presence and create the admin
+    account if there is none. Returns (migrations applied, whether the admin was created)."""
+    db.create_all()
+    applied = migrations.upgrade(db.engine)
     
-    # Create admin user if not exists
-    admin = User.query.filter_by(username='admin').first()
-    if not admin:
-        admin = User(
-            username='admin',
-            email='admin@example.com',
-            password_hash=generate_password_hash('admin123'),
-            full_name='Administrator',
-            role='admin'
-        )
-        db.session.add(admin)
+    # Backfill presence and visits for databases created before those tables existed
+    if not db.session.query(VehiclePresence.vehicle_id).first() and db.session.query(EntryLog.id).first():
+        rebuild_vehicle_presence()
+    if not db.session.query(VehicleVisit.id).first() and db.session.query(EntryLog.id).first():
+        rebuild_vehicle_visits()
         db.session.commit()
+    
+    # Create admin user if not exists
+    if User.query.filter_by(username='admin').first():
+        return applied, False
+    admin = User(
+        username='admin',
+        email='admin@example.com',
+        password_hash=generate_password_hash(admin_password),
+        full_name='Administrator',
+        role='admin'
+    )
+    db.session.add(admin)
+    db.session.commit()
+    return applied, True
+
+@api.cli.command('init-db')
+@click.option('--admin-password', envvar='ADMIN_PASSWORD', default='admin123', show_default=True,
+              help='Password for the admin account when it is created (env ADMIN_PASSWORD).')
+def init_db_command(admin_password):
+    """Create the schema, apply migrations and create the admin account. Run before first start
+    and after upgrades; the server itself never changes the schema."""
+    try:
+        applied, admin_created = bootstrap_database(admin_password)
+    except migrations.MigrationError as e:
+        raise click.ClickException(str(e))
+    for name in applied:
+        click.echo(f"Applied migration: {name}")
+    click.echo("Created admin user 'admin'" if admin_created else "Admin user already exists")
 
 # Helper function to generate QR code
 def generate_qr_code(data):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
+    return store_blob(render_qr_png(data), 'image/png')
+
+def vehicle_qr_payload(vehicle):
+    return qr_signer.sign(vehicle.id, vehicle.plate_number)
+
+def assign_qr_code(vehicle):
+    vehicle.qr_code = generate_qr_code(vehicle_qr_payload(vehicle))
+    vehicle.qr_key_version = qr_signer.current_version
+
+# qr_code is NOT NULL and unique but its payload needs the vehicle id; rows are inserted
+# with this placeholder, flushed for their ids, and given the real code in the same transaction
+def pending_qr_code(plate_number):
+    return f"pending:{plate_number}"
+
+# Blob helpers: columns hold 'blob:<sha256>' references, the API hands out URLs
+BLOB_REF_PREFIX = 'blob:'
+
+def store_blob(data, content_type):
+    """Write bytes to the blob store (deduplicated by content) and return a column reference."""
+    digest = blob_store.put(data)
+    if db.session.get(Blob, digest) is None:
+        db.session.add(Blob(sha256=digest, content_type=content_type, size=len(data)))
+    return f"{BLOB_REF_PREFIX}{digest}"
+
+def store_blobs(items, content_type):
+    """store_blob for many payloads, with one Blob lookup for the lot. Returns references in order."""
+    digests = [blob_store.put(data) for data in items]
+    known = {row.sha256 for row in db.session.query(Blob.sha256).filter(Blob.sha256.in_(set(digests)))}
+    for digest, data in zip(digests, items):
+        if digest not in known:
+            db.session.add(Blob(sha256=digest, content_type=content_type, size=len(data)))
+            known.add(digest)
+    return [f"{BLOB_REF_PREFIX}{digest}" for digest in digests]
+
+def blob_url(ref):
+    """URL for a stored reference. Legacy data URLs pass through until migrate-blobs has run."""
+    if ref and ref.startswith(BLOB_REF_PREFIX):
+        return f"/api/blobs/{ref[len(BLOB_REF_PREFIX):]}"
+    return ref
+
+def save_vehicle_image(vehicle_id, image):
+    image_ref = store_blob(image.read(), image.mimetype or 'application/octet-stream')
+    vehicle_image = VehicleImage(vehicle_id=vehicle_id, image_data=image_ref)
+    db.session.add(vehicle_image)
+    return vehicle_image
+
+def serialize_vehicle_image(vehicle_image):
+    # Thumbnails fall back to the original until the pool has rendered them
+    return {
+        'id': vehicle_image.id,
+        'url': blob_url(vehicle_image.image_data),
+        'thumbnail_url': blob_url(vehicle_image.thumbnail_small or vehicle_image.image_data),
+        'preview_url': blob_url(vehicle_image.thumbnail_medium or vehicle_image.image_data)
+    }
+
+def decode_data_url(value):
+    # data:<mime>;base64,<payload>
+    header, payload = value.split(',', 1)
+    content_type = header[len('data:'):].split(';', 1)[0] or 'application/octet-stream'
+    return content_type, base64.b64decode(payload)
+
+def migrate_legacy_blobs(batch_size=100):
+    """Move base64 data URLs from Vehicle.qr_code and VehicleImage.image_data into the blob store."""
+    migrated = 0
+    for model, column in ((Vehicle, 'qr_code'), (VehicleImage, 'image_data')):
+        while True:
+            rows = model.query.filter(getattr(model, column).like('data:%')).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                content_type, data = decode_data_url(getattr(row, column))
+                setattr(row, column, store_blob(data, content_type))
+            db.session.commit()
+            migrated += len(rows)
+    return migrated
+
+# Scan-path vehicle cache: the fields a scan response needs, keyed by ('id', id) and
+# ('plate', plate). Writes to vehicles and their owners invalidate it in the process that
+# made them; a hit is checked against the vehicle row so other processes' deletions and
+# plate changes apply at once.
+vehicle_cache = LRUCache(
+    maxsize=int(os.getenv('VEHICLE_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('VEHICLE_CACHE_TTL', '60'))
+)
+metrics.gauge('vehicle_cache_entries', 'Vehicles held in the scan cache.', lambda: vehicle_cache.stats()['size'])
+
+def load_scan_vehicle(vehicle_id=None, plate_number=None):
+    """Scan projection of a vehicle by id or plate, from the cache or one joined query."""
+    key = ('id', vehicle_id) if vehicle_id is not None else ('plate', plate_number)
+    cached = vehicle_cache.get(key)
+    if cached is not None:
+        # One primary-key lookup instead of the joined query: the vehicle must still exist
+        # with the plate and owner the entry was cached with
+        current = db.session.query(Vehicle.plate_number, Vehicle.user_id).filter(Vehicle.id == cached['id']).first()
+        if current is not None and tuple(current) == (cached['plate_number'], cached['user_id']):
+            return cached
+        invalidate_vehicle_cache(cached['id'], cached['plate_number'])
+    
+    # Scans show the small thumbnail, or the original until it has been rendered
+    first_image = db.select(
+        db.func.coalesce(VehicleImage.thumbnail_small, VehicleImage.image_data)
+    ).where(
+        VehicleImage.vehicle_id == Vehicle.id
+    ).order_by(VehicleImage.id).limit(1).scalar_subquery()
     
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
+    query = db.session.query(
+        Vehicle.id,
+        Vehicle.plate_number,
+        Vehicle.vehicle_type,
+        Vehicle.make,
+        Vehicle.model,
+        Vehicle.color,
+        Vehicle.user_id,
+        User.full_name.label('owner_name'),
+        first_image.label('image_ref')
+    ).join(User, User.id == Vehicle.user_id)
+    if vehicle_id is not None:
+        query = query.filter(Vehicle.id == vehicle_id)
+    else:
+        query = query.filter(Vehicle.plate_number == plate_number)
+    
+    row = query.first()
+    if row is None:
+        return None
     
-    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_base64}"
+    vehicle = row._asdict()
+    vehicle_cache.put(('id', vehicle['id']), vehicle)
+    vehicle_cache.put(('plate', vehicle['plate_number']), vehicle)
+    return vehicle
+
+def invalidate_vehicle_cache(vehicle_id, *plate_numbers):
+    vehicle_cache.delete(('id', vehicle_id), *[('plate', plate) for plate in plate_numbers])
+
+def invalidate_user_vehicles(user_id):
+    for vehicle_id, plate_number in db.session.query(Vehicle.id, Vehicle.plate_number).filter_by(user_id=user_id):
+        invalidate_vehicle_cache(vehicle_id, plate_number)
+
+# Thumbnail pipeline: uploads store the original and return; resizing runs on this pool
+thumbnail_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('THUMBNAIL_WORKERS', '2')),
+    thread_name_prefix='thumbnails'
+)
+atexit.register(thumbnail_pool.shutdown, wait=False)
+
+def read_image_ref(ref):
+    if ref.startswith(BLOB_REF_PREFIX):
+        return blob_store.read(ref[len(BLOB_REF_PREFIX):])
+    return decode_data_url(ref)[1]
+
+def build_thumbnails(app, image_id):
+    """Render and store the thumbnails of one VehicleImage in `app`. Returns True when they were saved."""
+    try:
+        with app.app_context():
+            vehicle_image = db.session.get(VehicleImage, image_id)
+            if not vehicle_image:
+                return False
+            thumbnails = render_thumbnails(read_image_ref(vehicle_image.image_data))
+            for name, _ in THUMBNAIL_SIZES:
+                data, content_type = thumbnails[name]
+                setattr(vehicle_image, f'thumbnail_{name}', store_blob(data, content_type))
+            db.session.commit()
+            vehicle = db.session.get(Vehicle, vehicle_image.vehicle_id)
+            if vehicle:
+                invalidate_vehicle_cache(vehicle.id, vehicle.plate_number)
+            return True
+    except Exception as e:
+        logger.warning('Thumbnail generation failed', extra={'image_id': image_id, 'error': str(e)})
+        return False
+
+def queue_thumbnails(image_ids):
+    app = current_app._get_current_object()
+    for image_id in image_ids:
+        thumbnail_pool.submit(build_thumbnails, app, image_id)
+
+@api.cli.command('generate-thumbnails')
+@click.option('--batch-size', default=100, show_default=True, help='Images loaded per query.')
+def generate_thumbnails_command(batch_size):
+    """Render thumbnails for images uploaded before the thumbnail pipeline existed."""
+    generated = failed = 0
+    last_id = 0
+    while True:
+        image_ids = [row.id for row in db.session.query(VehicleImage.id).filter(
+            VehicleImage.thumbnail_small.is_(None),
+            VehicleImage.id > last_id
+        ).order_by(VehicleImage.id).limit(batch_size)]
+        if not image_ids:
+            break
+        last_id = image_ids[-1]
+        for saved in thumbnail_pool.map(partial(build_thumbnails, current_app._get_current_object()), image_ids):
+            if saved:
+                generated += 1
+            else:
+                failed += 1
+    click.echo(f"Generated thumbnails for {generated} images ({failed} failed)")
+
+# Helper to parse ?start= / ?end= query parameters
+def parse_range_param(value, end=False):
+    """Parse a 'YYYY-MM-DD' or ISO datetime into an aware UTC datetime. Values without an
+    offset, bare dates included, are taken as UTC.
+    
+    A bare date used as an end bound covers that whole day, so the returned value is the
+    next midnight and callers should compare with '<'.
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return _utc(parsed)
+
+# Time bucket expression for the analytics endpoints, grouped in SQL
+TIMESERIES_BUCKETS = ('hour', 'day', 'week', 'month')
+
+# Bucket boundaries follow the calendar `utc_offset` minutes east of UTC, and the labels
+# are wall-clock times at that offset
+TIMESERIES_MAX_OFFSET = 14 * 60
+
+def timestamp_bucket(column, bucket, utc_offset=0):
+    if db.engine.dialect.name == 'postgresql':
+        if utc_offset:
+            column = column + timedelta(minutes=utc_offset)
+        return db.func.to_char(db.func.date_trunc(bucket, column), 'YYYY-MM-DD"T"HH24:MI:SS')
+    shift = (f'{utc_offset:+d} minutes',) if utc_offset else ()
+    if bucket == 'hour':
+        return db.func.strftime('%Y-%m-%dT%H:00:00', column, *shift)
+    if bucket == 'day':
+        return db.func.strftime('%Y-%m-%dT00:00:00', column, *shift)
+    if bucket == 'week':
+        # Weeks start on Monday, matching date_trunc('week', ...)
+        return db.func.strftime('%Y-%m-%dT00:00:00', column, *shift, '-6 days', 'weekday 1')
+    return db.func.strftime('%Y-%m-01T00:00:00', column, *shift)
+
+def format_utc_offset(offset):
+    """'+08:00' for 480, the ISO 8601 suffix of a UTC offset in minutes."""
+    hours, minutes = divmod(abs(offset), 60)
+    return f"{'-' if offset < 0 else '+'}{hours:02d}:{minutes:02d}"
+
+# Authenticated principal: the id, username and role a route needs about the token's user,
+# cached so routes don't load the User row on every request. update_user and delete_user
+# drop the entry; other processes see role changes and deletions within the TTL.
+Principal = namedtuple('Principal', ['id', 'username', 'role'])
+principal_cache = LRUCache(
+    maxsize=int(os.getenv('PRINCIPAL_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('PRINCIPAL_CACHE_TTL', '30'))
+)
+
+def load_principal(user_id):
+    """Principal for a user id, or None when the user no longer exists."""
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        row = db.session.query(User.id, User.username, User.role).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        principal_cache.put(user_id, principal)
+    return principal
+
+def invalidate_principal(user_id):
+    principal_cache.delete(user_id)
+
+def admin_required(fn):
+    """jwt_required() plus an admin role check against the cached principal."""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        principal = load_principal(int(get_jwt_identity()))
+        if principal is None or principal.role != 'admin':
+            return jsonify({'message': 'Admin access required'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
 
 # Authentication Routes
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     try:
         data = request.get_json()
@@ -143,8 +1111,7 @@ def login():
             
             # JWT identity must be a string
             access_token = create_access_token(identity=str(user.id))
-            print(f"Token created for user {user.id} (username: {user.username})")
-            print(f"Token (first 50 chars): {access_token[:50]}...")
+            logger.info('Login', extra={'user_id': user.id, 'username': user.username})
             return jsonify({
                 'access_token': access_token,
                 'user': {
@@ -158,21 +1125,12 @@ def login():
         
         return jsonify({'message': 'Invalid credentials'}), 401
     except Exception as e:
-        print(f"Login error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in login')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/auth/register', methods=['POST'])
-@jwt_required()
+@api.route('/api/auth/register', methods=['POST'])
+@admin_required
 def register():
-    # JWT identity is a string, convert to int for database lookup
-    current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
-    
-    if current_user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     data = request.get_json()
     role = data.get('role', 'user')
     
@@ -227,13 +1185,13 @@ def register():
     }), 201
 
 # User Management Routes
-@app.route('/api/users', methods=['GET'])
+@api.route('/api/users', methods=['GET'])
 @jwt_required()
 def get_users():
     try:
         # JWT identity is a string, convert to int for database lookup
         current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
+        current_user = load_principal(current_user_id)
         
         if not current_user:
             return jsonify({'message': 'User not found'}), 404
@@ -245,21 +1203,17 @@ def get_users():
             'email': u.email if u.role == 'admin' and not u.email.endswith('@nologin.local') else None,
             'full_name': u.full_name,
             'role': u.role,
-            'created_at': u.created_at.isoformat(),
+            'created_at': _utc(u.created_at).isoformat(),
             'vehicle_count': len(u.vehicles)
         } for u in users]), 200
     except Exception as e:
-        print(f"Error in get_users: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in get_users')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
     except Exception as e:
-        print(f"Error in get_users: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in get_users')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/users/<int:user_id>', methods=['GET'])
+@api.route('/api/users/<int:user_id>', methods=['GET'])
 @jwt_required()
 def get_user(user_id):
     user = User.query.get_or_404(user_id)
@@ -269,7 +1223,7 @@ def get_user(user_id):
         'email': user.email if user.role == 'admin' and not user.email.endswith('@nologin.local') else None,
         'full_name': user.full_name,
         'role': user.role,
-        'created_at': user.created_at.isoformat(),
+        'created_at': _utc(user.created_at).isoformat(),
         'vehicles': [{
             'id': v.id,
             'plate_number': v.plate_number,
@@ -277,12 +1231,12 @@ def get_user(user_id):
         } for v in user.vehicles]
     }), 200
 
-@app.route('/api/users/<int:user_id>', methods=['PUT'])
+@api.route('/api/users/<int:user_id>', methods=['PUT'])
 @jwt_required()
 def update_user(user_id):
     # JWT identity is a string, convert to int for database lookup
     current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
+    current_user = load_principal(current_user_id)
     
     user = User.query.get_or_404(user_id)
     data = request.get_json()
@@ -334,68 +1288,111 @@ def update_user(user_id):
         # For regular users, we don't update password (they don't use it)
     
     db.session.commit()
+    # Role changes take effect on the user's next request
+    invalidate_principal(user_id)
+    # Cached scan projections carry the owner's name
+    invalidate_user_vehicles(user_id)
     return jsonify({'message': 'User updated successfully'}), 200
 
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
-@jwt_required()
+@api.route('/api/users/<int:user_id>', methods=['DELETE'])
+@admin_required
 def delete_user(user_id):
-    # JWT identity is a string, convert to int for database lookup
-    current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
-    
-    if current_user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     user = User.query.get_or_404(user_id)
+    owned = [(vehicle.id, vehicle.plate_number) for vehicle in user.vehicles]
     db.session.delete(user)
     db.session.commit()
+    # Tokens issued to the deleted user stop working on their next request
+    invalidate_principal(user_id)
+    for vehicle_id, plate_number in owned:
+        invalidate_vehicle_cache(vehicle_id, plate_number)
     return jsonify({'message': 'User deleted successfully'}), 200
 
 # Vehicle Management Routes
-@app.route('/api/vehicles', methods=['GET'])
+# Fields selectable through ?fields= on the vehicle listing
+VEHICLE_FIELDS = {
+    'id': lambda v: v.id,
+    'plate_number': lambda v: v.plate_number,
+    'vehicle_type': lambda v: v.vehicle_type,
+    'make': lambda v: v.make,
+    'model': lambda v: v.model,
+    'color': lambda v: v.color,
+    'qr_code': lambda v: blob_url(v.qr_code),
+    'user_id': lambda v: v.user_id,
+    'owner_name': lambda v: v.owner.full_name,
+    'created_at': lambda v: _utc(v.created_at).isoformat(),
+    'images': lambda v: [serialize_vehicle_image(img) for img in v.images]
+}
+
+VEHICLE_PAGE_SIZE = 50
+VEHICLE_MAX_PAGE_SIZE = 500
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+@api.route('/api/vehicles', methods=['GET'])
 @jwt_required()
 def get_vehicles():
     try:
         # JWT identity is a string, convert to int for database lookup
         current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
+        current_user = load_principal(current_user_id)
         
         if not current_user:
             return jsonify({'message': 'User not found'}), 404
         
-        if current_user.role == 'admin':
-            vehicles = Vehicle.query.all()
-        else:
-            vehicles = Vehicle.query.filter_by(user_id=current_user_id).all()
+        fields = request.args.get('fields')
+        fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(VEHICLE_FIELDS)
+        unknown = [f for f in fields if f not in VEHICLE_FIELDS]
+        if unknown:
+            return jsonify({'message': f'Unknown fields: {", ".join(unknown)}'}), 400
+        if 'id' not in fields:
+            fields.insert(0, 'id')
         
-        return jsonify([{
-            'id': v.id,
-            'plate_number': v.plate_number,
-            'vehicle_type': v.vehicle_type,
-            'make': v.make,
-            'model': v.model,
-            'color': v.color,
-            'qr_code': v.qr_code,
-            'user_id': v.user_id,
-            'owner_name': v.owner.full_name,
-            'created_at': v.created_at.isoformat(),
-            'images': [{
-                'id': img.id,
-                'image_data': img.image_data
-            } for img in v.images]
-        } for v in vehicles]), 200
+        limit = min(max(request.args.get('limit', VEHICLE_PAGE_SIZE, type=int), 1), VEHICLE_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor', type=int)
+        plate = request.args.get('plate')
+        owner = request.args.get('owner')
+        vehicle_type = request.args.get('type')
+        
+        # Owners come back in the same statement; images only when asked for
+        query = Vehicle.query.join(Vehicle.owner).options(db.contains_eager(Vehicle.owner))
+        if 'qr_code' not in fields:
+            query = query.options(db.defer(Vehicle.qr_code))
+        if 'images' in fields:
+            query = query.options(db.selectinload(Vehicle.images))
+        
+        if current_user.role != 'admin':
+            query = query.filter(Vehicle.user_id == current_user_id)
+        
+        if plate:
+            query = query.filter(Vehicle.plate_number.ilike(f"{escape_like(plate)}%", escape='\\'))
+        if owner:
+            query = query.filter(User.full_name.ilike(f"%{escape_like(owner)}%", escape='\\'))
+        if vehicle_type:
+            query = query.filter(Vehicle.vehicle_type == vehicle_type)
+        
+        # Keyset pagination on the primary key: constant cost however deep the page
+        if cursor:
+            query = query.filter(Vehicle.id > cursor)
+        
+        vehicles = query.order_by(Vehicle.id).limit(limit + 1).all()
+        has_more = len(vehicles) > limit
+        vehicles = vehicles[:limit]
+        
+        return jsonify({
+            'vehicles': [{field: VEHICLE_FIELDS[field](v) for field in fields} for v in vehicles],
+            'next_cursor': vehicles[-1].id if has_more else None
+        }), 200
     except Exception as e:
-        print(f"Error in get_vehicles: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in get_vehicles')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/vehicles', methods=['POST'])
+@api.route('/api/vehicles', methods=['POST'])
 @jwt_required()
 def create_vehicle():
     # JWT identity is a string, convert to int for database lookup
     current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
+    current_user = load_principal(current_user_id)
     
     # Check if it's multipart/form-data (with images) or JSON
     if 'images' in request.files or request.content_type.startswith('multipart/form-data'):
@@ -425,47 +1422,32 @@ def create_vehicle():
     if Vehicle.query.filter_by(plate_number=plate_number).first():
         return jsonify({'message': 'Plate number already exists'}), 400
     
-    # Generate QR code data (using vehicle ID will be set after creation)
-    qr_data = f"VEHICLE:{plate_number}"
-    qr_code_image = generate_qr_code(qr_data)
-    
     vehicle = Vehicle(
         plate_number=plate_number,
         vehicle_type=vehicle_type,
         make=make,
         model=model,
         color=color,
-        qr_code=qr_code_image,
+        qr_code=pending_qr_code(plate_number),
         user_id=user_id
     )
     
     db.session.add(vehicle)
-    db.session.commit()
+    db.session.flush()
     
-    # Update QR code with actual vehicle ID
-    qr_data = f"VEHICLE:{vehicle.id}:{vehicle.plate_number}"
-    vehicle.qr_code = generate_qr_code(qr_data)
+    # QR code carries the vehicle ID, so it is rendered once the insert has assigned one
+    assign_qr_code(vehicle)
     
     # Process images if any
-    vehicle_images = []
-    for image in images:
-        if image and image.filename:
-            # Read and convert image to base64
-            image_data = image.read()
-            image_base64 = base64.b64encode(image_data).decode()
-            
-            # Create image record
-            vehicle_image = VehicleImage(
-                vehicle_id=vehicle.id,
-                image_data=f"data:{image.mimetype};base64,{image_base64}"
-            )
-            db.session.add(vehicle_image)
-            vehicle_images.append({
-                'id': vehicle_image.id,
-                'image_data': vehicle_image.image_data
-            })
+    vehicle_images = [
+        save_vehicle_image(vehicle.id, image)
+        for image in images
+        if image and image.filename
+    ]
     
     db.session.commit()
+    invalidate_vehicle_cache(vehicle.id, vehicle.plate_number)
+    queue_thumbnails([img.id for img in vehicle_images])
     
     return jsonify({
         'message': 'Vehicle created successfully',
@@ -476,20 +1458,22 @@ def create_vehicle():
             'make': vehicle.make,
             'model': vehicle.model,
             'color': vehicle.color,
-            'qr_code': vehicle.qr_code,
+            'qr_code': blob_url(vehicle.qr_code),
             'user_id': vehicle.user_id,
-            'images': vehicle_images
+            'images': [serialize_vehicle_image(img) for img in vehicle_images]
         }
     }), 201
 
-@app.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
+@api.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
 @jwt_required()
 def update_vehicle(vehicle_id):
     # JWT identity is a string, convert to int for database lookup
     current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
+    current_user = load_principal(current_user_id)
     
     vehicle = Vehicle.query.get_or_404(vehicle_id)
+    old_plate = vehicle.plate_number
+    new_images = []
     
     if current_user.role != 'admin' and vehicle.user_id != current_user_id:
         return jsonify({'message': 'Unauthorized'}), 403
@@ -503,8 +1487,7 @@ def update_vehicle(vehicle_id):
                 if Vehicle.query.filter_by(plate_number=new_plate).first():
                     return jsonify({'message': 'Plate number already exists'}), 400
                 vehicle.plate_number = new_plate
-                qr_data = f"VEHICLE:{vehicle.id}:{vehicle.plate_number}"
-                vehicle.qr_code = generate_qr_code(qr_data)
+                assign_qr_code(vehicle)
         
         if 'vehicle_type' in request.form:
             vehicle.vehicle_type = request.form.get('vehicle_type')
@@ -519,13 +1502,7 @@ def update_vehicle(vehicle_id):
         images = request.files.getlist('images')
         for image in images:
             if image and image.filename:
-                image_data = image.read()
-                image_base64 = base64.b64encode(image_data).decode()
-                vehicle_image = VehicleImage(
-                    vehicle_id=vehicle.id,
-                    image_data=f"data:{image.mimetype};base64,{image_base64}"
-                )
-                db.session.add(vehicle_image)
+                new_images.append(save_vehicle_image(vehicle.id, image))
         
         # Handle image deletions if provided
         if 'delete_images' in request.form:
@@ -542,8 +1519,7 @@ def update_vehicle(vehicle_id):
             if Vehicle.query.filter_by(plate_number=data['plate_number']).first():
                 return jsonify({'message': 'Plate number already exists'}), 400
             vehicle.plate_number = data['plate_number']
-            qr_data = f"VEHICLE:{vehicle.id}:{vehicle.plate_number}"
-            vehicle.qr_code = generate_qr_code(qr_data)
+            assign_qr_code(vehicle)
         
         if 'vehicle_type' in data:
             vehicle.vehicle_type = data['vehicle_type']
@@ -555,32 +1531,608 @@ def update_vehicle(vehicle_id):
             vehicle.color = data['color']
     
     db.session.commit()
+    invalidate_vehicle_cache(vehicle_id, old_plate, vehicle.plate_number)
+    queue_thumbnails([img.id for img in new_images])
     return jsonify({'message': 'Vehicle updated successfully'}), 200
 
-@app.route('/api/vehicles/<int:vehicle_id>', methods=['DELETE'])
+@api.route('/api/vehicles/<int:vehicle_id>', methods=['DELETE'])
 @jwt_required()
 def delete_vehicle(vehicle_id):
     # JWT identity is a string, convert to int for database lookup
     current_user_id = int(get_jwt_identity())
-    current_user = db.session.get(User, current_user_id)
+    current_user = load_principal(current_user_id)
     
     vehicle = Vehicle.query.get_or_404(vehicle_id)
     
     if current_user.role != 'admin' and vehicle.user_id != current_user_id:
         return jsonify({'message': 'Unauthorized'}), 403
     
+    plate_number = vehicle.plate_number
     db.session.delete(vehicle)
     db.session.commit()
+    invalidate_vehicle_cache(vehicle_id, plate_number)
     return jsonify({'message': 'Vehicle deleted successfully'}), 200
 
+# Bulk import of users and vehicles (POST /api/import, flask import-data)
+IMPORT_USER_FIELDS = ('username', 'full_name', 'role', 'email', 'password')
+IMPORT_VEHICLE_FIELDS = ('plate_number', 'vehicle_type', 'make', 'model', 'color', 'owner')
+IMPORT_BATCH_SIZE = 1000
+# Below this many vehicles, handing codes to worker processes costs more than rendering inline
+IMPORT_POOL_THRESHOLD = 200
+IMPORT_MAX_ERRORS = 100
+
+# Worker processes shared by the imports and QR sheet downloads of this process: at most
+# RENDER_MAX_JOBS of them render at once, the rest wait up to RENDER_WAIT seconds for a
+# turn and are then answered with 503
+render_pool = RenderPool(
+    workers=int(os.getenv('RENDER_WORKERS', '0')) or None,
+    max_jobs=int(os.getenv('RENDER_MAX_JOBS', '2'))
+)
+atexit.register(render_pool.shutdown)
+RENDER_WAIT = float(os.getenv('RENDER_WAIT', '30'))
+RENDER_BUSY_MESSAGE = 'QR rendering is busy with other requests, try again shortly'
+
+def read_import_records(stream, filename):
+    """Rows of a CSV file, or of a JSON file holding a list of objects, as dicts."""
+    text = stream.read()
+    if isinstance(text, bytes):
+        text = text.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError(f'{filename}: expected a JSON list of objects')
+        return records
+    return list(csv.DictReader(io.StringIO(text)))
+
+def clean_import_record(record, fields):
+    if not isinstance(record, dict):
+        record = {}
+    return {
+        field: str(record[field]).strip() if record.get(field) not in (None, '') else None
+        for field in fields
+    }
+
+def existing_values(column, values):
+    """Which of `values` already appear in `column`, in one IN query."""
+    if not values:
+        return set()
+    return {value for (value,) in db.session.query(column).filter(column.in_(list(values)))}
+
+def validate_import(users, vehicles):
+    """Check cleaned import rows against each other and the database with set-based queries.
+    
+    Returns (errors, owner_ids) where owner_ids maps already-existing owner usernames to ids.
+    """
+    errors = []
+    def error(kind, row, message):
+        errors.append({'kind': kind, 'row': row, 'message': message})
+    
+    usernames = {}
+    emails = {}
+    for row, user in enumerate(users, 1):
+        if not user['username'] or not user['full_name']:
+            error('user', row, 'username and full_name are required')
+            continue
+        role = user['role'] or 'user'
+        if role not in ('admin', 'user'):
+            error('user', row, f'Unknown role "{role}"')
+            continue
+        if role == 'admin' and (not user['email'] or not user['password']):
+            error('user', row, 'Email and password are required for admin users')
+            continue
+        if user['username'] in usernames:
+            error('user', row, f'Duplicate username "{user["username"]}" (row {usernames[user["username"]]})')
+            continue
+        usernames[user['username']] = row
+        # Regular users get the same placeholder address register() gives them
+        email = user['email'] if role == 'admin' else f"{user['username']}@nologin.local"
+        if email in emails:
+            error('user', row, f'Duplicate email "{email}" (row {emails[email]})')
+            continue
+        emails[email] = row
+    for username in existing_values(User.username, usernames):
+        error('user', usernames[username], f'Username "{username}" already exists')
+    for email in existing_values(User.email, emails):
+        error('user', emails[email], f'Email "{email}" already exists')
+    
+    plates = {}
+    owners = set()
+    for row, vehicle in enumerate(vehicles, 1):
+        if not vehicle['plate_number'] or not vehicle['vehicle_type'] or not vehicle['owner']:
+            error('vehicle', row, 'plate_number, vehicle_type and owner are required')
+            continue
+        if vehicle['plate_number'] in plates:
+            error('vehicle', row, f'Duplicate plate number "{vehicle["plate_number"]}" (row {plates[vehicle["plate_number"]]})')
+            continue
+        plates[vehicle['plate_number']] = row
+        owners.add(vehicle['owner'])
+    for plate_number in existing_values(Vehicle.plate_number, plates):
+        error('vehicle', plates[plate_number], f'Plate number "{plate_number}" already exists')
+    
+    owner_ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(owners - set(usernames)))) if owners else {}
+    for row, vehicle in enumerate(vehicles, 1):
+        owner = vehicle['owner']
+        if owner and owner not in usernames and owner not in owner_ids:
+            error('vehicle', row, f'Owner "{owner}" is not an existing or imported user')
+    
+    errors.sort(key=lambda e: (e['kind'] != 'user', e['row']))
+    return errors, owner_ids
+
+def import_records(users, vehicles, render=None, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and insert users and vehicles in one transaction.
+    
+    Returns ({'users_created', 'vehicles_created'}, None), or (None, errors) when any row is
+    invalid, in which case nothing is written. Vehicle QR codes render across the processes
+    of `render` (a RenderJob) from IMPORT_POOL_THRESHOLD vehicles on.
+    """
+    users = [clean_import_record(record, IMPORT_USER_FIELDS) for record in users]
+    vehicles = [clean_import_record(record, IMPORT_VEHICLE_FIELDS) for record in vehicles]
+    errors, owner_ids = validate_import(users, vehicles)
+    if errors:
+        return None, errors
+    
+    try:
+        # Regular users never log in, so one hash of a discarded random password serves them all
+        import secrets
+        placeholder_hash = generate_password_hash(secrets.token_urlsafe(32))
+        for start in range(0, len(users), batch_size):
+            rows = []
+            for user in users[start:start + batch_size]:
+                role = user['role'] or 'user'
+                rows.append(User(
+                    username=user['username'],
+                    email=user['email'] if role == 'admin' else f"{user['username']}@nologin.local",
+                    password_hash=generate_password_hash(user['password']) if role == 'admin' else placeholder_hash,
+                    full_name=user['full_name'],
+                    role=role
+                ))
+            db.session.add_all(rows)
+            db.session.flush()
+            owner_ids.update((row.username, row.id) for row in rows)
+        
+        pool = render.executor if render and len(vehicles) >= IMPORT_POOL_THRESHOLD else None
+        for start in range(0, len(vehicles), batch_size):
+            rows = [Vehicle(
+                plate_number=vehicle['plate_number'],
+                vehicle_type=vehicle['vehicle_type'],
+                make=vehicle['make'] or '',
+                model=vehicle['model'] or '',
+                color=vehicle['color'] or '',
+                qr_code=pending_qr_code(vehicle['plate_number']),
+                user_id=owner_ids[vehicle['owner']]
+            ) for vehicle in vehicles[start:start + batch_size]]
+            db.session.add_all(rows)
+            db.session.flush()
+            
+            pngs = render_qr_pngs([vehicle_qr_payload(row) for row in rows], pool)
+            for row, ref in zip(rows, store_blobs(pngs, 'image/png')):
+                row.qr_code = ref
+                row.qr_key_version = qr_signer.current_version
+            db.session.flush()
+        
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'users_created': len(users), 'vehicles_created': len(vehicles)}, None
+
+@api.cli.command('import-data')
+@click.option('--users', 'users_path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON file of users.')
+@click.option('--vehicles', 'vehicles_path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSON file of vehicles.')
+@click.option('--workers', type=int, default=None, help='QR rendering processes (default: CPU count).')
+def import_data_command(users_path, vehicles_path, workers):
+    """Bulk-create users and vehicles; vehicles name their owner by username."""
+    if not users_path and not vehicles_path:
+        raise click.UsageError('Pass --users and/or --vehicles')
+    records = {}
+    for kind, path in (('users', users_path), ('vehicles', vehicles_path)):
+        records[kind] = []
+        if path:
+            with open(path, encoding='utf-8-sig') as f:
+                records[kind] = read_import_records(f, path)
+    
+    started = time.monotonic()
+    render = RenderPool(workers)
+    try:
+        with render.acquire() as job:
+            result, errors = import_records(records['users'], records['vehicles'], render=job)
+    finally:
+        render.shutdown()
+    if errors:
+        for e in errors[:IMPORT_MAX_ERRORS]:
+            click.echo(f"{e['kind']} row {e['row']}: {e['message']}", err=True)
+        raise click.ClickException(f"Import rejected: {len(errors)} invalid rows, nothing was written")
+    click.echo(f"Imported {result['users_created']} users and {result['vehicles_created']} vehicles "
+               f"in {time.monotonic() - started:.1f}s")
+
+@api.route('/api/import', methods=['POST'])
+@admin_required
+def import_data():
+    """Bulk import from a JSON body {users, vehicles} or multipart 'users'/'vehicles' CSV or JSON files."""
+    try:
+        if request.files:
+            records = {
+                kind: read_import_records(request.files[kind], request.files[kind].filename or '')
+                if kind in request.files else []
+                for kind in ('users', 'vehicles')
+            }
+        else:
+            data = request.get_json(silent=True) or {}
+            records = {kind: data.get(kind) or [] for kind in ('users', 'vehicles')}
+            if not all(isinstance(value, list) for value in records.values()):
+                return jsonify({'message': 'users and vehicles must be lists'}), 400
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'message': f'Could not read import file: {str(e)}'}), 400
+    
+    if not records['users'] and not records['vehicles']:
+        return jsonify({'message': 'Nothing to import'}), 400
+    
+    job = None
+    if len(records['vehicles']) >= IMPORT_POOL_THRESHOLD:
+        job = render_pool.acquire(timeout=RENDER_WAIT)
+        if job is None:
+            return jsonify({'message': RENDER_BUSY_MESSAGE}), 503
+    try:
+        result, errors = import_records(records['users'], records['vehicles'], render=job)
+    except Exception as e:
+        logger.exception('Error in import_data')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+    finally:
+        if job:
+            job.release()
+    
+    if errors:
+        return jsonify({
+            'message': 'Import rejected, nothing was written',
+            'error_count': len(errors),
+            'errors': errors[:IMPORT_MAX_ERRORS]
+        }), 400
+    return jsonify({'message': 'Import completed', **result}), 201
+
+# Printable QR sticker sheets (GET/POST /api/vehicles/qr-sheet, flask qr-sheets)
+QR_SHEET_FORMATS = {'pdf': 'application/pdf', 'zip': 'application/zip'}
+QR_SHEET_BATCH_SIZE = 500
+
+def qr_sheet_items(query):
+    """(blob path, payload, plate, owner) per vehicle in plate order, read in keyset batches."""
+    last_plate = None
+    while True:
+        batch_query = query
+        if last_plate is not None:
+            batch_query = batch_query.filter(Vehicle.plate_number > last_plate)
+        rows = batch_query.order_by(Vehicle.plate_number).limit(QR_SHEET_BATCH_SIZE).all()
+        db.session.rollback()
+        if not rows:
+            return
+        for row in rows:
+            path = None
+            if row.qr_code.startswith(BLOB_REF_PREFIX):
+                path = blob_store.path_for(row.qr_code[len(BLOB_REF_PREFIX):])
+            yield path, vehicle_qr_payload(row), row.plate_number, row.owner_name
+        last_plate = rows[-1].plate_number
+
+def qr_sheet_stream(query, sheet_format, paper, render=None):
+    """Yield a PDF (or a zip of PNG pages) of QR sheets for the vehicles `query` selects.
+    
+    Pages render in the processes of `render` (a RenderJob), or inline without one, with a
+    bounded number in flight, so neither the vehicles nor the finished pages are ever all
+    in memory.
+    """
+    capacity = qr_sheets.page_capacity()
+    
+    def jobs():
+        items = []
+        for item in qr_sheet_items(query):
+            items.append(item)
+            if len(items) == capacity:
+                yield paper, items
+                items = []
+        if items:
+            yield paper, items
+    
+    render_page = qr_sheets.render_page_pdf if sheet_format == 'pdf' else qr_sheets.render_page_png
+    pool = render.executor if render else None
+    pages = qr_sheets.imap_bounded(pool, render_page, jobs(), window=render.pool.workers * 2 if pool else 1)
+    try:
+        if sheet_format == 'pdf':
+            yield from qr_sheets.stream_pdf(pages, paper)
+        else:
+            yield from qr_sheets.stream_png_zip(pages)
+    finally:
+        pages.close()
+
+def qr_sheet_query(current_user, vehicle_ids=None):
+    query = db.session.query(
+        Vehicle.id,
+        Vehicle.plate_number,
+        Vehicle.qr_code,
+        User.full_name.label('owner_name')
+    ).join(User, User.id == Vehicle.user_id)
+    if current_user is not None and current_user.role != 'admin':
+        query = query.filter(Vehicle.user_id == current_user.id)
+    if vehicle_ids:
+        query = query.filter(Vehicle.id.in_(vehicle_ids))
+    return query
+
+@api.cli.command('qr-sheets')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--plate', 'plates', multiple=True, help='Only this plate (repeatable). Default: every vehicle.')
+@click.option('--paper', type=click.Choice(sorted(qr_sheets.PAPER_SIZES)), default='a4', show_default=True)
+@click.option('--workers', type=int, default=None, help='Rendering processes (default: CPU count).')
+def qr_sheets_command(output, plates, paper, workers):
+    """Write printable QR sticker sheets to OUTPUT (.pdf, or .zip of PNG pages)."""
+    sheet_format = 'zip' if output.lower().endswith('.zip') else 'pdf'
+    query = qr_sheet_query(None)
+    if plates:
+        query = query.filter(Vehicle.plate_number.in_(plates))
+    started = time.monotonic()
+    render = RenderPool(workers)
+    try:
+        with render.acquire() as job, open(output, 'wb') as f:
+            for chunk in qr_sheet_stream(query, sheet_format, paper, job):
+                f.write(chunk)
+    finally:
+        render.shutdown()
+    click.echo(f"Wrote {output} in {time.monotonic() - started:.1f}s")
+
+@api.cli.command('reissue-qr-codes')
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_SIZE, show_default=True, help='Vehicles per commit.')
+@click.option('--workers', type=int, default=None, help='QR rendering processes (default: CPU count).')
+def reissue_qr_codes_command(batch_size, workers):
+    """Re-sign QR codes that are unsigned or use an older key version than the current one."""
+    stale = db.or_(Vehicle.qr_key_version.is_(None), Vehicle.qr_key_version != qr_signer.current_version)
+    started = time.monotonic()
+    reissued = 0
+    last_id = 0
+    render = RenderPool(workers)
+    try:
+        pool = render.acquire().executor
+        while True:
+            rows = Vehicle.query.filter(stale, Vehicle.id > last_id).order_by(Vehicle.id).limit(batch_size).all()
+            if not rows:
+                break
+            pngs = render_qr_pngs([vehicle_qr_payload(row) for row in rows], pool)
+            for row, ref in zip(rows, store_blobs(pngs, 'image/png')):
+                row.qr_code = ref
+                row.qr_key_version = qr_signer.current_version
+            db.session.commit()
+            last_id = rows[-1].id
+            reissued += len(rows)
+    finally:
+        render.shutdown()
+    click.echo(f"Reissued {reissued} QR codes with key version {qr_signer.current_version} "
+               f"in {time.monotonic() - started:.1f}s")
+    if reissued:
+        click.echo("Print the new stickers with: flask --app app qr-sheets stickers.pdf")
+
+@api.route('/api/vehicles/qr-sheet', methods=['GET', 'POST'])
+@jwt_required()
+def get_qr_sheet():
+    """Printable QR sheets for ?ids=1,2,3 (or a JSON body {ids: [...]}), or every visible vehicle."""
+    # JWT identity is a string, convert to int for database lookup
+    current_user_id = int(get_jwt_identity())
+    current_user = load_principal(current_user_id)
+    
+    if not current_user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    sheet_format = request.args.get('format', 'pdf')
+    paper = request.args.get('paper', 'a4')
+    if sheet_format not in QR_SHEET_FORMATS:
+        return jsonify({'message': f'Invalid format. Expected one of: {", ".join(QR_SHEET_FORMATS)}'}), 400
+    if paper not in qr_sheets.PAPER_SIZES:
+        return jsonify({'message': f'Invalid paper. Expected one of: {", ".join(qr_sheets.PAPER_SIZES)}'}), 400
+    
+    try:
+        if request.method == 'POST':
+            vehicle_ids = [int(v) for v in (request.get_json(silent=True) or {}).get('ids') or []]
+        else:
+            vehicle_ids = [int(v) for v in request.args.get('ids', '').split(',') if v.strip()]
+    except (TypeError, ValueError):
+        return jsonify({'message': 'ids must be vehicle ids'}), 400
+    
+    job = render_pool.acquire(timeout=RENDER_WAIT)
+    if job is None:
+        return jsonify({'message': RENDER_BUSY_MESSAGE}), 503
+    body = qr_sheet_stream(qr_sheet_query(current_user, vehicle_ids), sheet_format, paper, job)
+    filename = f"qr-sheets-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{sheet_format}"
+    response = Response(
+        stream_with_context(body),
+        mimetype=QR_SHEET_FORMATS[sheet_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # The slot is held until the download finishes or the client goes away
+    response.call_on_close(job.release)
+    return response
+
+# Live events for dashboards: new entries and stat deltas, pushed over /api/events. Under
+# gevent a stream costs no thread; under threaded workers each holds one, which
+# EVENT_MAX_SUBSCRIBERS (0: no limit) can cap per process. create_app() adds the relay
+# that carries events between workers.
+event_hub = EventHub(
+    buffer_size=int(os.getenv('EVENT_BUFFER_SIZE', '1000')),
+    heartbeat=float(os.getenv('EVENT_HEARTBEAT', '15')),
+    max_subscribers=int(os.getenv('EVENT_MAX_SUBSCRIBERS', '0'))
+)
+atexit.register(event_hub.close)
+metrics.gauge('event_subscribers', 'Open dashboard event streams.', lambda: event_hub.subscribers)
+
+def event_relay(app):
+    """Relay for EVENT_RELAY: 'postgres' (LISTEN/NOTIFY), 'socket' (Unix sockets in
+    EVENT_SOCKET_DIR, for workers on one host) or 'none'. The default follows the database.
+    Without Unix sockets (Windows) events stay in the process that published them."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    kind = os.getenv('EVENT_RELAY') or ('postgres' if uri.startswith('postgresql') else 'socket')
+    if kind == 'postgres':
+        return PostgresRelay(partial(relay_connection, app))
+    if kind == 'socket':
+        if hasattr(socket, 'AF_UNIX'):
+            return SocketRelay(os.getenv('EVENT_SOCKET_DIR') or os.path.join(app.instance_path, 'events'))
+        if os.getenv('EVENT_RELAY'):
+            logger.warning('EVENT_RELAY=socket needs Unix sockets; events stay in each process')
+    return None
+
+def relay_connection(app):
+    """A DBAPI connection of the app's database outside the pool, for the event relay."""
+    with app.app_context():
+        connection = db.engine.raw_connection()
+    driver_connection = connection.driver_connection
+    connection.detach()
+    return driver_connection
+
+def publish_entry_event(vehicle, entry_id, entry_type, timestamp, location, inside_delta=None):
+    """Announce a committed entry, and the stat changes it causes when `inside_delta` is given,
+    to the vehicle owner and admins."""
+    timestamp = _utc(timestamp)
+    event_hub.publish('entry', {
+        'id': entry_id,
+        'vehicle_id': vehicle['id'],
+        'plate_number': vehicle['plate_number'],
+        'vehicle_type': vehicle['vehicle_type'],
+        'owner_name': vehicle['owner_name'],
+        'entry_type': entry_type,
+        'timestamp': timestamp.isoformat(),
+        'location': location,
+        'notes': None
+    }, audience=vehicle['user_id'])
+    if inside_delta is None:
+        return
+    # Same definitions as /api/stats, so clients can add these to what it returned
+    event_hub.publish('stats', {
+        'total_entries': 1,
+        'entries_in': 1 if entry_type == 'in' else 0,
+        'entries_out': 1 if entry_type == 'out' else 0,
+        'today_entries': 1 if timestamp.date() == datetime.now(timezone.utc).date() else 0,
+        'vehicles_inside': inside_delta
+    }, audience=vehicle['user_id'])
+
+def presence_inside_delta(state_before, state_after):
+    return (state_after == 'in') - (state_before == 'in')
+
 # QR Code Scanning Route
-@app.route('/api/scan', methods=['POST'])
+def parse_client_timestamp(value):
+    """Parse a device ISO timestamp ('Z' or an offset; naive values are taken as UTC) into
+    an aware UTC datetime, the form every backend stores."""
+    return _utc(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+# Repeat reads of one sticker at one location within SCAN_DEBOUNCE_SECONDS (0 disables)
+# are answered with the first read's result
+scan_debouncer = ScanDebouncer(float(os.getenv('SCAN_DEBOUNCE_SECONDS', '5')))
+
+def lookup_scan_vehicle(qr_data):
+    """Resolve QR data to the scan projection of its vehicle.
+    
+    Returns (vehicle, None, None), or (None, message, status) for malformed or unknown codes.
+    """
+    if qr_signer.is_signed(qr_data):
+        # Forged, garbled or revoked-key codes are rejected here, before any database access
+        verified = qr_signer.verify(qr_data)
+        if not verified:
+            logger.info('QR signature check failed', extra={'qr_prefix': qr_data[:20]})
+            return None, 'Invalid or revoked QR code', 400
+        vehicle_id, plate_number, _ = verified
+        vehicle = load_scan_vehicle(vehicle_id=vehicle_id)
+        if not vehicle:
+            return None, 'Vehicle not found', 404
+        if vehicle['plate_number'] != plate_number:
+            # Sticker printed before a plate change; its replacement carries the new plate
+            return None, 'QR code is outdated. Please use the vehicle\'s current QR code', 400
+        return vehicle, None, None
+
+    if not QR_ACCEPT_LEGACY:
+        return None, 'Unsigned QR codes are no longer accepted. Please use the vehicle\'s current QR code', 400
+
+    # Check if it starts with VEHICLE:
+    if not qr_data.startswith('VEHICLE:'):
+        logger.info('Unrecognized QR format', extra={'qr_prefix': qr_data[:20]})
+        return None, f'Invalid QR code format. Expected format: VEHICLE:ID:PLATE or VEHICLE:PLATE. Received: {qr_data[:50]}', 400
+    
+    parts = qr_data.split(':')
+    
+    # Handle two formats:
+    # Format 1: VEHICLE:ID:PLATE (3 parts) - preferred format
+    # Format 2: VEHICLE:PLATE (2 parts) - fallback for old QR codes
+    if len(parts) >= 3:
+        # Format: VEHICLE:ID:PLATE
+        try:
+            vehicle_id = int(parts[1])
+        except ValueError:
+            return None, f'Invalid vehicle ID in QR code: {parts[1]}', 400
+        vehicle = load_scan_vehicle(vehicle_id=vehicle_id)
+    elif len(parts) == 2:
+        # Format: VEHICLE:PLATE - look up by plate number
+        plate_number = parts[1]
+        vehicle = load_scan_vehicle(plate_number=plate_number)
+        if not vehicle:
+            return None, f'Vehicle with plate number "{plate_number}" not found', 404
+    else:
+        return None, f'Invalid QR code format. Expected VEHICLE:ID:PLATE or VEHICLE:PLATE. Received: {qr_data}', 400
+    
+    if not vehicle:
+        return None, 'Vehicle not found', 404
+    return vehicle, None, None
+
+def claim_presence(vehicle_id, location, scan_timestamp, window):
+    """Take the vehicle's presence row for a scan at `location`, unless its latest entry was
+    recorded at the same location within `window` seconds of the scan.
+    
+    The conditional UPDATE is the scan's first write, so a concurrent scan of the vehicle
+    on any worker waits for it and then sees the entry this one records. Returns
+    (presence, repeated); presence is None for a vehicle that was never scanned.
+    """
+    taken = VehiclePresence.query.filter(
+        VehiclePresence.vehicle_id == vehicle_id,
+        db.or_(
+            VehiclePresence.last_location.is_(None),
+            VehiclePresence.last_location != location,
+            VehiclePresence.last_timestamp.is_(None),
+            VehiclePresence.last_timestamp <= scan_timestamp - timedelta(seconds=window),
+            VehiclePresence.last_timestamp >= scan_timestamp + timedelta(seconds=window)
+        )
+    ).update({VehiclePresence.state: VehiclePresence.state}, synchronize_session=False)
+    presence = db.session.get(VehiclePresence, vehicle_id)
+    return presence, presence is not None and not taken
+
+def scan_response(vehicle, entry_id, entry_type, timestamp, location, gate_command_data=None, warning_message=None):
+    response_data = {
+        'message': f'Vehicle {entry_type.upper()} recorded successfully',
+        'entry': {
+            'id': entry_id,
+            'vehicle_id': vehicle['id'],
+            'plate_number': vehicle['plate_number'],
+            'vehicle_type': vehicle['vehicle_type'],
+            'make': vehicle['make'],
+            'model': vehicle['model'],
+            'color': vehicle['color'],
+            'owner_name': vehicle['owner_name'],
+            'entry_type': entry_type,
+            # UTC with its offset, as /api/entries returns it
+            'timestamp': timestamp.isoformat(),
+            'location': location,
+            'vehicle_image': blob_url(vehicle['image_ref'])
+        }
+    }
+    if gate_command_data:
+        response_data['gate_command'] = gate_command_data
+    if warning_message:
+        response_data['warning'] = warning_message
+    return response_data
+
+def recorded_scan_response(vehicle, presence):
+    """scan_response for the entry `presence` points at, answering a repeat read of it."""
+    entry = db.session.get(EntryLog, presence.last_entry_id)
+    command = GateCommand.query.filter_by(entry_id=entry.id).order_by(GateCommand.id).first()
+    return scan_response(vehicle, entry.id, entry.entry_type, _utc(entry.timestamp), entry.location,
+                         serialize_gate_command(command) if command else None)
+
+@api.route('/api/scan', methods=['POST'])
 @jwt_required()
 def scan_qr_code():
+    debounce_key = debounce_token = None
     try:
-        current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
-        print(f"Scan request from user: {current_user.username if current_user else 'Unknown'} (ID: {current_user_id})")
         data = request.get_json()
         if not data:
             return jsonify({'message': 'No data provided'}), 400
@@ -595,252 +2147,750 @@ def scan_qr_code():
         # Use client's timestamp if provided, otherwise fall back to server time
         if client_timestamp:
             try:
-                # Parse the ISO timestamp from the client (includes timezone offset)
-                # Handle both 'Z' (UTC) notation and timezone offset notation
-                timestamp_str = client_timestamp.replace('Z', '+00:00')
-                scan_timestamp = datetime.fromisoformat(timestamp_str)
-                # If the timestamp doesn't have timezone info, assume it's UTC
-                if scan_timestamp.tzinfo is None:
-                    scan_timestamp = scan_timestamp.replace(tzinfo=timezone.utc)
-                print(f"Using client timestamp: {scan_timestamp} (from device: {client_timestamp})")
+                scan_timestamp = parse_client_timestamp(client_timestamp)
             except (ValueError, AttributeError) as e:
-                print(f"Error parsing client timestamp '{client_timestamp}': {e}, using server time instead")
+                logger.warning('Unparseable client timestamp, using server time',
+                               extra={'client_timestamp': str(client_timestamp)[:40], 'error': str(e)})
                 scan_timestamp = datetime.now(timezone.utc)
         else:
             # Fallback to server time if no timestamp provided (backward compatibility)
             scan_timestamp = datetime.now(timezone.utc)
-            print(f"No client timestamp provided, using server time: {scan_timestamp}")
-        
-        # Log the received QR data for debugging
-        print(f"Received QR data: {qr_data[:200]}...")  # Log first 200 chars
-        print(f"QR data length: {len(qr_data)}")
         
-        # Check if it starts with VEHICLE:
-        if not qr_data.startswith('VEHICLE:'):
-            print(f"ERROR: QR data does not start with 'VEHICLE:'. Actual start: {qr_data[:50]}")
-            return jsonify({
-                'message': f'Invalid QR code format. Expected format: VEHICLE:ID:PLATE or VEHICLE:PLATE. Received: {qr_data[:50]}'
-            }), 400
+        vehicle, error_message, error_status = lookup_scan_vehicle(qr_data)
+        if not vehicle:
+            SCANS.inc(location=location, result='rejected')
+            return jsonify({'message': error_message}), error_status
         
-        parts = qr_data.split(':')
-        vehicle = None
+        # A sticker read again within the window gets the first read's result: no new
+        # entry, no in/out flip and no second gate command. Repeats that reach this worker
+        # are answered from memory; claim_presence catches those recorded by another one
+        if scan_debouncer.enabled:
+            previous, debounce_token = scan_debouncer.claim((vehicle['id'], location))
+            if previous is not None:
+                SCANS.inc(location=location, result='duplicate')
+                logger.debug('Duplicate scan suppressed', extra={'vehicle_id': vehicle['id'], 'location': location})
+                return jsonify({**previous, 'duplicate': True}), 200
+            debounce_key = (vehicle['id'], location)
         
-        # Handle two formats:
-        # Format 1: VEHICLE:ID:PLATE (3 parts) - preferred format
-        # Format 2: VEHICLE:PLATE (2 parts) - fallback for old QR codes
-        if len(parts) >= 3:
-            # Format: VEHICLE:ID:PLATE
-            try:
-                vehicle_id = int(parts[1])
-                vehicle = db.session.get(Vehicle, vehicle_id)
-            except ValueError:
-                return jsonify({'message': f'Invalid vehicle ID in QR code: {parts[1]}'}), 400
-        elif len(parts) == 2:
-            # Format: VEHICLE:PLATE - look up by plate number
-            plate_number = parts[1]
-            vehicle = Vehicle.query.filter_by(plate_number=plate_number).first()
-            if not vehicle:
-                return jsonify({
-                    'message': f'Vehicle with plate number "{plate_number}" not found'
-                }), 404
+        # Current presence state for this vehicle (mirrors its latest EntryLog row)
+        if scan_debouncer.enabled:
+            presence, repeated = claim_presence(vehicle['id'], location, scan_timestamp, scan_debouncer.window)
+            if repeated:
+                response_data = recorded_scan_response(vehicle, presence)
+                db.session.rollback()
+                scan_debouncer.finish(debounce_key, debounce_token, response_data)
+                SCANS.inc(location=location, result='duplicate')
+                logger.debug('Duplicate scan suppressed', extra={'vehicle_id': vehicle['id'], 'location': location})
+                return jsonify({**response_data, 'duplicate': True}), 200
         else:
-            return jsonify({
-                'message': f'Invalid QR code format. Expected VEHICLE:ID:PLATE or VEHICLE:PLATE. Received: {qr_data}'
-            }), 400
-        
-        if not vehicle:
-            return jsonify({'message': 'Vehicle not found'}), 404
+            presence = db.session.get(VehiclePresence, vehicle['id'])
         
-        # Get the last entry for this vehicle
-        last_entry = EntryLog.query.filter_by(vehicle_id=vehicle.id).order_by(EntryLog.timestamp.desc()).first()
+        state_before = presence.state if presence else None
         
         # Determine entry type: if last entry was 'in', this is 'out', and vice versa
-        if last_entry and last_entry.entry_type == 'in':
+        if presence and presence.state == 'in':
             entry_type = 'out'
         else:
             entry_type = 'in'
         
         # Create new entry log using the device's timestamp
         entry = EntryLog(
-            vehicle_id=vehicle.id,
+            vehicle_id=vehicle['id'],
             entry_type=entry_type,
             location=location,
             timestamp=scan_timestamp
         )
         
         db.session.add(entry)
-        db.session.commit()
+        db.session.flush()
+        entry_id = entry.id
+        state_after = record_presence(vehicle['id'], entry).state
+        record_visit(vehicle['id'], entry)
 
-        # Control ESP32 gate automation
-        esp32_ip = os.getenv('ESP32_IP')
+        # Control ESP32 gate automation; the command row commits with the entry and
+        # is delivered in the background, so the scan never waits on the controller
+        gate_route = resolve_gate(location)
         warning_message = None
+        gate_command_data = None
+        gate_command_url = None
 
-        if esp32_ip:
-            try:
-                # Determine gate action based on entry type
-                gate_action = 'open' if entry_type == 'in' else 'close'
-                esp32_url = f"{esp32_ip}/{gate_action}"
-
-                print(f"Sending gate control request to ESP32: {esp32_url}")
-
-                # Send HTTP POST request to ESP32 with 5-second timeout
-                response = requests.post(esp32_url, timeout=5)
-
-                if response.status_code == 200:
-                    print(f"ESP32 gate {gate_action} command sent successfully")
-                else:
-                    print(f"ESP32 responded with status code: {response.status_code}")
-                    warning_message = f"Gate control failed (ESP32 responded with status {response.status_code})"
-
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to communicate with ESP32: {str(e)}")
-                warning_message = "Gate control unavailable (ESP32 unreachable)"
-            except Exception as e:
-                print(f"Unexpected error controlling gate: {str(e)}")
-                warning_message = f"Gate control error: {str(e)}"
+        if gate_route:
+            controller_id, base_url = gate_route
+            # Determine gate action based on entry type
+            gate_action = 'open' if entry_type == 'in' else 'close'
+            gate_command = GateCommand(
+                entry_id=entry_id,
+                action=gate_action,
+                url=f"{base_url}/{gate_action}"
+            )
+            # Known-down controllers fail fast instead of tying up a dispatch worker
+            if controller_id is not None and gate_health.is_down(controller_id):
+                gate_command.status = 'failed'
+                gate_command.last_error = 'Gate controller offline'
+                gate_command.completed_at = datetime.now(timezone.utc)
+                warning_message = f"Gate control unavailable (controller for {location} is offline)"
+            db.session.add(gate_command)
+            db.session.flush()
+            # Serialize before commit, which would expire the row and cost a reload
+            gate_command_data = serialize_gate_command(gate_command)
+            gate_command_url = gate_command.url
         else:
-            print("ESP32_IP not configured - gate control disabled")
+            logger.debug('No gate controller for location', extra={'location': location})
             warning_message = "Gate control not configured"
 
-        vehicle_image = VehicleImage.query.filter_by(vehicle_id=vehicle.id).first()
-
-        response_data = {
-            'message': f'Vehicle {entry_type.upper()} recorded successfully',
-            'entry': {
-                'id': entry.id,
-                'vehicle_id': vehicle.id,
-                'plate_number': vehicle.plate_number,
-                'vehicle_type': vehicle.vehicle_type,
-                'make': vehicle.make,
-                'model': vehicle.model,
-                'color': vehicle.color,
-                'owner_name': vehicle.owner.full_name,
-                'entry_type': entry_type,
-                'timestamp': entry.timestamp.isoformat(),
-                'location': entry.location,
-                'vehicle_image': vehicle_image.image_data if vehicle_image else None
-            }
-        }
+        db.session.commit()
+
+        if gate_command_data and gate_command_data['status'] == 'pending':
+            gate_dispatcher.submit(gate_command_data['id'], gate_command_url)
+        
+        SCANS.inc(location=location, result=entry_type)
+        logger.info('Scan recorded', extra={'vehicle_id': vehicle['id'], 'entry_type': entry_type, 'location': location})
+        try:
+            publish_entry_event(vehicle, entry_id, entry_type, scan_timestamp, location,
+                                presence_inside_delta(state_before, state_after))
+        except Exception:
+            # The entry is committed: a failed dashboard push must not make the device retry it
+            logger.exception('Could not publish entry event', extra={'entry_id': entry_id})
 
-        if warning_message:
-            response_data['warning'] = warning_message
+        response_data = scan_response(vehicle, entry_id, entry_type, scan_timestamp, location,
+                                      gate_command_data, warning_message)
 
+        if debounce_key:
+            scan_debouncer.finish(debounce_key, debounce_token, response_data)
         return jsonify(response_data), 200
         
     except Exception as e:
-        print(f"Error in scan_qr_code: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        if debounce_key:
+            scan_debouncer.release(debounce_key, debounce_token)
+        logger.exception('Error in scan_qr_code')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+
+SCAN_BATCH_MAX = 1000
+
+def replay_vehicle_scans(vehicle_id, queued, presence):
+    """Insert one vehicle's queued scans, toggling in/out in timestamp order.
+    
+    `queued` holds (timestamp, index, location, client_scan_id) tuples. Each scan takes the
+    opposite type of the entry just before it. When the batch reaches back before entries
+    recorded since, those keep their type (they drove the gate and were reported), and
+    scans after them toggle from it. Returns [(index, client_scan_id, entry)].
+    """
+    queued.sort(key=lambda item: (item[0], item[1]))
+    first_timestamp = queued[0][0]
+    later = []
+    if presence is None or presence.last_timestamp is None or _utc(presence.last_timestamp) <= first_timestamp:
+        state = presence.state if presence else None
+    else:
+        previous = EntryLog.query.filter(
+            EntryLog.vehicle_id == vehicle_id,
+            EntryLog.timestamp <= first_timestamp
+        ).order_by(EntryLog.timestamp.desc(), EntryLog.id.desc()).first()
+        state = previous.entry_type if previous else None
+        later = EntryLog.query.filter(
+            EntryLog.vehicle_id == vehicle_id,
+            EntryLog.timestamp > first_timestamp
+        ).order_by(EntryLog.timestamp, EntryLog.id).all()
+    
+    # Recorded entries sort before queued scans with the same timestamp
+    timeline = [(_utc(row.timestamp), 0, row.id, row) for row in later]
+    timeline += [(item[0], 1, item[1], item) for item in queued]
+    timeline.sort(key=lambda item: item[:3])
+    
+    inserted = []
+    for _, kind, _, item in timeline:
+        if kind == 0:
+            state = item.entry_type
+            continue
+        state = 'out' if state == 'in' else 'in'
+        scan_timestamp, index, location, client_scan_id = item
+        entry = EntryLog(vehicle_id=vehicle_id, entry_type=state, location=location, timestamp=scan_timestamp)
+        db.session.add(entry)
+        inserted.append((index, client_scan_id, entry))
+    return inserted
+
+@api.route('/api/scan/batch', methods=['POST'])
+@jwt_required()
+def scan_batch():
+    """Record scans queued by a device while it was offline, in one transaction.
+    
+    Each scan carries a client_scan_id; IDs already recorded come back as duplicates, so a
+    device can resend a batch until it gets an answer. Replayed passes don't drive the gate.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json()
+        scans = data.get('scans') if isinstance(data, dict) else None
+        if not isinstance(scans, list) or not scans:
+            return jsonify({'message': 'scans must be a non-empty list'}), 400
+        if len(scans) > SCAN_BATCH_MAX:
+            return jsonify({'message': f'At most {SCAN_BATCH_MAX} scans per batch'}), 400
+        logger.info('Batch scan', extra={'user_id': current_user_id, 'scans': len(scans)})
+        
+        scan_ids = [scan.get('client_scan_id') if isinstance(scan, dict) else None for scan in scans]
+        wanted = {scan_id for scan_id in scan_ids if isinstance(scan_id, str)}
+        known = {}
+        entry_types = {}
+        if wanted:
+            known = dict(db.session.query(ScanReceipt.client_scan_id, ScanReceipt.entry_id)
+                         .filter(ScanReceipt.client_scan_id.in_(wanted)))
+        if known:
+            entry_types = dict(db.session.query(EntryLog.id, EntryLog.entry_type)
+                               .filter(EntryLog.id.in_(set(known.values()))))
+            archived = set(known.values()) - set(entry_types)
+            if archived:
+                Entry = entry_log_source()
+                entry_types.update(db.session.query(Entry.id, Entry.entry_type).filter(Entry.id.in_(archived)))
+        
+        results = [None] * len(scans)
+        vehicles = {}
+        first_seen = {}
+        repeats = []
+        pending = {}
+        for index, scan in enumerate(scans):
+            scan_id = scan_ids[index]
+            if not isinstance(scan_id, str) or not scan_id or len(scan_id) > 64:
+                results[index] = {'client_scan_id': scan_id, 'status': 'error',
+                                  'message': 'client_scan_id is required (at most 64 characters)'}
+                continue
+            if scan_id in known:
+                results[index] = {'client_scan_id': scan_id, 'status': 'duplicate',
+                                  'entry_id': known[scan_id], 'entry_type': entry_types.get(known[scan_id])}
+                continue
+            if scan_id in first_seen:
+                repeats.append((index, first_seen[scan_id]))
+                continue
+            first_seen[scan_id] = index
+            
+            qr_data = scan.get('qr_data')
+            if not isinstance(qr_data, str) or not qr_data:
+                results[index] = {'client_scan_id': scan_id, 'status': 'error', 'message': 'QR code data is required'}
+                continue
+            try:
+                scan_timestamp = parse_client_timestamp(scan.get('timestamp'))
+            except (ValueError, AttributeError):
+                # Server time would be wrong for a replayed scan, so the device's time is required
+                results[index] = {'client_scan_id': scan_id, 'status': 'error', 'message': 'Invalid or missing timestamp'}
+                continue
+            vehicle, error_message, _ = lookup_scan_vehicle(qr_data)
+            if not vehicle:
+                results[index] = {'client_scan_id': scan_id, 'status': 'error', 'message': error_message}
+                continue
+            
+            location = scan.get('location', 'Main Gate')
+            vehicles[vehicle['id']] = vehicle
+            results[index] = {'client_scan_id': scan_id, 'status': 'recorded', 'vehicle_id': vehicle['id'],
+                              'plate_number': vehicle['plate_number'], 'timestamp': scan_timestamp.isoformat(),
+                              'location': location}
+            pending.setdefault(vehicle['id'], []).append((scan_timestamp, index, location, scan_id))
+        
+        presences = {presence.vehicle_id: presence for presence in
+                     VehiclePresence.query.filter(VehiclePresence.vehicle_id.in_(list(pending)))} if pending else {}
+        inserted = []
+        last_entries = {}
+        for vehicle_id, queued in pending.items():
+            inserted.extend(replay_vehicle_scans(vehicle_id, queued, presences.get(vehicle_id)))
+        
+        # One flush inserts every entry; presence and receipts need their ids
+        db.session.flush()
+        for index, scan_id, entry in inserted:
+            db.session.add(ScanReceipt(client_scan_id=scan_id, entry_id=entry.id))
+            results[index]['entry_id'] = entry.id
+            results[index]['entry_type'] = entry.entry_type
+            latest = last_entries.get(entry.vehicle_id)
+            if latest is None or (_utc(entry.timestamp), entry.id) > (_utc(latest.timestamp), latest.id):
+                last_entries[entry.vehicle_id] = entry
+        for vehicle_id, entry in last_entries.items():
+            record_presence(vehicle_id, entry)
+        # Replays can land between recorded entries and close or split their visits, so
+        # the affected stretch of each vehicle's visits is derived again
+        for vehicle_id, queued in pending.items():
+            resync_vehicle_visits(vehicle_id, min(item[0] for item in queued))
+        
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request recorded some of these scan IDs first; a retry reports them as duplicates
+            db.session.rollback()
+            return jsonify({'message': 'Some scans were recorded concurrently, retry the batch'}), 409
+        
+        for index, _, _ in inserted:
+            SCANS.inc(location=results[index]['location'], result='replayed')
+        try:
+            for index, _, _ in inserted:
+                result = results[index]
+                publish_entry_event(vehicles[result['vehicle_id']], result['entry_id'], result['entry_type'],
+                                    datetime.fromisoformat(result['timestamp']), result['location'])
+            if inserted:
+                # Replays land in the past, so clients reload /api/stats instead of applying deltas
+                event_hub.publish('resync', {})
+        except Exception:
+            # The batch is committed: a failed dashboard push must not make the device resend it
+            logger.exception('Could not publish replayed entry events', extra={'entries': len(inserted)})
+        
+        for index, first_index in repeats:
+            results[index] = dict(results[first_index])
+            if results[index]['status'] == 'recorded':
+                results[index]['status'] = 'duplicate'
+        
+        statuses = [result['status'] for result in results]
+        return jsonify({
+            'recorded': statuses.count('recorded'),
+            'duplicates': statuses.count('duplicate'),
+            'errors': statuses.count('error'),
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Error in scan_batch')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
+# Gate Controller Routes
+@api.route('/api/gates', methods=['GET'])
+@jwt_required()
+def get_gates():
+    gate_health.start()
+    controllers = GateController.query.order_by(GateController.location).all()
+    return jsonify([serialize_gate_controller(c) for c in controllers]), 200
+
+@api.route('/api/gates', methods=['POST'])
+@admin_required
+def create_gate():
+    data = request.get_json() or {}
+    name = data.get('name')
+    location = data.get('location')
+    base_url = (data.get('base_url') or '').rstrip('/')
+    
+    if not name or not location or not base_url:
+        return jsonify({'message': 'Name, location and base_url are required'}), 400
+    if not base_url.startswith(('http://', 'https://')):
+        return jsonify({'message': 'base_url must start with http:// or https://'}), 400
+    if GateController.query.filter_by(location=location).first():
+        return jsonify({'message': 'A gate controller is already registered for this location'}), 400
+    
+    controller = GateController(
+        name=name,
+        location=location,
+        base_url=base_url,
+        enabled=data.get('enabled', True)
+    )
+    db.session.add(controller)
+    db.session.commit()
+    invalidate_gate_routes()
+    
+    return jsonify({
+        'message': 'Gate controller created successfully',
+        'gate': serialize_gate_controller(controller)
+    }), 201
+
+@api.route('/api/gates/<int:gate_id>', methods=['PUT'])
+@admin_required
+def update_gate(gate_id):
+    controller = GateController.query.get_or_404(gate_id)
+    data = request.get_json() or {}
+    
+    if 'location' in data and data['location'] != controller.location:
+        if GateController.query.filter_by(location=data['location']).first():
+            return jsonify({'message': 'A gate controller is already registered for this location'}), 400
+        controller.location = data['location']
+    if 'base_url' in data:
+        base_url = (data['base_url'] or '').rstrip('/')
+        if not base_url.startswith(('http://', 'https://')):
+            return jsonify({'message': 'base_url must start with http:// or https://'}), 400
+        controller.base_url = base_url
+        gate_health.forget(controller.id)
+    if 'name' in data:
+        controller.name = data['name']
+    if 'enabled' in data:
+        controller.enabled = bool(data['enabled'])
+    
+    db.session.commit()
+    invalidate_gate_routes()
+    return jsonify({'message': 'Gate controller updated successfully'}), 200
+
+@api.route('/api/gates/<int:gate_id>', methods=['DELETE'])
+@admin_required
+def delete_gate(gate_id):
+    controller = GateController.query.get_or_404(gate_id)
+    db.session.delete(controller)
+    db.session.commit()
+    gate_health.forget(gate_id)
+    invalidate_gate_routes()
+    return jsonify({'message': 'Gate controller deleted successfully'}), 200
+
+# EventSource can't set headers, so /api/events also takes ?token= from /api/events/token.
+# URLs end up in access logs, so that token only opens event streams (it is no bearer
+# token) and expires after EVENT_TOKEN_TTL seconds; an open stream outlives it.
+EVENT_TOKEN_TTL = int(os.getenv('EVENT_TOKEN_TTL', '60'))
+
+def event_token_serializer():
+    return URLSafeTimedSerializer(current_app.config['JWT_SECRET_KEY'], salt='event-stream')
+
+@api.route('/api/events/token', methods=['POST'])
+@jwt_required()
+def issue_event_token():
+    token = event_token_serializer().dumps(int(get_jwt_identity()))
+    return jsonify({'token': token, 'expires_in': EVENT_TOKEN_TTL}), 200
+
+@api.route('/api/events', methods=['GET'])
+def stream_events():
+    token = request.args.get('token')
+    if token:
+        try:
+            current_user_id = event_token_serializer().loads(token, max_age=EVENT_TOKEN_TTL)
+        except BadSignature:
+            return jsonify({'message': 'Event stream token is invalid or expired'}), 401
+    else:
+        verify_jwt_in_request()
+        # JWT identity is a string, convert to int for database lookup
+        current_user_id = int(get_jwt_identity())
+    current_user = load_principal(current_user_id)
+    
+    if not current_user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    is_admin = current_user.role == 'admin'
+    
+    # Audience is the owning user's id; None goes to everyone
+    def can_see(audience):
+        return is_admin or audience is None or audience == current_user_id
+    
+    try:
+        stream = event_hub.subscribe(can_see, request.headers.get('Last-Event-ID'))
+    except SubscriberLimitReached:
+        # EVENT_MAX_SUBSCRIBERS keeps threaded workers from spending every thread on streams
+        response = jsonify({'message': 'Too many open event streams, retry later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    # Not wrapped in stream_with_context: the database session is released when this returns
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api.route('/api/gate-commands/<int:command_id>', methods=['GET'])
+@jwt_required()
+def get_gate_command(command_id):
+    command = GateCommand.query.get_or_404(command_id)
+    return jsonify(serialize_gate_command(command)), 200
+
+# Blob Serving Route
+# Not behind jwt_required: <img> tags cannot send the Authorization header, and the
+# SHA-256 in the URL is unguessable without already holding a reference to the blob.
+@api.route('/api/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    if not BlobStore.is_digest(digest):
+        return jsonify({'message': 'Blob not found'}), 404
+    
+    blob = db.session.get(Blob, digest)
+    if not blob or not blob_store.exists(digest):
+        return jsonify({'message': 'Blob not found'}), 404
+    
+    # Content never changes for a given digest, so browsers may cache it forever
+    response = send_file(
+        blob_store.path_for(digest),
+        mimetype=blob.content_type,
+        etag=digest,
+        conditional=True,
+        max_age=31536000
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 # Test endpoint to verify token
-@app.route('/api/test-token', methods=['GET'])
+@api.route('/api/test-token', methods=['GET'])
 @jwt_required()
 def test_token():
     try:
         # JWT identity is a string, convert to int for database lookup
         current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
+        current_user = load_principal(current_user_id)
         return jsonify({
             'message': 'Token is valid',
             'user_id': current_user_id,
             'username': current_user.username if current_user else None
         }), 200
     except Exception as e:
-        print(f"Test token error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in test_token')
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # Entry Log Routes
-@app.route('/api/entries', methods=['GET'])
+ENTRY_COUNT_MODES = ('exact', 'approx', 'none')
+# count=approx counts at most this many rows and reports the total as a lower bound
+ENTRY_APPROX_COUNT_CAP = 10000
+
+def encode_entry_cursor(timestamp, entry_id):
+    raw = json.dumps([_utc(timestamp).isoformat(), entry_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_entry_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    timestamp, entry_id = json.loads(raw)
+    return _utc(datetime.fromisoformat(timestamp)), int(entry_id)
+
+def entry_rows_query(Entry, current_user, entry_type=None, vehicle_id=None, location=None, start=None, end=None):
+    """Entry rows joined with plate, vehicle type and owner name in one statement."""
+    query = db.session.query(
+        Entry.id,
+        Entry.vehicle_id,
+        Entry.entry_type,
+        Entry.timestamp,
+        Entry.location,
+        Entry.notes,
+        Vehicle.plate_number,
+        Vehicle.vehicle_type,
+        User.full_name.label('owner_name')
+    ).select_from(Entry).join(Vehicle, Vehicle.id == Entry.vehicle_id).join(User, User.id == Vehicle.user_id)
+    
+    if current_user.role != 'admin':
+        # Regular users can only see their own vehicle entries
+        query = query.filter(Vehicle.user_id == current_user.id)
+    if entry_type:
+        query = query.filter(Entry.entry_type == entry_type)
+    if vehicle_id:
+        query = query.filter(Entry.vehicle_id == vehicle_id)
+    if location:
+        query = query.filter(Entry.location == location)
+    if start:
+        query = query.filter(Entry.timestamp >= start)
+    if end:
+        query = query.filter(Entry.timestamp < end)
+    return query
+
+@api.route('/api/entries', methods=['GET'])
 @jwt_required()
 def get_entries():
     try:
         # JWT identity is a string, convert to int for database lookup
         current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
+        current_user = load_principal(current_user_id)
         
         if not current_user:
             return jsonify({'message': 'User not found'}), 404
         
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 50, type=int), 1)
         entry_type = request.args.get('type')  # 'in' or 'out'
         vehicle_id = request.args.get('vehicle_id', type=int)
+        location = request.args.get('location')
         
-        query = EntryLog.query
+        # Passing cursor (empty for the first page) switches to keyset pagination
+        keyset = 'cursor' in request.args
+        count_mode = request.args.get('count', 'none' if keyset else 'exact')
+        if count_mode not in ENTRY_COUNT_MODES:
+            return jsonify({'message': f'Invalid count. Expected one of: {", ".join(ENTRY_COUNT_MODES)}'}), 400
         
-        if current_user.role != 'admin':
-            # Regular users can only see their own vehicle entries
-            user_vehicles = [v.id for v in Vehicle.query.filter_by(user_id=current_user_id).all()]
-            query = query.filter(EntryLog.vehicle_id.in_(user_vehicles))
+        try:
+            start = parse_range_param(request.args.get('start'))
+            end = parse_range_param(request.args.get('end'), end=True)
+        except ValueError:
+            return jsonify({'message': 'Invalid start or end date. Use YYYY-MM-DD or ISO 8601'}), 400
         
-        if entry_type:
-            query = query.filter_by(entry_type=entry_type)
+        # Hot table plus any archived months the range reaches into
+        Entry = entry_log_source(start, end)
         
-        if vehicle_id:
-            query = query.filter_by(vehicle_id=vehicle_id)
+        # Vehicle and owner come from the same statement instead of lazy loads per row
+        query = entry_rows_query(Entry, current_user, entry_type, vehicle_id, location, start, end)
         
-        entries = query.order_by(EntryLog.timestamp.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        total = None
+        total_capped = False
+        if count_mode == 'exact':
+            total = query.order_by(None).count()
+        elif count_mode == 'approx':
+            capped = query.order_by(None).limit(ENTRY_APPROX_COUNT_CAP + 1).subquery()
+            total = db.session.query(db.func.count()).select_from(capped).scalar()
+            total_capped = total > ENTRY_APPROX_COUNT_CAP
+            total = min(total, ENTRY_APPROX_COUNT_CAP)
         
-        return jsonify({
+        query = query.order_by(Entry.timestamp.desc(), Entry.id.desc())
+        
+        if keyset:
+            cursor = request.args.get('cursor')
+            if cursor:
+                try:
+                    cursor_timestamp, cursor_id = decode_entry_cursor(cursor)
+                except (ValueError, TypeError):
+                    return jsonify({'message': 'Invalid cursor'}), 400
+                # Seek past the last row of the previous page: constant cost at any depth
+                query = query.filter(db.tuple_(Entry.timestamp, Entry.id) < (cursor_timestamp, cursor_id))
+            rows = query.limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+        else:
+            rows = query.limit(per_page).offset((page - 1) * per_page).all()
+        
+        response = {
             'entries': [{
-                'id': e.id,
-                'vehicle_id': e.vehicle_id,
-                'plate_number': e.vehicle.plate_number,
-                'vehicle_type': e.vehicle.vehicle_type,
-                'owner_name': e.vehicle.owner.full_name,
-                'entry_type': e.entry_type,
-                'timestamp': e.timestamp.isoformat(),
-                'location': e.location,
-                'notes': e.notes
-            } for e in entries.items],
-            'total': entries.total,
-            'pages': entries.pages,
-            'current_page': page
-        }), 200
+                'id': row.id,
+                'vehicle_id': row.vehicle_id,
+                'plate_number': row.plate_number,
+                'vehicle_type': row.vehicle_type,
+                'owner_name': row.owner_name,
+                'entry_type': row.entry_type,
+                'timestamp': _utc(row.timestamp).isoformat(),
+                'location': row.location,
+                'notes': row.notes
+            } for row in rows],
+            'total': total
+        }
+        if total_capped:
+            response['total_capped'] = True
+        
+        if keyset:
+            response['next_cursor'] = encode_entry_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None
+        else:
+            response['pages'] = -(-total // per_page) if total is not None else None
+            response['current_page'] = page
+        
+        return jsonify(response), 200
     except Exception as e:
-        print(f"Error in get_entries: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in get_entries')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
-@app.route('/api/stats', methods=['GET'])
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_COLUMNS = ('id', 'timestamp', 'entry_type', 'location', 'vehicle_id', 'plate_number',
+                  'vehicle_type', 'owner_name', 'notes')
+EXPORT_BATCH_SIZE = 1000
+
+@api.route('/api/entries/export', methods=['GET'])
+@jwt_required()
+def export_entries():
+    # JWT identity is a string, convert to int for database lookup
+    current_user_id = int(get_jwt_identity())
+    current_user = load_principal(current_user_id)
+    
+    if not current_user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'message': f'Invalid format. Expected one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    try:
+        start = parse_range_param(request.args.get('start'))
+        end = parse_range_param(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({'message': 'Invalid start or end date. Use YYYY-MM-DD or ISO 8601'}), 400
+    
+    Entry = entry_log_source(start, end)
+    query = entry_rows_query(
+        Entry, current_user,
+        entry_type=request.args.get('type'),
+        vehicle_id=request.args.get('vehicle_id', type=int),
+        location=request.args.get('location'),
+        start=start,
+        end=end
+    ).order_by(Entry.timestamp, Entry.id)
+    
+    def export_rows():
+        # Keyset batches rather than one long cursor: each batch is a short read, so the
+        # export never holds a SQLite read transaction that would stall scan commits
+        last = None
+        while True:
+            batch_query = query
+            if last:
+                batch_query = batch_query.filter(db.tuple_(Entry.timestamp, Entry.id) > last)
+            rows = batch_query.limit(EXPORT_BATCH_SIZE).all()
+            db.session.rollback()
+            if not rows:
+                return
+            yield rows
+            last = (rows[-1].timestamp, rows[-1].id)
+    
+    def row_values(row):
+        values = row._asdict()
+        values['timestamp'] = _utc(row.timestamp).isoformat()
+        return [values[column] for column in EXPORT_COLUMNS]
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in export_rows():
+            writer.writerows(row_values(row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    
+    def generate_ndjson():
+        for rows in export_rows():
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row_values(row)))) + '\n' for row in rows)
+    
+    filename = f"entries-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Let proxies pass chunks through instead of buffering the whole export
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@api.route('/api/stats', methods=['GET'])
 @jwt_required()
 def get_stats():
     try:
         # JWT identity is a string, convert to int for database lookup
         current_user_id = int(get_jwt_identity())
-        current_user = db.session.get(User, current_user_id)
+        current_user = load_principal(current_user_id)
         
         if not current_user:
             return jsonify({'message': 'User not found'}), 404
         
         query = EntryLog.query
+        # Admins see everything, so archived months come from the catalog's counters;
+        # per-user totals have to look inside the archive tables
+        Entry = EntryLog if current_user.role == 'admin' else entry_log_source()
+        totals_query = db.session.query(Entry)
         if current_user.role != 'admin':
-            user_vehicles = [v.id for v in Vehicle.query.filter_by(user_id=current_user_id).all()]
+            user_vehicles = db.select(Vehicle.id).filter(Vehicle.user_id == current_user_id)
             query = query.filter(EntryLog.vehicle_id.in_(user_vehicles))
+            totals_query = totals_query.filter(Entry.vehicle_id.in_(user_vehicles))
+        
+        # One pass over the (timestamp, entry_type) index for all three totals
+        totals = totals_query.with_entities(
+            db.func.count(Entry.id),
+            count_where(Entry.entry_type == 'in'),
+            count_where(Entry.entry_type == 'out')
+        ).one()
+        total_entries = totals[0]
+        entries_in = totals[1] or 0
+        entries_out = totals[2] or 0
         
-        total_entries = query.count()
-        entries_in = query.filter_by(entry_type='in').count()
-        entries_out = query.filter_by(entry_type='out').count()
+        if current_user.role == 'admin':
+            archived = db.session.query(
+                db.func.sum(EntryLogArchive.row_count),
+                db.func.sum(EntryLogArchive.in_count),
+                db.func.sum(EntryLogArchive.out_count)
+            ).one()
+            total_entries += archived[0] or 0
+            entries_in += archived[1] or 0
+            entries_out += archived[2] or 0
         
-        # Get today's entries
-        today = datetime.now(timezone.utc).date()
+        # Get today's entries as a half-open range so the timestamp index applies
+        today_start = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time(), timezone.utc)
         today_entries = query.filter(
-            db.func.date(EntryLog.timestamp) == today
+            EntryLog.timestamp >= today_start,
+            EntryLog.timestamp < today_start + timedelta(days=1)
         ).count()
         
         # Get vehicles currently inside (last entry was 'in')
-        all_vehicles = Vehicle.query.all() if current_user.role == 'admin' else Vehicle.query.filter_by(user_id=current_user_id).all()
-        vehicles_inside = 0
-        for vehicle in all_vehicles:
-            last_entry = EntryLog.query.filter_by(vehicle_id=vehicle.id).order_by(EntryLog.timestamp.desc()).first()
-            if last_entry and last_entry.entry_type == 'in':
-                vehicles_inside += 1
+        vehicle_query = Vehicle.query
+        inside_query = VehiclePresence.query.filter_by(state='in')
+        if current_user.role != 'admin':
+            vehicle_query = vehicle_query.filter_by(user_id=current_user_id)
+            inside_query = inside_query.join(Vehicle).filter(Vehicle.user_id == current_user_id)
+        vehicles_inside = inside_query.count()
         
         return jsonify({
             'total_entries': total_entries,
@@ -848,16 +2898,342 @@ def get_stats():
             'entries_out': entries_out,
             'today_entries': today_entries,
             'vehicles_inside': vehicles_inside,
-            'total_vehicles': len(all_vehicles)
+            'total_vehicles': vehicle_query.count()
+        }), 200
+    except Exception as e:
+        logger.exception('Error in get_stats')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+
+@api.route('/api/stats/timeseries', methods=['GET'])
+@jwt_required()
+def get_stats_timeseries():
+    try:
+        # JWT identity is a string, convert to int for database lookup
+        current_user_id = int(get_jwt_identity())
+        current_user = load_principal(current_user_id)
+        
+        if not current_user:
+            return jsonify({'message': 'User not found'}), 404
+        
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in TIMESERIES_BUCKETS:
+            return jsonify({'message': f'Invalid bucket. Expected one of: {", ".join(TIMESERIES_BUCKETS)}'}), 400
+        
+        try:
+            start = parse_range_param(request.args.get('start'))
+            end = parse_range_param(request.args.get('end'), end=True)
+        except ValueError:
+            return jsonify({'message': 'Invalid start or end date. Use YYYY-MM-DD or ISO 8601'}), 400
+        
+        # Minutes east of UTC of the viewer's calendar (480 for UTC+8), so day buckets are local days
+        utc_offset = request.args.get('utc_offset', 0, type=int)
+        if abs(utc_offset) > TIMESERIES_MAX_OFFSET:
+            return jsonify({'message': f'utc_offset must be between -{TIMESERIES_MAX_OFFSET} and {TIMESERIES_MAX_OFFSET} minutes'}), 400
+        
+        location = request.args.get('location')
+        vehicle_type = request.args.get('vehicle_type')
+        
+        # Hot table plus any archived months the range reaches into
+        Entry = entry_log_source(start, end)
+        
+        in_count = count_where(Entry.entry_type == 'in').label('in_count')
+        out_count = count_where(Entry.entry_type == 'out').label('out_count')
+        
+        def grouped(*columns):
+            query = db.session.query(*columns, in_count, out_count).select_from(Entry).join(Vehicle, Vehicle.id == Entry.vehicle_id)
+            if current_user.role != 'admin':
+                query = query.filter(Vehicle.user_id == current_user_id)
+            if start:
+                query = query.filter(Entry.timestamp >= start)
+            if end:
+                query = query.filter(Entry.timestamp < end)
+            if location:
+                query = query.filter(Entry.location == location)
+            if vehicle_type:
+                query = query.filter(Vehicle.vehicle_type == vehicle_type)
+            if columns:
+                query = query.group_by(*columns).order_by(*columns)
+            return query
+        
+        bucket_key = timestamp_bucket(Entry.timestamp, bucket, utc_offset).label('bucket')
+        offset_suffix = format_utc_offset(utc_offset)
+        totals = grouped().one()
+        
+        return jsonify({
+            'bucket': bucket,
+            'start': start.isoformat() if start else None,
+            'end': end.isoformat() if end else None,
+            'totals': {'in': totals.in_count or 0, 'out': totals.out_count or 0},
+            'series': [{
+                'bucket': row.bucket + offset_suffix,
+                'in': row.in_count,
+                'out': row.out_count
+            } for row in grouped(bucket_key)],
+            'by_location': [{
+                'location': row.location,
+                'in': row.in_count,
+                'out': row.out_count
+            } for row in grouped(Entry.location)],
+            'by_vehicle_type': [{
+                'vehicle_type': row.vehicle_type,
+                'in': row.in_count,
+                'out': row.out_count
+            } for row in grouped(Vehicle.vehicle_type)]
+        }), 200
+    except Exception as e:
+        logger.exception('Error in get_stats_timeseries')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+
+# Dwell time: stays on site from the visit table, so none of these pair entries at read time
+OVERSTAY_HOURS = float(os.getenv('OVERSTAY_HOURS', '12'))
+# (label, upper bound in seconds) of the dwell histogram; the last bucket is open-ended
+DWELL_BUCKETS = (
+    ('<15m', 900), ('15m-1h', 3600), ('1-2h', 7200), ('2-4h', 14400),
+    ('4-8h', 28800), ('8-12h', 43200), ('12-24h', 86400), ('>24h', None)
+)
+DWELL_PERCENTILES = (('p50', 0.50), ('p90', 0.90), ('p95', 0.95))
+
+def visit_rows_query(current_user):
+    """Visit rows joined with plate, vehicle type and owner name in one statement."""
+    query = db.session.query(
+        VehicleVisit.id,
+        VehicleVisit.vehicle_id,
+        VehicleVisit.entered_at,
+        VehicleVisit.exited_at,
+        VehicleVisit.duration_seconds,
+        VehicleVisit.entry_location,
+        VehicleVisit.exit_location,
+        Vehicle.plate_number,
+        Vehicle.vehicle_type,
+        User.full_name.label('owner_name')
+    ).select_from(VehicleVisit).join(Vehicle, Vehicle.id == VehicleVisit.vehicle_id).join(User, User.id == Vehicle.user_id)
+    if current_user.role != 'admin':
+        query = query.filter(Vehicle.user_id == current_user.id)
+    return query
+
+def serialize_visit(row, now):
+    # Open visits report how long the vehicle has been inside so far
+    is_open = row.exited_at is None
+    return {
+        'id': row.id,
+        'vehicle_id': row.vehicle_id,
+        'plate_number': row.plate_number,
+        'vehicle_type': row.vehicle_type,
+        'owner_name': row.owner_name,
+        'entered_at': _utc(row.entered_at).isoformat(),
+        'exited_at': None if is_open else _utc(row.exited_at).isoformat(),
+        'entry_location': row.entry_location,
+        'exit_location': row.exit_location,
+        'duration_seconds': int((now - _utc(row.entered_at)).total_seconds()) if is_open else row.duration_seconds,
+        'open': is_open
+    }
+
+@api.route('/api/visits', methods=['GET'])
+@jwt_required()
+def get_visits():
+    """Stays on site, newest first: ?vehicle_id=, ?open=true|false, ?start=/?end= on arrival time."""
+    try:
+        # JWT identity is a string, convert to int for database lookup
+        current_user_id = int(get_jwt_identity())
+        current_user = load_principal(current_user_id)
+        
+        if not current_user:
+            return jsonify({'message': 'User not found'}), 404
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 50, type=int), 1)
+        vehicle_id = request.args.get('vehicle_id', type=int)
+        is_open = request.args.get('open')
+        
+        try:
+            start = parse_range_param(request.args.get('start'))
+            end = parse_range_param(request.args.get('end'), end=True)
+        except ValueError:
+            return jsonify({'message': 'Invalid start or end date. Use YYYY-MM-DD or ISO 8601'}), 400
+        
+        query = visit_rows_query(current_user)
+        if vehicle_id:
+            query = query.filter(VehicleVisit.vehicle_id == vehicle_id)
+        if is_open in ('true', 'false'):
+            query = query.filter(VehicleVisit.exited_at.is_(None) if is_open == 'true' else VehicleVisit.exited_at.isnot(None))
+        if start:
+            query = query.filter(VehicleVisit.entered_at >= start)
+        if end:
+            query = query.filter(VehicleVisit.entered_at < end)
+        
+        total = query.order_by(None).count()
+        rows = query.order_by(VehicleVisit.entered_at.desc(), VehicleVisit.id.desc()) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+        now = datetime.now(timezone.utc)
+        
+        return jsonify({
+            'visits': [serialize_visit(row, now) for row in rows],
+            'total': total,
+            'pages': -(-total // per_page),
+            'current_page': page
+        }), 200
+    except Exception as e:
+        logger.exception('Error in get_visits')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+
+@api.route('/api/visits/overstays', methods=['GET'])
+@jwt_required()
+def get_overstays():
+    """Vehicles inside for longer than ?hours= (default OVERSTAY_HOURS), longest stay first."""
+    try:
+        # JWT identity is a string, convert to int for database lookup
+        current_user_id = int(get_jwt_identity())
+        current_user = load_principal(current_user_id)
+        
+        if not current_user:
+            return jsonify({'message': 'User not found'}), 404
+        
+        hours = request.args.get('hours', OVERSTAY_HOURS, type=float)
+        if hours is None or hours < 0:
+            return jsonify({'message': 'hours must be a non-negative number'}), 400
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 100, type=int), 1)
+        
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(hours=hours)
+        query = visit_rows_query(current_user).filter(
+            VehicleVisit.exited_at.is_(None),
+            VehicleVisit.entered_at < cutoff
+        )
+        
+        total = query.order_by(None).count()
+        rows = query.order_by(VehicleVisit.entered_at, VehicleVisit.id).limit(per_page).offset((page - 1) * per_page).all()
+        
+        return jsonify({
+            'hours': hours,
+            'cutoff': cutoff.isoformat(),
+            'visits': [serialize_visit(row, now) for row in rows],
+            'total': total,
+            'pages': -(-total // per_page),
+            'current_page': page
+        }), 200
+    except Exception as e:
+        logger.exception('Error in get_overstays')
+        return jsonify({'message': f'Server error: {str(e)}'}), 500
+
+@api.route('/api/stats/dwell', methods=['GET'])
+@jwt_required()
+def get_dwell_stats():
+    """Dwell time of visits that ended in [start, end): totals, percentiles, histogram, per vehicle type."""
+    try:
+        # JWT identity is a string, convert to int for database lookup
+        current_user_id = int(get_jwt_identity())
+        current_user = load_principal(current_user_id)
+        
+        if not current_user:
+            return jsonify({'message': 'User not found'}), 404
+        
+        try:
+            start = parse_range_param(request.args.get('start'))
+            end = parse_range_param(request.args.get('end'), end=True)
+        except ValueError:
+            return jsonify({'message': 'Invalid start or end date. Use YYYY-MM-DD or ISO 8601'}), 400
+        
+        location = request.args.get('location')
+        vehicle_type = request.args.get('vehicle_type')
+        duration = VehicleVisit.duration_seconds
+        
+        query = db.session.query(VehicleVisit).filter(VehicleVisit.exited_at.isnot(None))
+        if current_user.role != 'admin' or vehicle_type:
+            query = query.join(Vehicle, Vehicle.id == VehicleVisit.vehicle_id)
+        if current_user.role != 'admin':
+            query = query.filter(Vehicle.user_id == current_user_id)
+        if vehicle_type:
+            query = query.filter(Vehicle.vehicle_type == vehicle_type)
+        if start:
+            query = query.filter(VehicleVisit.exited_at >= start)
+        if end:
+            query = query.filter(VehicleVisit.exited_at < end)
+        if location:
+            query = query.filter(VehicleVisit.entry_location == location)
+        
+        totals = query.with_entities(
+            db.func.count(VehicleVisit.id),
+            db.func.avg(duration),
+            db.func.min(duration),
+            db.func.max(duration)
+        ).one()
+        visits = totals[0]
+        
+        # Nearest-rank percentiles of the matching durations
+        percentiles = {}
+        for name, fraction in DWELL_PERCENTILES:
+            rank = max(math.ceil(fraction * visits), 1)
+            percentiles[f'{name}_seconds'] = query.with_entities(duration).order_by(duration) \
+                .offset(rank - 1).limit(1).scalar() if visits else None
+        
+        bucket = db.case(
+            *[(duration < upper, label) for label, upper in DWELL_BUCKETS if upper is not None],
+            else_=DWELL_BUCKETS[-1][0]
+        ).label('bucket')
+        counts = dict(query.with_entities(bucket, db.func.count(VehicleVisit.id)).group_by(bucket).all())
+        
+        by_type_query = query if current_user.role != 'admin' or vehicle_type else \
+            query.join(Vehicle, Vehicle.id == VehicleVisit.vehicle_id)
+        by_vehicle_type = by_type_query.with_entities(
+            Vehicle.vehicle_type,
+            db.func.count(VehicleVisit.id),
+            db.func.avg(duration),
+            db.func.max(duration)
+        ).group_by(Vehicle.vehicle_type).order_by(Vehicle.vehicle_type).all()
+        
+        lower = 0
+        histogram = []
+        for label, upper in DWELL_BUCKETS:
+            histogram.append({'bucket': label, 'min_seconds': lower, 'max_seconds': upper, 'visits': counts.get(label, 0)})
+            lower = upper
+        
+        return jsonify({
+            'start': start.isoformat() if start else None,
+            'end': end.isoformat() if end else None,
+            'totals': {
+                'visits': visits,
+                'avg_seconds': round(float(totals[1]), 1) if totals[1] is not None else None,
+                'min_seconds': totals[2],
+                'max_seconds': totals[3],
+                **percentiles
+            },
+            'histogram': histogram,
+            'by_vehicle_type': [{
+                'vehicle_type': row[0],
+                'visits': row[1],
+                'avg_seconds': round(float(row[2]), 1),
+                'max_seconds': row[3]
+            } for row in by_vehicle_type]
         }), 200
     except Exception as e:
-        print(f"Error in get_stats: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error in get_dwell_stats')
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
+@api.route('/api/stats/cache', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    return jsonify({
+        'vehicle_cache': vehicle_cache.stats(),
+        'principal_cache': principal_cache.stats(),
+        'scan_debounce': scan_debouncer.stats()
+    }), 200
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint. With METRICS_TOKEN set, requires 'Authorization: Bearer <token>';
+    without it, only answers requests made directly from this host."""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+            return jsonify({'message': 'Invalid metrics token'}), 401
+    elif request.remote_addr not in ('127.0.0.1', '::1') or any(
+            header in request.headers for header in ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')):
+        # A reverse proxy on this host connects from loopback too, hence the header check
+        return jsonify({'message': 'Set METRICS_TOKEN to scrape /metrics from another host'}), 403
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # Root route for health check
-@app.route('/')
+@api.route('/')
 def index():
     return jsonify({
         'message': 'Gate Security API',
@@ -865,6 +3241,46 @@ def index():
         'version': '1.0.0'
     }), 200
 
+def create_app(config=None):
+    """Build the API app. `config` overrides settings read from the environment.
+    
+    Nothing here touches the database: `flask --app app init-db` creates the schema and
+    the admin account.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///gate_security.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['BLOB_STORAGE_PATH'] = os.getenv('BLOB_STORAGE_PATH', os.path.join(app.instance_path, 'blobs'))
+    # JWT Configuration - MUST be set before JWTManager initialization
+    app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    # Flask-JWT-Extended defaults to looking for tokens in Authorization header with Bearer format
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    
+    db.init_app(app)
+    with app.app_context():
+        # Only the app's own database: other engines (copy-from-sqlite reads its source
+        # through one) are opened as they are
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _sqlite_pragmas)
+    jwt.init_app(app)
+    CORS(app, supports_credentials=True, allow_headers=['Content-Type', 'Authorization'])
+    app.extensions['blob_store'] = BlobStore(app.config['BLOB_STORAGE_PATH'])
+    app.register_blueprint(api)
+    
+    gate_dispatcher.on_result = partial(record_gate_result, app)
+    gate_health.get_controllers = partial(enabled_gate_controllers, app)
+    event_hub.relay = event_relay(app)
+    return app
+
 if __name__ == '__main__':
+    app = create_app()
+    # The development server sets up a fresh database itself
+    with app.app_context():
+        try:
+            bootstrap_database()
+        except migrations.MigrationError as e:
+            sys.exit(f"Error: {e}")
     app.run(debug=True, host='127.0.0.1', port=5001)
 
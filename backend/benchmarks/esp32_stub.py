@@ -0,0 +1,108 @@
+"""Stand-in for an ESP32 gate controller with configurable latency and failure rate.
+
+Serves POST /open, POST /close and GET /status like the firmware does. Used by
+benchmarks.run, or on its own:
+
+    python -m benchmarks.esp32_stub --port 8081 --latency 0.05 --failure-rate 0.1
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ESP32Stub:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.position = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='esp32-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _respond(self, path):
+        """(status, body) for a request, after the simulated latency."""
+        with self._lock:
+            self.requests += 1
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0)
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            return 503, 'Simulated failure'
+        if path in ('/open', '/close'):
+            self.position = 90 if path == '/open' else 0
+            return 200, 'Gate opened' if path == '/open' else 'Gate closed'
+        if path == '/status':
+            return 200, f'Gate position: {self.position} degrees'
+        return 404, 'Not found'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                status, body = stub._respond(self.path.split('?')[0])
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _reply
+            do_POST = _reply
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds around --latency.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    args = parser.parse_args()
+
+    stub = ESP32Stub(args.host, args.port, args.latency, args.jitter, args.failure_rate).start()
+    print(f'ESP32 stub listening on {stub.url} (Ctrl+C to stop)')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
+        print(f'{stub.requests} requests, {stub.failures} simulated failures')
+
+
+if __name__ == '__main__':
+    main()
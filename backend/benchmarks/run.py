@@ -0,0 +1,305 @@
+"""Drive /api/scan, /api/stats, /api/entries and /api/vehicles concurrently and report latency.
+
+Run from the backend directory against a database made by benchmarks.seed:
+
+    python -m benchmarks.run /tmp/bench-10k.db --duration 30 --concurrency 8 \\
+        --esp32-latency 0.05 --esp32-failure-rate 0.05 --json results.json
+
+By default requests go through the Flask app in this process, against a scratch copy of
+the database, with the ESP32 replaced by benchmarks.esp32_stub. SQL statements are
+counted per request. With --url the same mix is sent over HTTP to a running server
+instead; point that server at the database and signing keys used here.
+
+--baseline compares against an earlier --json file and exits with status 1 when a p95
+or the queries per request got worse by more than --tolerance.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.esp32_stub import ESP32Stub
+
+DEFAULT_MIX = 'scan=60,entries=20,stats=10,vehicles=10'
+LOCATIONS = ('Main Gate', 'Back Gate', 'Service Gate')
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in REQUESTS:
+            raise argparse.ArgumentTypeError(f'Unknown request type {name!r}; expected {", ".join(REQUESTS)}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# Each builder returns (method, path, json body) for one request
+def _scan(ctx, rng):
+    vehicle_id, plate = rng.choice(ctx['vehicles'])
+    return 'POST', '/api/scan', {
+        'qr_data': ctx['sign'](vehicle_id, plate),
+        'location': rng.choice(LOCATIONS),
+        'timestamp': datetime.now().astimezone().isoformat()
+    }
+
+
+def _stats(ctx, rng):
+    return 'GET', '/api/stats', None
+
+
+def _entries(ctx, rng):
+    return 'GET', f'/api/entries?page={rng.randint(1, 5)}&per_page=50', None
+
+
+def _vehicles(ctx, rng):
+    cursor = rng.choice(ctx['vehicles'])[0]
+    return 'GET', f'/api/vehicles?limit=50&cursor={cursor}', None
+
+
+def _dwell(ctx, rng):
+    return 'GET', '/api/stats/dwell', None
+
+
+def _overstays(ctx, rng):
+    return 'GET', '/api/visits/overstays?hours=12', None
+
+
+REQUESTS = {'scan': _scan, 'stats': _stats, 'entries': _entries, 'vehicles': _vehicles,
+            'dwell': _dwell, 'overstays': _overstays}
+
+
+class InProcessClient:
+    """Requests through app.test_client(), counting the SQL statements each one runs."""
+
+    def __init__(self, app, counter):
+        self.client = app.test_client()
+        self.counter = counter
+
+    def send(self, method, path, body, headers):
+        self.counter.count = 0
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        response.close()
+        return response.status_code, self.counter.count
+
+
+class HTTPClient:
+    def __init__(self, base_url):
+        import requests
+        self.session = requests.Session()
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, path, body, headers):
+        response = self.session.request(method, self.base_url + path, json=body, headers=headers, timeout=60)
+        return response.status_code, None
+
+
+def worker(client, ctx, kinds, weights, deadline, warmup_until, seed, samples):
+    rng = random.Random(seed)
+    headers = {'Authorization': f"Bearer {ctx['token']}"}
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        method, path, body = REQUESTS[kind](ctx, rng)
+        measured = time.monotonic() >= warmup_until
+        started = time.perf_counter()
+        try:
+            status, queries = client.send(method, path, body, headers)
+        except Exception:
+            status, queries = 0, None
+        elapsed = time.perf_counter() - started
+        if measured:
+            samples.append((kind, elapsed, status, queries))
+
+
+def summarize(samples, duration):
+    report = {}
+    for kind in sorted({sample[0] for sample in samples}):
+        rows = [sample for sample in samples if sample[0] == kind]
+        latencies = sorted(sample[1] for sample in rows)
+        queries = [sample[3] for sample in rows if sample[3] is not None]
+        report[kind] = {
+            'requests': len(rows),
+            'errors': sum(1 for sample in rows if not 200 <= sample[2] < 300),
+            'rps': round(len(rows) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2),
+            'queries_avg': round(sum(queries) / len(queries), 2) if queries else None,
+            'queries_max': max(queries) if queries else None
+        }
+    return report
+
+
+def print_report(report):
+    columns = ('requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'queries_avg', 'queries_max')
+    print(f"{'endpoint':<10}" + ''.join(f'{column:>13}' for column in columns))
+    for kind, row in report.items():
+        print(f'{kind:<10}' + ''.join(f"{'-' if row[c] is None else row[c]:>13}" for c in columns))
+
+
+def compare(report, baseline, tolerance):
+    """Lines describing regressions against `baseline`; empty when there are none."""
+    regressions = []
+    for kind, row in report.items():
+        before = baseline.get(kind)
+        if not before:
+            continue
+        if row['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{kind}: p95 {before['p95_ms']} ms -> {row['p95_ms']} ms")
+        if row['queries_avg'] is not None and before.get('queries_avg') is not None \
+                and row['queries_avg'] > before['queries_avg'] * (1 + tolerance) + 0.5:
+            regressions.append(f"{kind}: queries/request {before['queries_avg']} -> {row['queries_avg']}")
+    return regressions
+
+
+def load_app(args, workdir, stub):
+    database = os.path.abspath(args.database)
+    if not args.url and not args.in_place:
+        # Scans write entries, so every run starts from the same seeded state. The backup API
+        # copies committed pages still in the -wal file too, which a file copy would miss.
+        copy = os.path.join(workdir, os.path.basename(database))
+        source, target = sqlite3.connect(database), sqlite3.connect(copy)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        database = copy
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('BLOB_STORAGE_PATH', os.path.join(workdir, 'blobs'))
+    os.environ['SCAN_DEBOUNCE_SECONDS'] = str(args.debounce)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if stub:
+        os.environ['ESP32_IP'] = stub.url
+    import app as app_module
+    app = app_module.create_app()
+    with app.app_context():
+        # Databases seeded by an older version get the current schema
+        app_module.bootstrap_database()
+    return app_module, app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='Database made by benchmarks.seed.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to measure.')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds run before measuring starts.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Request weights (default {DEFAULT_MIX}).')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--debounce', type=float, default=0, help='SCAN_DEBOUNCE_SECONDS for the run (default 0: every scan writes).')
+    parser.add_argument('--esp32-latency', type=float, default=0.02)
+    parser.add_argument('--esp32-jitter', type=float, default=0.0)
+    parser.add_argument('--esp32-failure-rate', type=float, default=0.0)
+    parser.add_argument('--url', help='Benchmark a running server at this URL instead of in-process.')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--in-place', action='store_true', help='Write to the database itself instead of a copy.')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file.')
+    parser.add_argument('--baseline', help='Results file from an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression (default 0.2).')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='gate-bench-')
+    stub = None if args.url else ESP32Stub(
+        latency=args.esp32_latency, jitter=args.esp32_jitter, failure_rate=args.esp32_failure_rate, seed=args.seed
+    ).start()
+    try:
+        app_module, app = load_app(args, workdir, stub)
+        counter = threading.local()
+
+        @event.listens_for(Engine, 'after_cursor_execute')
+        def count_query(*_):
+            if hasattr(counter, 'count'):
+                counter.count += 1
+
+        def make_client():
+            return HTTPClient(args.url) if args.url else InProcessClient(app, counter)
+
+        login = make_client()
+        if args.url:
+            response = login.session.post(f'{login.base_url}/api/auth/login',
+                                          json={'username': args.username, 'password': args.password})
+            token = response.json()['access_token']
+        else:
+            response = login.client.post('/api/auth/login', json={'username': args.username, 'password': args.password})
+            token = response.get_json()['access_token']
+
+        with app.app_context():
+            vehicles = app_module.db.session.query(app_module.Vehicle.id, app_module.Vehicle.plate_number).all()
+        if not vehicles:
+            sys.exit('The database has no vehicles; create one with benchmarks.seed')
+        ctx = {'token': token, 'vehicles': [tuple(v) for v in vehicles], 'sign': app_module.qr_signer.sign}
+
+        kinds, weights = list(args.mix), list(args.mix.values())
+        samples = []
+        start = time.monotonic()
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.duration
+        threads = [
+            threading.Thread(target=worker, args=(make_client(), ctx, kinds, weights, deadline, warmup_until,
+                                                  args.seed * 1000 + i, samples))
+            for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = summarize(samples, args.duration)
+        print(f'{len(vehicles)} vehicles, concurrency {args.concurrency}, {args.duration:g}s'
+              f"{' against ' + args.url if args.url else ' in-process'}")
+        print_report(report)
+
+        result = {'settings': {key: value for key, value in vars(args).items() if key != 'password'}, 'endpoints': report}
+        if stub:
+            # Let queued gate commands finish so the delivery counts are complete
+            app_module.gate_dispatcher.queue.join()
+            from gate_dispatch import GATE_COMMANDS
+            gate = {
+                'stub_requests': stub.requests,
+                'stub_failures': stub.failures,
+                'delivered': GATE_COMMANDS.value(outcome='delivered'),
+                'failed': GATE_COMMANDS.value(outcome='failed')
+            }
+            print('gate: ' + ', '.join(f'{key}={value}' for key, value in gate.items()))
+            result['gate'] = gate
+
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump(result, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(report, json.load(f)['endpoints'], args.tolerance)
+            for line in regressions:
+                print(f'REGRESSION {line}')
+            if regressions:
+                sys.exit(1)
+    finally:
+        if stub:
+            stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Create a benchmark database shaped like gate_security.db at a chosen scale.
+
+Run from the backend directory:
+
+    python -m benchmarks.seed /tmp/bench-10k.db --vehicles 10000 --entries 1000000
+
+Rows are generated from --seed, so the same arguments always give the same database.
+Entries alternate in/out per vehicle in time order and the presence table is rebuilt from
+them, exactly as if every scan had gone through /api/scan.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+LOCATIONS = ('Main Gate', 'Main Gate', 'Main Gate', 'Back Gate', 'Service Gate')
+VEHICLE_TYPES = ('car', 'car', 'car', 'motorcycle', 'truck', 'van')
+MAKES = ('Toyota', 'Honda', 'Mitsubishi', 'Nissan', 'Ford', 'Hyundai', 'Suzuki', 'Isuzu')
+COLORS = ('White', 'Black', 'Silver', 'Gray', 'Red', 'Blue')
+FIRST_NAMES = ('Ana', 'Ben', 'Carla', 'Dan', 'Elena', 'Felix', 'Grace', 'Hugo', 'Ines', 'Jose', 'Kim', 'Luis')
+LAST_NAMES = ('Santos', 'Reyes', 'Cruz', 'Garcia', 'Mendoza', 'Torres', 'Flores', 'Ramos', 'Lopez', 'Navarro')
+CHUNK = 20000
+
+
+def plate_for(index):
+    # Three letters and four digits, unique per index
+    letters = ''.join(chr(ord('A') + (index // 10000 // 26 ** i) % 26) for i in range(3))
+    return f'{letters} {index % 10000:04d}'
+
+
+def _insert(db, table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+    db.session.commit()
+
+
+def seed(app_module, vehicles, users, entries, days, rng):
+    app, db = app_module.create_app(), app_module.db
+    User, Vehicle, EntryLog = app_module.User, app_module.Vehicle, app_module.EntryLog
+    with app.app_context():
+        app_module.bootstrap_database()
+        if db.engine.dialect.name == 'sqlite':
+            # Throwaway bulk load; durability only matters once it is done
+            db.session.execute(db.text('PRAGMA synchronous=OFF'))
+
+        started = time.monotonic()
+        password_hash = app_module.generate_password_hash('benchmark')
+        first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        _insert(db, User.__table__, [{
+            'id': first_user + i,
+            'username': f'bench{i}',
+            'email': f'bench{i}@nologin.local',
+            'password_hash': password_hash,
+            'full_name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'role': 'user',
+            'created_at': datetime(2024, 1, 1)
+        } for i in range(users)])
+
+        _insert(db, Vehicle.__table__, [{
+            'id': i + 1,
+            'plate_number': plate_for(i),
+            'vehicle_type': rng.choice(VEHICLE_TYPES),
+            'make': rng.choice(MAKES),
+            'model': f'Model {rng.randint(1, 20)}',
+            'color': rng.choice(COLORS),
+            # Scans don't read the QR image, so no PNGs are rendered
+            'qr_code': f'bench:{i + 1}',
+            'user_id': first_user + rng.randrange(users),
+            'created_at': datetime(2024, 1, 1)
+        } for i in range(vehicles)])
+        print(f'{users} users and {vehicles} vehicles in {time.monotonic() - started:.1f}s')
+
+        # Spread entries over the last `days` days, one day at a time so memory stays flat
+        started = time.monotonic()
+        end = datetime.now(timezone.utc).replace(microsecond=0)
+        start = end - timedelta(days=days)
+        state = {}
+        next_id = 1
+        for day in range(days):
+            count = entries // days + (1 if day < entries % days else 0)
+            day_start = start + timedelta(days=day)
+            moments = sorted(
+                (rng.randrange(86400), rng.randint(1, vehicles)) for _ in range(count)
+            )
+            rows = []
+            for second, vehicle_id in moments:
+                entry_type = 'out' if state.get(vehicle_id) == 'in' else 'in'
+                state[vehicle_id] = entry_type
+                rows.append({
+                    'id': next_id,
+                    'vehicle_id': vehicle_id,
+                    'entry_type': entry_type,
+                    'timestamp': day_start + timedelta(seconds=second),
+                    'location': rng.choice(LOCATIONS)
+                })
+                next_id += 1
+            _insert(db, EntryLog.__table__, rows)
+        print(f'{next_id - 1} entries in {time.monotonic() - started:.1f}s')
+
+        started = time.monotonic()
+        inside = app_module.rebuild_vehicle_presence()
+        print(f'Presence for {inside} vehicles in {time.monotonic() - started:.1f}s')
+        
+        if db.engine.dialect.name == 'sqlite':
+            # Fold the WAL into the database file so the file alone is the whole database
+            db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        db.session.close()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file to create.')
+    parser.add_argument('--vehicles', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None, help='Vehicle owners (default: vehicles / 2).')
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90, help='Period the entries are spread over.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='Replace the database if it exists.')
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.database)
+    if os.path.exists(path):
+        if not args.force:
+            sys.exit(f'{path} exists; pass --force to replace it')
+        os.remove(path)
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('BLOB_STORAGE_PATH', path + '.blobs')
+    import app as app_module
+
+    seed(app_module, args.vehicles, args.users or max(args.vehicles // 2, 1), args.entries,
+         max(args.days, 1), random.Random(args.seed))
+    print(f'Wrote {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import tempfile
+
+
+class BlobStore:
+    """Content-addressed file storage for vehicle images and QR code PNGs.
+
+    Files are keyed by their SHA-256 digest, so storing the same bytes twice is a no-op.
+    Layout is <root>/ab/cd/abcd... to keep directories small.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def is_digest(value):
+        return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def put(self, data):
+        """Store bytes and return their digest. Writes are atomic, so readers never see partial files."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return digest
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def read(self, digest):
+        with open(self.path_for(digest), 'rb') as f:
+            return f.read()
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import select
+import socket
+import threading
+from collections import deque
+
+logger = logging.getLogger('gate_security.events')
+
+
+class SubscriberLimitReached(Exception):
+    """EventHub.subscribe was called with max_subscribers streams already open."""
+
+
+class EventHub:
+    """Fan-out of server-sent events to the streams open in this process.
+
+    Published events go into a bounded ring buffer and each subscriber reads from it at its
+    own position. Publishing costs the same however many clients are listening, and no
+    thread is started per client. A subscriber that falls behind by more than the buffer
+    gets a 'resync' event instead of silently missing data. Event IDs carry a per-process
+    prefix, so a reconnecting EventSource resumes from Last-Event-ID on the process that
+    sent it and gets 'resync' anywhere else.
+
+    With a relay, publish() hands the event to it and every process's hub receives it back
+    from the relay, so streams see events published by any worker.
+    """
+
+    def __init__(self, buffer_size=1000, heartbeat=15, max_subscribers=0, relay=None):
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.relay = relay
+        self.subscribers = 0
+        self._events = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._pid = None
+        self._prefix = None
+
+    def publish(self, event, data, audience=None):
+        """Send an event to every subscriber whose filter accepts `audience` (None reaches all)."""
+        if self.relay is not None:
+            self.relay.send(event, json.dumps(data), audience)
+        else:
+            self.deliver(event, json.dumps(data), audience)
+
+    def deliver(self, event, data, audience=None):
+        """Queue an event, `data` already JSON, for this process's subscribers."""
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, event, data, audience))
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self.relay is not None:
+            self.relay.stop()
+
+    def _id_prefix(self):
+        # Forked workers inherit the hub, so each process draws its own prefix
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid, self._prefix = pid, os.urandom(4).hex()
+        return self._prefix
+
+    def subscribe(self, can_see, last_event_id=None):
+        """Open a stream of SSE chunks for the events `can_see(audience)` accepts, ending when
+        the hub closes. `last_event_id` is a reconnecting client's Last-Event-ID header.
+
+        Raises SubscriberLimitReached when max_subscribers (0: no limit) streams are open.
+        Closing the returned iterable frees its slot.
+        """
+        if self.relay is not None:
+            self.relay.start(self)
+        prefix = self._id_prefix()
+        with self._cond:
+            if self.max_subscribers and self.subscribers >= self.max_subscribers:
+                raise SubscriberLimitReached(f'{self.subscribers} event streams already open')
+            position, resync = self._last_id, False
+            if last_event_id:
+                sent_prefix, _, sent_id = last_event_id.partition('.')
+                if sent_prefix == prefix and sent_id.isdigit() and int(sent_id) <= self._last_id:
+                    position = int(sent_id)
+                else:
+                    # Sent by another process, or before a restart: what was missed is unknown
+                    resync = True
+            self.subscribers += 1
+        return _Stream(self, self._chunks(can_see, prefix, position, resync))
+
+    def _release(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    @staticmethod
+    def _format(prefix, event_id, event, data):
+        return f"id: {prefix}.{event_id}\nevent: {event}\ndata: {data}\n\n"
+
+    def _chunks(self, can_see, prefix, position, resync):
+        yield 'retry: 3000\n\n' + (self._format(prefix, position, 'resync', '{}') if resync else '')
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._last_id > position or self._closed, timeout=self.heartbeat)
+                if self._closed:
+                    return
+                oldest = self._events[0][0] if self._events else self._last_id + 1
+                missed = position + 1 < oldest
+                pending = [item for item in self._events if item[0] > position]
+                position = self._last_id
+
+            chunks = []
+            if missed:
+                chunks.append(self._format(prefix, position, 'resync', '{}'))
+            else:
+                chunks.extend(
+                    self._format(prefix, event_id, event, data)
+                    for event_id, event, data, audience in pending
+                    if can_see(audience)
+                )
+            # Comment lines keep proxies from timing the stream out and reveal dead clients
+            yield ''.join(chunks) if chunks else ': keep-alive\n\n'
+
+
+class _Stream:
+    """One subscriber's chunks. The slot is freed once, when the stream is closed or ends;
+    WSGI servers call close() even when a client goes away before the first chunk."""
+
+    def __init__(self, hub, chunks):
+        self._hub = hub
+        self._chunks = chunks
+        self._open = True
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        self._chunks.close()
+        with self._lock:
+            if not self._open:
+                return
+            self._open = False
+        self._hub._release()
+
+
+def _encode(event, data, audience):
+    return f'{json.dumps([event, audience])}\n{data}'
+
+
+def _decode(payload):
+    head, _, data = payload.partition('\n')
+    event, audience = json.loads(head)
+    return event, data, audience
+
+
+class PostgresRelay:
+    """Carries events between server processes with PostgreSQL LISTEN/NOTIFY.
+
+    send() issues a NOTIFY on a connection of its own. One listener thread per process,
+    started by the first subscriber, hands every notification (its own process's too) to
+    the hub. Notifications sent while the listener reconnects are lost, so its subscribers
+    are sent 'resync' once it is back. `connect` returns a new psycopg2 connection.
+    """
+
+    channel = 'gate_events'
+
+    def __init__(self, connect, retry=2.0):
+        self.connect = connect
+        self.retry = retry
+        self._sender = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def send(self, event, data, audience=None):
+        with self._lock:
+            try:
+                if self._sender is None:
+                    self._sender = self.connect()
+                    self._sender.autocommit = True
+                with self._sender.cursor() as cursor:
+                    cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, _encode(event, data, audience)))
+            except Exception:
+                logger.warning('Could not relay event', exc_info=True, extra={'event': event})
+                self._sender = _close(self._sender)
+
+    def start(self, hub):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._listen, args=(hub,), name='event-relay', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen(self, hub):
+        connection = None
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                if connection is None:
+                    connection = self.connect()
+                    connection.autocommit = True
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'LISTEN {self.channel}')
+                    if connected_before:
+                        hub.deliver('resync', '{}')
+                    connected_before = True
+                if select.select([connection], [], [], 5)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        hub.deliver(*_decode(connection.notifies.pop(0).payload))
+            except Exception:
+                logger.warning('Event relay listener disconnected', exc_info=True)
+                connection = _close(connection)
+                self._stop.wait(self.retry)
+        _close(connection)
+
+
+class SocketRelay:
+    """Carries events between server processes on one host over Unix datagram sockets.
+
+    Each process with subscribers binds a socket in `directory`; send() hands the event to
+    its own hub and writes it to every other socket there, removing sockets whose process
+    is gone. The kernel queues only a few datagrams per socket, so send() waits up to
+    `timeout` seconds for a receiver to drain; one that stays stuck misses the event. When
+    the sockets can't be set up, events still reach this process's streams.
+    """
+
+    def __init__(self, directory, timeout=0.1):
+        self.directory = directory
+        self.timeout = timeout
+        self._hub = None
+        self._sender = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._path = None
+
+    def send(self, event, data, audience=None):
+        if self._hub is not None:
+            self._hub.deliver(event, data, audience)
+        payload = _encode(event, data, audience).encode()
+        try:
+            with self._lock:
+                if self._sender is None:
+                    self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                    self._sender.settimeout(self.timeout)
+            entries = [entry.path for entry in os.scandir(self.directory)
+                       if entry.name.endswith('.sock') and entry.path != self._path]
+        except FileNotFoundError:
+            return
+        except OSError:
+            logger.warning('Could not relay event', exc_info=True, extra={'event': event})
+            return
+        for path in entries:
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody bound to it: the process exited without cleaning up
+                _unlink(path)
+            except TimeoutError:
+                logger.warning('Event receiver is not draining, event dropped', extra={'event': event, 'socket': path})
+            except OSError:
+                logger.warning('Could not relay event', exc_info=True, extra={'event': event, 'socket': path})
+
+    def start(self, hub):
+        with self._lock:
+            if self._hub is not None:
+                return
+            self._hub = hub
+            path = os.path.join(self.directory, f'{os.getpid()}.sock')
+            receiver = None
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                _unlink(path)
+                receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                receiver.bind(path)
+            except OSError:
+                _close(receiver)
+                logger.warning('Event relay socket unavailable, streams only see this process\'s events',
+                               exc_info=True, extra={'socket': path})
+                return
+            receiver.settimeout(1)
+            self._path = path
+            self._thread = threading.Thread(target=self._listen, args=(hub, receiver), name='event-relay', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen(self, hub, receiver):
+        try:
+            while not self._stop.is_set():
+                try:
+                    payload = receiver.recv(1 << 20)
+                except socket.timeout:
+                    continue
+                hub.deliver(*_decode(payload.decode()))
+        finally:
+            receiver.close()
+            _unlink(self._path)
+
+
+def _close(connection):
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return None
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
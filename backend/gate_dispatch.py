@@ -0,0 +1,235 @@
+import logging
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger('gate_security.gate')
+
+GATE_REQUEST_SECONDS = metrics.histogram(
+    'gate_request_duration_seconds', 'ESP32 HTTP request latency per attempt.', ('request', 'outcome')
+)
+GATE_COMMANDS = metrics.counter('gate_commands', 'Gate commands by final delivery outcome.', ('outcome',))
+GATE_RETRIES = metrics.counter('gate_command_retries', 'Gate command attempts after the first.')
+
+
+def _observe_request(request, started, outcome):
+    GATE_REQUEST_SECONDS.observe(time.monotonic() - started, request=request, outcome=outcome)
+
+
+def _new_session(pool_maxsize):
+    # requests is imported on the first gate command or poll, not at API startup
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class GateDispatcher:
+    """Background delivery of open/close commands to the ESP32 gate controllers.
+
+    Scans enqueue a command and return immediately; a small pool of worker threads
+    sends it over a pooled keep-alive session, retrying with exponential backoff, and
+    reports the final outcome through `on_result(command_id, delivered, attempts, error)`.
+    """
+
+    def __init__(self, on_result, workers=4, retries=3, timeout=5, backoff=0.5, queue_size=1000):
+        self.on_result = on_result
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._session = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = _new_session(max(self.workers, 4))
+            return self._session
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'gate-dispatch-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, command_id, url):
+        """Queue a POST to `url`. Returns False when the queue is full and the command was dropped."""
+        self.start()
+        try:
+            self.queue.put_nowait((command_id, url))
+        except queue.Full:
+            GATE_COMMANDS.inc(outcome='dropped')
+            self.on_result(command_id, False, 0, 'Gate dispatch queue full')
+            return False
+        return True
+
+    def _send(self, url):
+        import requests
+        attempts = 0
+        error = None
+        while attempts <= self.retries:
+            if attempts:
+                GATE_RETRIES.inc()
+                time.sleep(self.backoff * (2 ** (attempts - 1)))
+            attempts += 1
+            started = time.monotonic()
+            try:
+                response = self.session.post(url, timeout=self.timeout)
+                if response.status_code == 200:
+                    _observe_request('command', started, 'ok')
+                    GATE_COMMANDS.inc(outcome='delivered')
+                    return True, attempts, None
+                _observe_request('command', started, 'http_error')
+                error = f'Controller responded with status {response.status_code}'
+                # Client errors will not succeed on retry
+                if response.status_code < 500:
+                    break
+            except requests.exceptions.RequestException as e:
+                _observe_request('command', started, 'unreachable')
+                error = f'Controller unreachable: {e}'
+        GATE_COMMANDS.inc(outcome='failed')
+        return False, attempts, error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            command_id, url = job
+            try:
+                delivered, attempts, error = self._send(url)
+                self.on_result(command_id, delivered, attempts, error)
+            except Exception:
+                logger.exception('Gate dispatch error', extra={'command_id': command_id})
+            finally:
+                self.queue.task_done()
+
+
+class GateHealthMonitor:
+    """Polls each gate controller's /status endpoint in the background and caches liveness.
+
+    `get_controllers()` returns (controller_id, base_url) pairs and is called on every round,
+    so newly registered gates are picked up without a restart. Polls run in parallel so a
+    round takes roughly one timeout however many gates there are.
+    """
+
+    POSITION_PATTERN = re.compile(r'(-?\d+)\s*degrees')
+
+    def __init__(self, get_controllers, session=None, interval=15, timeout=2, max_parallel=16):
+        self.get_controllers = get_controllers
+        self._session = session
+        self.interval = interval
+        self.timeout = timeout
+        self.max_parallel = max_parallel
+        self._health = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='gate-health', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = _new_session(self.max_parallel)
+            return self._session
+
+    def refresh(self):
+        """Ask the poller to run a round now instead of waiting for the interval."""
+        self._wake.set()
+
+    def forget(self, controller_id):
+        with self._lock:
+            self._health.pop(controller_id, None)
+
+    def get(self, controller_id):
+        with self._lock:
+            health = self._health.get(controller_id)
+            return dict(health) if health else None
+
+    def snapshot(self):
+        with self._lock:
+            return {controller_id: dict(health) for controller_id, health in self._health.items()}
+
+    def is_down(self, controller_id):
+        """True only when the last poll failed recently; unknown controllers are assumed up."""
+        health = self.get(controller_id)
+        if not health or health['online']:
+            return False
+        return time.time() - health['checked_at'] < self.interval * 3
+
+    def check(self, controller_id, base_url):
+        import requests
+        started = time.monotonic()
+        health = {'online': False, 'position': None, 'latency_ms': None, 'error': None}
+        try:
+            response = self.session.get(f"{base_url}/status", timeout=self.timeout)
+            health['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+            _observe_request('status', started, 'ok' if response.status_code == 200 else 'http_error')
+            if response.status_code == 200:
+                health['online'] = True
+                match = self.POSITION_PATTERN.search(response.text)
+                if match:
+                    health['position'] = int(match.group(1))
+            else:
+                health['error'] = f'Controller responded with status {response.status_code}'
+        except requests.exceptions.RequestException as e:
+            _observe_request('status', started, 'unreachable')
+            health['error'] = f'Controller unreachable: {e}'
+        health['checked_at'] = time.time()
+        with self._lock:
+            self._health[controller_id] = health
+        return health
+
+    def poll_once(self):
+        controllers = list(self.get_controllers())
+        if not controllers:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(controllers))) as pool:
+            for controller_id, base_url in controllers:
+                pool.submit(self.check, controller_id, base_url)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception('Gate health poll error')
+            self._wake.wait(self.interval)
+            self._wake.clear()
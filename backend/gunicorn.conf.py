@@ -0,0 +1,78 @@
+"""Gunicorn settings for the gate security API. Every value can be overridden from the
+environment (or on the command line), e.g. WEB_CONCURRENCY=4 GUNICORN_WORKER_CLASS=gthread.
+"""
+import multiprocessing
+import os
+import shutil
+
+# Same port as the development server, which the Vite proxy forwards /api to
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+
+# Processes give CPU parallelism. They share what matters: repeat scans are recognized in
+# the database, cached vehicles are checked against their row, metrics are added up
+# across workers and live events reach all of them through the relay.
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# gevent runs every request on a greenlet, so an open /api/events stream costs no thread
+# and streams need no cap. GUNICORN_WORKER_CLASS=gthread runs a thread per request
+# instead (GUNICORN_THREADS, with DB_POOL_SIZE at or above it); there every stream holds
+# a thread and EVENT_MAX_SUBSCRIBERS should keep some free for scans.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# SQLite's busy wait blocks a whole gevent worker, so a second connection of the same
+# worker waiting for the write lock would stall the greenlet holding it. With one
+# connection per worker its requests queue for the connection instead.
+if worker_class == 'gevent' and not os.getenv('DATABASE_URL', '').startswith('postgresql'):
+    os.environ.setdefault('DB_POOL_SIZE', '1')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+
+# Each worker writes its metrics here for whichever worker answers /metrics to add up
+metrics_dir = os.getenv('METRICS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+
+# Import the app once in the master; workers fork with the code already loaded, so
+# spawning or replacing one is quick. Startup never touches the database. gevent must
+# patch the standard library before the app's locks exist, so it loads in each worker.
+preload_app = worker_class == 'gthread'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections the master may have opened must not be shared with workers
+    if not server.cfg.preload_app:
+        return
+    from app import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def on_starting(server):
+    # Totals start over with the server, as they would in a single process
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    import metrics
+    metrics.REGISTRY.share(metrics_dir)
+    # psycopg2 waits for PostgreSQL through the patched select(), so a query yields to
+    # the worker's other requests instead of blocking them
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycopg2 import extensions, extras
+    except ImportError:
+        return
+    extensions.set_wait_callback(extras.wait_select)
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(metrics_dir, worker.pid)
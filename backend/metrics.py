@@ -0,0 +1,254 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+
+# Prometheus text exposition (format 0.0.4) without the client library. Metrics live in
+# process memory; with several server processes, Registry.share() has each one write its
+# series to a common directory and /metrics reports the sum over all of them.
+
+# Seconds; covers cached scans (a few ms) through ESP32 timeouts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statements per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+# Label combinations per metric; further ones are folded into a single 'other' series so
+# free-text labels (locations) cannot grow memory without bound
+MAX_SERIES = 500
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            key = ('other',) * len(self.labelnames)
+        return key
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def collect(self):
+        """{label values: value} of every series."""
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def combine(a, b):
+        """The value of one series over two processes."""
+        return a + b
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def render(self, series):
+        lines = self._header()
+        lines += [f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                  for key, value in sorted(series.items())]
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts plus +Inf, then sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._series.items()}
+
+    @staticmethod
+    def combine(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+    def render(self, series):
+        lines = self._header()
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read from `callback()` at scrape time, for state that already lives elsewhere."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def collect(self):
+        return {(): self.callback()}
+
+    def render(self, series):
+        return self._header() + [f'{self.name} {_format_value(value)}' for value in series.values()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._directory = None
+        self._path = None
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering returns the existing metric, so module reloads don't duplicate series
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        metric = self._register(Gauge(name, documentation, callback))
+        metric.callback = callback
+        return metric
+
+    def _sorted(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def render(self):
+        metrics = self._sorted()
+        if self._directory is None:
+            series = {metric.name: metric.collect() for metric in metrics}
+        else:
+            self.flush()
+            series = self._combined()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(series.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def share(self, directory, interval=5.0):
+        """Write this process's series to `directory` now, every `interval` seconds and at
+        exit, and have render() report the sum over every file there. Call it in each
+        process after it has been forked."""
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._path = os.path.join(directory, f'{os.getpid()}.json')
+        self.flush()
+        atexit.register(self.flush)
+        stop = threading.Event()
+        atexit.register(stop.set)
+        threading.Thread(target=self._flush_every, args=(interval, stop), name='metrics-flush', daemon=True).start()
+
+    def flush(self):
+        snapshot = {
+            metric.name: {'kind': metric.kind, 'series': [[list(key), value] for key, value in metric.collect().items()]}
+            for metric in self._sorted()
+        }
+        _write_json(self._path, snapshot)
+
+    def _flush_every(self, interval, stop):
+        while not stop.wait(interval):
+            self.flush()
+
+    def _combined(self):
+        series = {}
+        for snapshot in _read_snapshots(self._directory):
+            for name, entry in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or metric.kind != entry['kind']:
+                    continue
+                combined = series.setdefault(name, {})
+                for key, value in entry['series']:
+                    key = tuple(key)
+                    combined[key] = metric.combine(combined[key], value) if key in combined else value
+        return series
+
+
+def _write_json(path, data):
+    # Written aside and renamed into place, so readers never see half a file
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def _read_snapshots(directory):
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def mark_process_dead(directory, pid):
+    """Drop the gauges of an exited process from `directory`; its counters and histograms
+    keep counting towards the totals."""
+    path = os.path.join(directory, f'{pid}.json')
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    _write_json(path, {name: entry for name, entry in snapshot.items() if entry['kind'] != 'gauge'})
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
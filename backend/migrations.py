@@ -0,0 +1,200 @@
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, text
+
+# db.create_all() only creates missing tables; it never adds columns or indexes to a
+# table that already exists. Schema changes to existing tables go here as numbered steps.
+# Steps must be idempotent, since a fresh database already has everything create_all built.
+
+
+def _entry_log_indexes(conn):
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_entry_log_vehicle_timestamp ON entry_log (vehicle_id, timestamp)'
+    ))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_entry_log_timestamp_type ON entry_log (timestamp, entry_type)'
+    ))
+
+
+def _vehicle_image_thumbnails(conn):
+    existing = {column['name'] for column in inspect(conn).get_columns('vehicle_image')}
+    for column in ('thumbnail_small', 'thumbnail_medium'):
+        if column not in existing:
+            conn.execute(text(f'ALTER TABLE vehicle_image ADD COLUMN {column} VARCHAR(80)'))
+
+
+def _vehicle_qr_key_version(conn):
+    existing = {column['name'] for column in inspect(conn).get_columns('vehicle')}
+    if 'qr_key_version' not in existing:
+        conn.execute(text('ALTER TABLE vehicle ADD COLUMN qr_key_version INTEGER'))
+
+
+def _timestamptz_columns(conn):
+    # SQLite has no time zone type; on PostgreSQL, tables created before DateTime columns
+    # became timezone-aware hold naive timestamps. They were written as UTC, which is the
+    # session time zone the app connects with.
+    if conn.dialect.name != 'postgresql':
+        return
+    rows = conn.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND data_type = 'timestamp without time zone' "
+        "AND table_name <> 'schema_migration'"
+    )).all()
+    for table_name, column_name in rows:
+        conn.execute(text(
+            f'ALTER TABLE "{table_name}" ALTER COLUMN "{column_name}" TYPE TIMESTAMP WITH TIME ZONE'
+        ))
+
+
+class MigrationError(Exception):
+    """A migration needs something from the operator before it can run."""
+
+
+# Columns holding scan times. Before scans were converted to UTC at ingest, SQLite stored
+# a scanner's timestamp as the device's local wall-clock time, while scans without one got
+# the server's UTC clock. Scanners send whole milliseconds and the server clock has
+# microseconds, which tells the two apart row by row; the other columns were always UTC.
+SCAN_TIME_COLUMNS = {
+    'entry_log': ('timestamp',),
+    'entry_log_archive': ('period_start', 'period_end'),
+    'vehicle_presence': ('last_timestamp',),
+    'vehicle_visit': ('entered_at', 'exited_at'),
+}
+SCAN_TIMES_UTC_VERSION = 5
+
+
+def scan_time_columns(conn):
+    """{table: columns} of SCAN_TIME_COLUMNS plus every entry_log_archive_YYYYMM table present."""
+    tables = inspect(conn).get_table_names()
+    columns = {table: names for table, names in SCAN_TIME_COLUMNS.items() if table in tables}
+    for table in tables:
+        suffix = table.removeprefix('entry_log_archive_')
+        if suffix != table and suffix.isdigit():
+            columns[table] = ('timestamp',)
+    return columns
+
+
+def local_scan_time_columns(conn):
+    """scan_time_columns() of a SQLite database whose scan times are still local time, or {}
+    when it has been through _scan_times_to_utc or has no entries. Reads only."""
+    inspector = inspect(conn)
+    if inspector.has_table('schema_migration') and conn.execute(
+            text('SELECT 1 FROM schema_migration WHERE version = :version'),
+            {'version': SCAN_TIMES_UTC_VERSION}).first():
+        return {}
+    if not inspector.has_table('entry_log') or conn.execute(text('SELECT 1 FROM entry_log LIMIT 1')).first() is None:
+        return {}
+    return scan_time_columns(conn)
+
+
+def is_scanner_time(value):
+    """True for a naive scan time from a not yet migrated database that came from a
+    scanner's clock (whole milliseconds), False for one from the server's UTC clock."""
+    return value.microsecond % 1000 == 0
+
+
+def parse_utc_offset(value):
+    """timezone for an ISO 8601 offset such as '+08:00', '-0530' or 'Z'."""
+    try:
+        return datetime.strptime(value.strip().replace('Z', '+00:00'), '%z').tzinfo
+    except ValueError:
+        raise ValueError(f'Invalid UTC offset {value!r}; expected e.g. +08:00') from None
+
+
+def _scan_times_to_utc(conn):
+    # PostgreSQL's timezone-aware columns always stored the instant, so only SQLite can hold
+    # local scan times. The devices' offset can't be recovered from the data; the operator
+    # supplies it.
+    if conn.dialect.name != 'sqlite':
+        return
+    columns = local_scan_time_columns(conn)
+    if not columns:
+        return
+    value = os.getenv('LEGACY_SCAN_UTC_OFFSET')
+    if not value:
+        raise MigrationError(
+            'Existing scan times are stored as the scanners\' local time. Set LEGACY_SCAN_UTC_OFFSET '
+            'to their UTC offset (e.g. +08:00, or +00:00 to keep them as they are) and run again'
+        )
+    try:
+        offset = parse_utc_offset(value).utcoffset(None)
+    except ValueError as e:
+        raise MigrationError(f'LEGACY_SCAN_UTC_OFFSET: {e}') from None
+    if not offset:
+        return
+    # datetime() drops the fraction, which is carried over from the stored value. Values
+    # are stored as 'YYYY-MM-DD HH:MM:SS.ffffff', so the last three digits are zero for
+    # scanner times only (see is_scanner_time); presence, visits and archive months copy
+    # their entries' values and are shifted alike.
+    shift = f'{-int(offset.total_seconds()) // 60:+d} minutes'
+    for table, names in columns.items():
+        for name in names:
+            conn.execute(text(
+                f'UPDATE "{table}" SET "{name}" = datetime("{name}", :shift) || substr("{name}", 20) '
+                f'WHERE "{name}" IS NOT NULL AND substr("{name}", 24, 3) IN (\'000\', \'\')'
+            ), {'shift': shift})
+
+
+def _vehicle_presence_last_location(conn):
+    existing = {column['name'] for column in inspect(conn).get_columns('vehicle_presence')}
+    if 'last_location' not in existing:
+        conn.execute(text('ALTER TABLE vehicle_presence ADD COLUMN last_location VARCHAR(100)'))
+    conn.execute(text(
+        'UPDATE vehicle_presence SET last_location = '
+        '(SELECT location FROM entry_log WHERE entry_log.id = vehicle_presence.last_entry_id) '
+        'WHERE last_location IS NULL'
+    ))
+
+
+def _scan_receipt_entry_fk(conn):
+    # Receipts now outlive the entries archive_entries moves out of entry_log. SQLite doesn't
+    # enforce foreign keys unless asked to, so only PostgreSQL needs the constraint dropped.
+    if conn.dialect.name != 'postgresql':
+        return
+    for foreign_key in inspect(conn).get_foreign_keys('scan_receipt'):
+        if foreign_key['referred_table'] == 'entry_log' and foreign_key['name']:
+            conn.execute(text(f'ALTER TABLE scan_receipt DROP CONSTRAINT "{foreign_key["name"]}"'))
+
+
+MIGRATIONS = [
+    (1, 'entry_log composite indexes', _entry_log_indexes),
+    (2, 'vehicle_image thumbnail columns', _vehicle_image_thumbnails),
+    (3, 'vehicle qr_key_version column', _vehicle_qr_key_version),
+    (4, 'timezone-aware timestamps on PostgreSQL', _timestamptz_columns),
+    (SCAN_TIMES_UTC_VERSION, 'scan times in UTC on SQLite', _scan_times_to_utc),
+    (6, 'vehicle_presence last_location column', _vehicle_presence_last_location),
+    (7, 'scan_receipt entry_id without foreign key', _scan_receipt_entry_fk),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migration ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR(200) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migration'))}
+
+
+def upgrade(engine):
+    """Apply pending migrations in order, each in its own transaction. Returns the names applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(
+                text('INSERT INTO schema_migration (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {'version': version, 'name': name, 'applied_at': datetime.now(timezone.utc)}
+            )
+        applied.append(name)
+    return applied
@@ -0,0 +1,98 @@
+import io
+from datetime import date, datetime
+
+from sqlalchemy import inspect
+
+from migrations import is_scanner_time
+
+# Bulk copy from a SQLite database into PostgreSQL with COPY ... FROM STDIN, a batch of
+# rows at a time, so memory stays flat however large the entry log is.
+
+
+def _csv_field(value, zone=None):
+    # COPY's CSV format reads an unquoted empty field as NULL and "" as an empty string
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        # Naive scanner times are wall-clock time in `zone` when one is given; everything
+        # else is UTC, the target session's time zone
+        if zone is not None and value.tzinfo is None and is_scanner_time(value):
+            value = value.replace(tzinfo=zone)
+        value = value.isoformat(' ')
+    elif isinstance(value, date):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _csv_rows(rows, zones):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_csv_field(value, zone) for value, zone in zip(row, zones)))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_table(source, target, table, batch_rows=50000, local_columns=(), zone=None):
+    """Copy every row of `table` from the `source` connection into `target` (a PostgreSQL
+    connection) using COPY. Only columns present on both sides are copied, so a source
+    that predates newer columns still loads. Naive scanner times (is_scanner_time) in
+    `local_columns` are read as wall-clock time in `zone`. Returns the number of rows copied."""
+    inspector = inspect(source)
+    if not inspector.has_table(table.name):
+        return 0
+    source_columns = {column['name'] for column in inspector.get_columns(table.name)}
+    columns = [column for column in table.columns if column.name in source_columns]
+    zones = [zone if column.name in local_columns else None for column in columns]
+    quote = target.dialect.identifier_preparer.quote
+    statement = (
+        f"COPY {quote(table.name)} ({', '.join(quote(column.name) for column in columns)}) "
+        f"FROM STDIN WITH (FORMAT csv)"
+    )
+
+    cursor = target.connection.dbapi_connection.cursor()
+    copied = 0
+    result = source.execution_options(stream_results=True).execute(table.select().with_only_columns(*columns))
+    for rows in result.partitions(batch_rows):
+        cursor.copy_expert(statement, _csv_rows(rows, zones))
+        copied += len(rows)
+    cursor.close()
+    return copied
+
+
+def reset_sequence(target, table, column='id'):
+    """Point the serial sequence behind `table.column` past the copied rows."""
+    quote = target.dialect.identifier_preparer.quote
+    target.exec_driver_sql(
+        f"SELECT setval(pg_get_serial_sequence('{quote(table.name)}', '{column}'), "
+        f"COALESCE(MAX({quote(column)}), 1), MAX({quote(column)}) IS NOT NULL) FROM {quote(table.name)}"
+    )
+
+
+def copy_database(source_engine, target_engine, tables, batch_rows=50000, on_table=None,
+                  local_columns=None, zone=None):
+    """Replace the contents of `tables` (parents before children) in the target with the
+    source's rows, in one transaction. Scanner times in `local_columns` ({table name:
+    column names}) hold wall-clock time in `zone` rather than UTC. Returns {table name: rows copied}."""
+    counts = {}
+    quote = target_engine.dialect.identifier_preparer.quote
+    with source_engine.connect() as source, target_engine.begin() as target:
+        target.exec_driver_sql(
+            f"TRUNCATE {', '.join(quote(table.name) for table in tables)} RESTART IDENTITY CASCADE"
+        )
+        for table in tables:
+            counts[table.name] = copy_table(source, target, table, batch_rows,
+                                            (local_columns or {}).get(table.name, ()), zone)
+            if 'id' in table.columns and table.columns['id'].primary_key:
+                reset_sequence(target, table)
+            if on_table:
+                on_table(table.name, counts[table.name])
+    # Fresh statistics so the planner doesn't treat the new tables as empty
+    with target_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as target:
+        for table in tables:
+            target.exec_driver_sql(f'ANALYZE {quote(table.name)}')
+    return counts
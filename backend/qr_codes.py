@@ -0,0 +1,29 @@
+import io
+
+# Kept free of Flask and database imports: render_qr_png runs in process-pool workers.
+# qrcode (and Pillow behind it) is imported on first render, not at API startup.
+
+
+def render_qr_png(data):
+    """PNG bytes of a QR code for `data`."""
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_qr_pngs(payloads, pool=None, chunksize=64):
+    """Render many QR codes in input order, across `pool` (a ProcessPoolExecutor) when given."""
+    if pool is None:
+        return [render_qr_png(data) for data in payloads]
+    return list(pool.map(render_qr_png, payloads, chunksize=chunksize))
@@ -0,0 +1,187 @@
+import io
+import zipfile
+import zlib
+from collections import deque
+
+from qr_codes import render_qr_png
+
+# Kept free of Flask and database imports: render_page_* run in process-pool workers.
+# Pillow is imported on first render so the API doesn't load it at startup.
+
+DPI = 300
+# Paper sizes in inches
+PAPER_SIZES = {'a4': (8.27, 11.69), 'letter': (8.5, 11.0)}
+COLUMNS = 3
+ROWS = 4
+MARGIN = 150
+CAPTION_SIZE = 44
+
+
+def page_capacity():
+    return COLUMNS * ROWS
+
+
+def _load_qr(item):
+    # item is (blob path or None, payload, plate, owner); stored PNGs are used as-is so the
+    # sheet matches what the vehicle record holds, older codes are rendered from the payload
+    from PIL import Image
+    path, payload, _, _ = item
+    if path:
+        return Image.open(path)
+    return Image.open(io.BytesIO(render_qr_png(payload)))
+
+
+def _fit_text(draw, text, font, width):
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '...', font=font) > width:
+        text = text[:-1]
+    return text + '...'
+
+
+def render_page(paper, items):
+    """One sheet as a grayscale image: a grid of QR codes, each captioned with plate and owner."""
+    from PIL import Image, ImageDraw, ImageFont
+    width_in, height_in = PAPER_SIZES[paper]
+    width, height = round(width_in * DPI), round(height_in * DPI)
+    page = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    plate_font = ImageFont.load_default(size=CAPTION_SIZE)
+    owner_font = ImageFont.load_default(size=round(CAPTION_SIZE * 0.75))
+
+    cell_width = (width - 2 * MARGIN) // COLUMNS
+    cell_height = (height - 2 * MARGIN) // ROWS
+    caption_height = round(CAPTION_SIZE * 2.6)
+    qr_size = min(cell_width, cell_height - caption_height) - 40
+
+    for index, item in enumerate(items):
+        column, row = index % COLUMNS, index // COLUMNS
+        left = MARGIN + column * cell_width
+        top = MARGIN + row * cell_height
+        # Light cut guides around each sticker
+        draw.rectangle([left, top, left + cell_width - 1, top + cell_height - 1], outline=200, width=2)
+
+        with _load_qr(item) as qr_image:
+            # Nearest-neighbour keeps module edges sharp for scanners
+            qr_image = qr_image.convert('L').resize((qr_size, qr_size), Image.NEAREST)
+        page.paste(qr_image, (left + (cell_width - qr_size) // 2, top + 20))
+
+        _, _, plate, owner = item
+        center = left + cell_width // 2
+        text_top = top + 20 + qr_size + 10
+        draw.text((center, text_top), _fit_text(draw, plate, plate_font, cell_width - 20),
+                  fill=0, font=plate_font, anchor='ma')
+        if owner:
+            draw.text((center, text_top + round(CAPTION_SIZE * 1.3)), _fit_text(draw, owner, owner_font, cell_width - 20),
+                      fill=80, font=owner_font, anchor='ma')
+    return page
+
+
+def render_page_png(job):
+    paper, items = job
+    buffer = io.BytesIO()
+    render_page(paper, items).save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def render_page_pdf(job):
+    """(width, height, Flate-compressed 8-bit gray pixels) for one PDF page image."""
+    paper, items = job
+    page = render_page(paper, items)
+    return page.width, page.height, zlib.compress(page.tobytes(), 6)
+
+
+def imap_bounded(pool, fn, jobs, window):
+    """Like pool.map, but only `window` jobs are in flight, so results never pile up in memory.
+    Closing the generator early cancels the jobs not yet started."""
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.submit(fn, job) if pool else job)
+            if len(pending) >= window:
+                yield _result(pending.popleft(), fn, pool)
+        while pending:
+            yield _result(pending.popleft(), fn, pool)
+    finally:
+        if pool:
+            for future in pending:
+                future.cancel()
+
+
+def _result(pending, fn, pool):
+    return pending.result() if pool else fn(pending)
+
+
+def stream_pdf(pages, paper):
+    """Write a PDF incrementally from rendered page images, yielding bytes as it goes.
+
+    Object 1 is the catalog and object 2 the page tree, written last once every page is known.
+    """
+    width_in, height_in = PAPER_SIZES[paper]
+    media_box = f'[0 0 {width_in * 72:.2f} {height_in * 72:.2f}]'
+    offsets = {}
+    position = 0
+    next_id = 3
+    kids = []
+
+    def emit(object_id, body):
+        nonlocal position
+        offsets[object_id] = position
+        chunk = f'{object_id} 0 obj\n'.encode() + body + b'\nendobj\n'
+        position += len(chunk)
+        return chunk
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header
+    yield emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    for width, height, data in pages:
+        image_id, content_id, page_id = next_id, next_id + 1, next_id + 2
+        next_id += 3
+        yield emit(image_id, (
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            f'/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>\nstream\n'
+        ).encode() + data + b'\nendstream')
+        content = f'q {width_in * 72:.2f} 0 0 {height_in * 72:.2f} 0 0 cm /Im0 Do Q'.encode()
+        yield emit(content_id, f'<< /Length {len(content)} >>\nstream\n'.encode() + content + b'\nendstream')
+        yield emit(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox {media_box} '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode())
+        kids.append(page_id)
+
+    yield emit(2, f'<< /Type /Pages /Kids [{" ".join(f"{kid} 0 R" for kid in kids)}] /Count {len(kids)} >>'.encode())
+
+    xref = [f'xref\n0 {next_id}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[object_id]:010d} 00000 n \n' for object_id in range(1, next_id)]
+    yield ''.join(xref).encode()
+    yield f'trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n'.encode()
+
+
+class _ChunkBuffer:
+    # Write-only file object for zipfile; the caller drains it after every entry
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_png_zip(pages):
+    """Zip rendered PNG pages as sheet-001.png, sheet-002.png, ..., yielding bytes as it goes."""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for number, png in enumerate(pages, 1):
+            archive.writestr(f'sheet-{number:03d}.png', png)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Bulk QR rendering (imports, sticker sheets, reissues) runs in worker processes. An API
+# process keeps one pool for all of its requests instead of starting one per request, and
+# starts its processes with spawn: forking a process that serves requests on other
+# threads or greenlets copies their held locks into the child.
+
+
+class RenderPool:
+    """A ProcessPoolExecutor of `workers` processes, started on first use, that at most
+    `max_jobs` callers use at once. Callers take a slot with acquire() and release it when
+    their last page or code is rendered.
+    """
+
+    def __init__(self, workers=None, max_jobs=1):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self._reset()
+        # A forked child (a gunicorn worker of a preloaded app) starts its own pool
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._slots = threading.BoundedSemaphore(self.max_jobs)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def acquire(self, timeout=None):
+        """A RenderJob holding a slot, or None when none frees up within `timeout` seconds."""
+        if not self._slots.acquire(timeout=timeout):
+            return None
+        return RenderJob(self)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class RenderJob:
+    """One slot of a RenderPool; release() is safe to call more than once."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._released = False
+
+    @property
+    def executor(self):
+        """The shared executor, or None for a one-process pool, which renders inline."""
+        if self._released:
+            raise RuntimeError('RenderJob used after release')
+        return self.pool._get_executor() if self.pool.workers > 1 else None
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.pool._slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ScanDebouncer:
+    """Suppresses repeat scans of the same key within a time window.
+
+    The first scan claims the key and records its result; repeats inside the window get
+    that result back instead of being processed again. A repeat that arrives while the
+    first scan is still running waits for it rather than racing it, up to wait_timeout. The
+    window is per process; scan_qr_code backs it with a check of the vehicle's last entry,
+    which every worker sees.
+    """
+
+    def __init__(self, window, maxsize=10000, wait_timeout=10):
+        self.window = window
+        self.maxsize = maxsize
+        self.wait_timeout = wait_timeout
+        self.suppressed = 0
+        self.taken_over = 0
+        self._data = OrderedDict()  # key -> [result, expires_at, done event]
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def claim(self, key):
+        """Returns (result, None) with the result of a recent scan of `key`, or (None, token)
+        when the caller should process this one and then pass the token to finish() or release().
+
+        A scan still unfinished after wait_timeout is presumed stuck: the waiter takes the key
+        over, and the stuck scan's finish() or release() no longer touches it.
+        """
+        while True:
+            with self._lock:
+                slot = self._data.get(key)
+                if slot is None or (slot[1] is not None and slot[1] <= time.monotonic()):
+                    return None, self._take(key)
+                if slot[1] is not None:
+                    self.suppressed += 1
+                    return slot[0], None
+                done = slot[2]
+            # First scan still in progress; once it finishes either its result is there or the key is free
+            if not done.wait(self.wait_timeout):
+                with self._lock:
+                    if self._data.get(key) is slot:
+                        self.taken_over += 1
+                        slot[2].set()
+                        return None, self._take(key)
+                # Finished, released or taken over by another waiter meanwhile: look again
+
+    def finish(self, key, token, result):
+        with self._lock:
+            slot = self._data.get(key)
+            if slot is not token:
+                return
+            slot[0], slot[1] = result, time.monotonic() + self.window
+            slot[2].set()
+
+    def release(self, key, token):
+        """Drop a claim whose scan failed, so the next scan is processed normally."""
+        with self._lock:
+            if self._data.get(key) is not token:
+                return
+            del self._data[key]
+        token[2].set()
+
+    def _take(self, key):
+        slot = self._data[key] = [None, None, threading.Event()]
+        self._data.move_to_end(key)
+        self._evict()
+        return slot
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            _, slot = self._data.popitem(last=False)
+            slot[2].set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window_seconds': self.window,
+                'size': len(self._data),
+                'suppressed': self.suppressed,
+                'taken_over': self.taken_over,
+            }
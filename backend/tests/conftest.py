@@ -0,0 +1,51 @@
+import os
+
+# Settings app.py reads at import: no event relay sockets, no debounce window (tests that
+# need one build their own ScanDebouncer)
+os.environ.setdefault('EVENT_RELAY', 'none')
+os.environ.setdefault('SCAN_DEBOUNCE_SECONDS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import pytest
+
+import app as gate_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = gate_app.create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'gate.db'}",
+        'BLOB_STORAGE_PATH': str(tmp_path / 'blobs'),
+    })
+    with app.app_context():
+        gate_app.bootstrap_database()
+        yield app
+        gate_app.db.session.remove()
+        gate_app.db.engine.dispose()
+    # Module-level caches outlive each app; ids repeat across the per-test databases
+    gate_app.vehicle_cache.clear()
+    gate_app.principal_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    response = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'})
+    return {'Authorization': f"Bearer {response.json['access_token']}"}
+
+
+@pytest.fixture
+def make_vehicle(app):
+    """Create a vehicle owned by the admin; returns (vehicle id, signed QR payload)."""
+    def make(plate_number='TEST-1'):
+        admin = gate_app.User.query.filter_by(username='admin').one()
+        vehicle = gate_app.Vehicle(plate_number=plate_number, vehicle_type='car', make='', model='',
+                                   color='', qr_code=gate_app.pending_qr_code(plate_number), user_id=admin.id)
+        gate_app.db.session.add(vehicle)
+        gate_app.db.session.commit()
+        return vehicle.id, gate_app.qr_signer.sign(vehicle.id, plate_number)
+    return make
@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+import app as gate_app
+
+db = gate_app.db
+
+
+def add_entries(vehicle_id, *items):
+    rows = [gate_app.EntryLog(vehicle_id=vehicle_id, entry_type=entry_type, location='Main Gate',
+                              timestamp=datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc))
+            for entry_type, timestamp in items]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def test_old_months_move_to_archive_tables(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    ids = add_entries(vehicle_id, ('in', '2020-01-05T08:00:00'), ('out', '2020-01-05T17:00:00'),
+                      ('in', '2020-02-03T08:00:00'), ('out', '2020-02-03T17:00:00'))
+    gate_app.rebuild_vehicle_presence()
+
+    moved = gate_app.archive_entries(horizon_days=180)
+
+    # The vehicle's latest entry stays hot for its presence row
+    assert moved == {'2020-01': 2, '2020-02': 1}
+    assert [row.id for row in gate_app.EntryLog.query.all()] == [ids[3]]
+    catalog = db.session.get(gate_app.EntryLogArchive, '2020-01')
+    assert (catalog.row_count, catalog.in_count, catalog.out_count) == (2, 1, 1)
+    assert gate_app.archive_entries(horizon_days=180) == {}
+
+
+def test_entry_log_source_spans_hot_and_archived_rows(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    ids = add_entries(vehicle_id, ('in', '2020-01-05T08:00:00'), ('out', '2020-01-05T17:00:00'),
+                      ('in', '2020-02-03T08:00:00'))
+    gate_app.rebuild_vehicle_presence()
+    gate_app.archive_entries(horizon_days=180)
+
+    # No archive month overlaps a range after them, so the hot table is queried alone
+    assert gate_app.entry_log_source(datetime(2020, 2, 1, tzinfo=timezone.utc)) is gate_app.EntryLog
+
+    Entry = gate_app.entry_log_source(datetime(2020, 1, 1, tzinfo=timezone.utc))
+    found = db.session.query(Entry.id, Entry.entry_type).order_by(Entry.timestamp).all()
+    assert found == [(ids[0], 'in'), (ids[1], 'out'), (ids[2], 'in')]
+
+    Entry = gate_app.entry_log_source(datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2020, 1, 31, tzinfo=timezone.utc))
+    assert db.session.query(db.func.count(Entry.id)).filter(
+        Entry.timestamp < datetime(2020, 1, 31, tzinfo=timezone.utc)).scalar() == 2
+
+
+def test_entries_endpoint_reads_archived_months(client, auth_headers, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    add_entries(vehicle_id, ('in', '2020-01-05T08:00:00'), ('out', '2020-01-05T17:00:00'),
+                ('in', '2020-02-03T08:00:00'))
+    gate_app.rebuild_vehicle_presence()
+    gate_app.archive_entries(horizon_days=180)
+
+    response = client.get('/api/entries?start=2020-01-01&end=2020-02-28', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json['total'] == 3
+    assert [entry['timestamp'] for entry in response.json['entries']] == [
+        '2020-02-03T08:00:00+00:00', '2020-01-05T17:00:00+00:00', '2020-01-05T08:00:00+00:00']
+
+
+def test_receipts_of_archived_entries_still_catch_resends(client, auth_headers, make_vehicle):
+    _, qr = make_vehicle()
+    scans = [{'client_scan_id': f's{n}', 'qr_data': qr, 'location': 'Main Gate', 'timestamp': timestamp}
+             for n, timestamp in enumerate(('2020-01-05T08:00:00Z', '2020-01-05T17:00:00Z', '2020-02-03T08:00:00Z'))]
+    first = client.post('/api/scan/batch', json={'scans': scans}, headers=auth_headers).json
+    assert gate_app.archive_entries(horizon_days=180) == {'2020-01': 2}
+
+    again = client.post('/api/scan/batch', json={'scans': scans}, headers=auth_headers).json
+    assert again['duplicates'] == 3
+    assert [(r['entry_id'], r['entry_type']) for r in again['results']] == \
+           [(r['entry_id'], r['entry_type']) for r in first['results']]
+
+
+def test_expired_receipts_are_pruned(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    [entry_id] = add_entries(vehicle_id, ('in', '2020-01-05T08:00:00'))
+    db.session.add_all([
+        gate_app.ScanReceipt(client_scan_id='old', entry_id=entry_id, created_at=datetime(2020, 1, 5, tzinfo=timezone.utc)),
+        gate_app.ScanReceipt(client_scan_id='new', entry_id=entry_id),
+    ])
+    db.session.commit()
+
+    assert gate_app.prune_scan_receipts(retention_days=90) == 1
+    assert [receipt.client_scan_id for receipt in gate_app.ScanReceipt.query.all()] == ['new']
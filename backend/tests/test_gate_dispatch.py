@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.esp32_stub import ESP32Stub
+from gate_dispatch import GateDispatcher
+
+
+class Results:
+    """on_result callback that records outcomes and lets a test wait for them."""
+
+    def __init__(self):
+        self.outcomes = {}
+        self._done = threading.Condition()
+
+    def __call__(self, command_id, delivered, attempts, error):
+        with self._done:
+            self.outcomes[command_id] = (delivered, attempts, error)
+            self._done.notify_all()
+
+    def wait(self, count, timeout=10):
+        with self._done:
+            assert self._done.wait_for(lambda: len(self.outcomes) >= count, timeout)
+        return self.outcomes
+
+
+@pytest.fixture
+def stub():
+    stub = ESP32Stub().start()
+    yield stub
+    stub.stop()
+
+
+def dispatcher(results, **kwargs):
+    kwargs.setdefault('workers', 2)
+    kwargs.setdefault('backoff', 0.01)
+    kwargs.setdefault('timeout', 2)
+    return GateDispatcher(results, **kwargs)
+
+
+def test_delivers_on_first_attempt(stub):
+    results = Results()
+    gate = dispatcher(results)
+    try:
+        assert gate.submit(1, f'{stub.url}/open')
+        assert gate.submit(2, f'{stub.url}/close')
+        outcomes = results.wait(2)
+    finally:
+        gate.stop(5)
+    assert outcomes == {1: (True, 1, None), 2: (True, 1, None)}
+    assert stub.requests == 2
+
+
+def test_server_errors_are_retried_with_backoff(stub):
+    stub.failure_rate = 1.0
+    results = Results()
+    gate = dispatcher(results, retries=3, backoff=0.05)
+    started = time.monotonic()
+    try:
+        gate.submit(1, f'{stub.url}/open')
+        outcomes = results.wait(1)
+    finally:
+        gate.stop(5)
+    delivered, attempts, error = outcomes[1]
+    assert not delivered
+    assert attempts == 4
+    assert '503' in error
+    assert stub.requests == 4
+    # Waits of 0.05, 0.1 and 0.2 seconds between the four attempts
+    assert time.monotonic() - started >= 0.35
+
+
+def test_retry_succeeds_once_the_controller_recovers(stub):
+    stub.failure_rate = 1.0
+    results = Results()
+    gate = dispatcher(results, retries=5, backoff=0.1)
+    try:
+        gate.submit(1, f'{stub.url}/open')
+        while stub.requests < 1:
+            time.sleep(0.01)
+        stub.failure_rate = 0.0
+        outcomes = results.wait(1)
+    finally:
+        gate.stop(5)
+    delivered, attempts, error = outcomes[1]
+    assert delivered and error is None
+    assert attempts == stub.requests >= 2
+    assert stub.position == 90
+
+
+def test_client_errors_are_not_retried(stub):
+    results = Results()
+    gate = dispatcher(results, retries=3)
+    try:
+        gate.submit(1, f'{stub.url}/missing')
+        outcomes = results.wait(1)
+    finally:
+        gate.stop(5)
+    assert outcomes[1] == (False, 1, 'Controller responded with status 404')
+    assert stub.requests == 1
+
+
+def test_unreachable_controller_uses_every_attempt(stub):
+    url = f'{stub.url}/open'
+    stub.stop()
+    results = Results()
+    gate = dispatcher(results, retries=2)
+    try:
+        gate.submit(1, url)
+        outcomes = results.wait(1)
+    finally:
+        gate.stop(5)
+    delivered, attempts, error = outcomes[1]
+    assert not delivered
+    assert attempts == 3
+    assert error.startswith('Controller unreachable')
+
+
+def test_full_queue_drops_the_command():
+    results = Results()
+    # No worker threads, so nothing drains the one queue slot
+    gate = dispatcher(results, workers=0, queue_size=1)
+    assert gate.submit(1, 'http://127.0.0.1:9/open')
+    assert not gate.submit(2, 'http://127.0.0.1:9/open')
+    assert results.outcomes == {2: (False, 0, 'Gate dispatch queue full')}
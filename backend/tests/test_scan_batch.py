@@ -0,0 +1,81 @@
+import app as gate_app
+
+
+def batch(client, headers, scans):
+    response = client.post('/api/scan/batch', json={'scans': scans}, headers=headers)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def scan(client_scan_id, qr_data, timestamp):
+    return {'client_scan_id': client_scan_id, 'qr_data': qr_data, 'location': 'Main Gate', 'timestamp': timestamp}
+
+
+def entries(vehicle_id):
+    return [(entry.entry_type, entry.timestamp.strftime('%H:%M')) for entry in
+            gate_app.EntryLog.query.filter_by(vehicle_id=vehicle_id).order_by(gate_app.EntryLog.timestamp)]
+
+
+def test_replays_toggle_in_timestamp_order(client, auth_headers, make_vehicle):
+    vehicle_id, qr = make_vehicle()
+    body = batch(client, auth_headers, [
+        scan('s3', qr, '2026-03-01T12:00:00Z'),
+        scan('s1', qr, '2026-03-01T08:00:00Z'),
+        scan('s2', qr, '2026-03-01T10:00:00Z'),
+    ])
+
+    assert body['recorded'] == 3
+    assert [result['entry_type'] for result in body['results']] == ['in', 'in', 'out']
+    assert entries(vehicle_id) == [('in', '08:00'), ('out', '10:00'), ('in', '12:00')]
+    presence = gate_app.db.session.get(gate_app.VehiclePresence, vehicle_id)
+    assert presence.state == 'in'
+
+
+def test_resent_batch_is_reported_as_duplicates(client, auth_headers, make_vehicle):
+    vehicle_id, qr = make_vehicle()
+    scans = [scan('s1', qr, '2026-03-01T08:00:00Z'), scan('s2', qr, '2026-03-01T10:00:00Z')]
+    first = batch(client, auth_headers, scans)
+    again = batch(client, auth_headers, scans)
+
+    assert again['recorded'] == 0
+    assert again['duplicates'] == 2
+    assert [(r['entry_id'], r['entry_type']) for r in again['results']] == \
+           [(r['entry_id'], r['entry_type']) for r in first['results']]
+    assert len(entries(vehicle_id)) == 2
+    assert gate_app.ScanReceipt.query.count() == 2
+
+
+def test_repeated_id_within_a_batch_is_recorded_once(client, auth_headers, make_vehicle):
+    vehicle_id, qr = make_vehicle()
+    body = batch(client, auth_headers, [scan('s1', qr, '2026-03-01T08:00:00Z'),
+                                        scan('s1', qr, '2026-03-01T08:00:00Z')])
+
+    assert [result['status'] for result in body['results']] == ['recorded', 'duplicate']
+    assert body['results'][0]['entry_id'] == body['results'][1]['entry_id']
+    assert len(entries(vehicle_id)) == 1
+
+
+def test_replay_before_recorded_entries_keeps_their_types(client, auth_headers, make_vehicle):
+    vehicle_id, qr = make_vehicle()
+    for timestamp in ('2026-03-01T10:00:00Z', '2026-03-01T12:00:00Z'):
+        response = client.post('/api/scan', json={'qr_data': qr, 'location': 'Main Gate', 'timestamp': timestamp},
+                               headers=auth_headers)
+        assert response.status_code == 200
+
+    batch(client, auth_headers, [scan('s1', qr, '2026-03-01T11:00:00Z'), scan('s2', qr, '2026-03-01T13:00:00Z')])
+
+    assert entries(vehicle_id) == [('in', '10:00'), ('out', '11:00'), ('out', '12:00'), ('in', '13:00')]
+    presence = gate_app.db.session.get(gate_app.VehiclePresence, vehicle_id)
+    assert presence.state == 'in'
+
+
+def test_invalid_scans_are_reported_per_item(client, auth_headers, make_vehicle):
+    _, qr = make_vehicle()
+    body = batch(client, auth_headers, [
+        scan('s1', qr, 'not a time'),
+        {'qr_data': qr, 'timestamp': '2026-03-01T08:00:00Z'},
+        scan('s3', 'VEHICLE:999:NOPE', '2026-03-01T08:00:00Z'),
+    ])
+
+    assert body['errors'] == 3
+    assert gate_app.EntryLog.query.count() == 0
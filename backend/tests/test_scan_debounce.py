@@ -0,0 +1,84 @@
+import threading
+import time
+
+from scan_debounce import ScanDebouncer
+
+
+def test_repeat_within_window_gets_first_result():
+    debouncer = ScanDebouncer(window=60)
+    result, token = debouncer.claim('sticker')
+    assert result is None and token is not None
+    debouncer.finish('sticker', token, {'entry_id': 1})
+
+    assert debouncer.claim('sticker') == ({'entry_id': 1}, None)
+    assert debouncer.suppressed == 1
+
+
+def test_claim_after_window_is_processed_again():
+    debouncer = ScanDebouncer(window=0.05)
+    _, token = debouncer.claim('sticker')
+    debouncer.finish('sticker', token, {'entry_id': 1})
+    time.sleep(0.1)
+
+    result, token = debouncer.claim('sticker')
+    assert result is None and token is not None
+
+
+def test_release_frees_the_key():
+    debouncer = ScanDebouncer(window=60)
+    _, token = debouncer.claim('sticker')
+    debouncer.release('sticker', token)
+
+    result, token = debouncer.claim('sticker')
+    assert result is None and token is not None
+
+
+def test_waiter_gets_result_of_scan_in_progress():
+    debouncer = ScanDebouncer(window=60, wait_timeout=5)
+    _, token = debouncer.claim('sticker')
+    claimed = []
+    waiter = threading.Thread(target=lambda: claimed.append(debouncer.claim('sticker')))
+    waiter.start()
+    time.sleep(0.05)
+    debouncer.finish('sticker', token, {'entry_id': 1})
+    waiter.join(5)
+
+    assert claimed == [({'entry_id': 1}, None)]
+
+
+def test_waiter_processes_scan_after_first_one_is_released():
+    debouncer = ScanDebouncer(window=60, wait_timeout=5)
+    _, token = debouncer.claim('sticker')
+    claimed = []
+    waiter = threading.Thread(target=lambda: claimed.append(debouncer.claim('sticker')))
+    waiter.start()
+    time.sleep(0.05)
+    debouncer.release('sticker', token)
+    waiter.join(5)
+
+    [(result, waiter_token)] = claimed
+    assert result is None and waiter_token is not None
+
+
+def test_stuck_scan_is_taken_over():
+    debouncer = ScanDebouncer(window=60, wait_timeout=0.05)
+    _, stuck = debouncer.claim('sticker')
+
+    result, token = debouncer.claim('sticker')
+    assert result is None and token is not None
+    assert debouncer.taken_over == 1
+
+    # The stuck scan finishing late leaves the new owner's claim alone
+    debouncer.finish('sticker', stuck, {'entry_id': 1})
+    debouncer.release('sticker', stuck)
+    debouncer.finish('sticker', token, {'entry_id': 2})
+    assert debouncer.claim('sticker') == ({'entry_id': 2}, None)
+
+
+def test_keys_are_independent():
+    debouncer = ScanDebouncer(window=60)
+    _, token = debouncer.claim(('sticker', 'Main Gate'))
+    debouncer.finish(('sticker', 'Main Gate'), token, {'entry_id': 1})
+
+    result, token = debouncer.claim(('sticker', 'Back Gate'))
+    assert result is None and token is not None
@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+
+import app as gate_app
+
+db = gate_app.db
+
+
+def at(timestamp):
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc)
+
+
+def add_entries(vehicle_id, *items):
+    rows = [gate_app.EntryLog(vehicle_id=vehicle_id, entry_type=entry_type, location='Main Gate', timestamp=at(timestamp))
+            for entry_type, timestamp in items]
+    db.session.add_all(rows)
+    db.session.flush()
+    return [row.id for row in rows]
+
+
+def visits(vehicle_id):
+    return [(visit.id, visit.entry_id, visit.exit_id, visit.duration_seconds) for visit in
+            gate_app.VehicleVisit.query.filter_by(vehicle_id=vehicle_id).order_by(gate_app.VehicleVisit.entered_at)]
+
+
+def test_rebuild_pairs_each_in_with_the_following_out(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    ids = add_entries(vehicle_id, ('in', '2026-03-01T08:00:00'), ('out', '2026-03-01T10:00:00'),
+                      ('in', '2026-03-01T12:00:00'), ('in', '2026-03-01T13:00:00'))
+
+    assert gate_app.rebuild_vehicle_visits() == 3
+    assert [visit[1:] for visit in visits(vehicle_id)] == [
+        (ids[0], ids[1], 7200), (ids[2], None, None), (ids[3], None, None)]
+
+
+def test_resync_closes_the_open_visit_in_place(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    ids = add_entries(vehicle_id, ('in', '2026-03-01T08:00:00'), ('out', '2026-03-01T10:00:00'),
+                      ('in', '2026-03-01T12:00:00'))
+    gate_app.rebuild_vehicle_visits()
+    before = visits(vehicle_id)
+
+    [exit_id] = add_entries(vehicle_id, ('out', '2026-03-01T15:00:00'))
+    assert gate_app.resync_vehicle_visits(vehicle_id, at('2026-03-01T15:00:00')) == 1
+
+    assert visits(vehicle_id) == [before[0], (before[1][0], ids[2], exit_id, 3 * 3600)]
+
+
+def test_resync_of_a_replay_inside_a_visit_keeps_ids(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    ids = add_entries(vehicle_id, ('in', '2026-03-01T08:00:00'), ('out', '2026-03-01T12:00:00'),
+                      ('in', '2026-03-01T14:00:00'), ('out', '2026-03-01T16:00:00'))
+    gate_app.rebuild_vehicle_visits()
+    before = visits(vehicle_id)
+
+    # A replayed exit and re-entry between the first pair of recorded entries
+    replayed = add_entries(vehicle_id, ('out', '2026-03-01T09:00:00'), ('in', '2026-03-01T10:00:00'))
+    assert gate_app.resync_vehicle_visits(vehicle_id, at('2026-03-01T09:00:00')) == 2
+
+    assert visits(vehicle_id)[0] == (before[0][0], ids[0], replayed[0], 3600)
+    assert visits(vehicle_id)[1][1:] == (replayed[1], ids[1], 7200)
+    assert visits(vehicle_id)[2] == before[1]
+
+
+def test_resync_without_changes_writes_nothing(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    add_entries(vehicle_id, ('in', '2026-03-01T08:00:00'), ('out', '2026-03-01T10:00:00'))
+    gate_app.rebuild_vehicle_visits()
+
+    assert gate_app.resync_vehicle_visits(vehicle_id, at('2026-03-01T08:00:00')) == 0
+
+
+def test_resync_matches_a_full_rebuild(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    add_entries(vehicle_id, ('in', '2026-03-01T08:00:00'), ('out', '2026-03-01T09:00:00'),
+                ('in', '2026-03-02T08:00:00'))
+    gate_app.rebuild_vehicle_visits()
+    add_entries(vehicle_id, ('out', '2026-03-01T20:00:00'), ('in', '2026-03-01T21:00:00'),
+                ('out', '2026-03-02T18:00:00'))
+
+    gate_app.resync_vehicle_visits(vehicle_id, at('2026-03-01T20:00:00'))
+    resynced = [visit[1:] for visit in visits(vehicle_id)]
+    gate_app.rebuild_vehicle_visits()
+    assert resynced == [visit[1:] for visit in visits(vehicle_id)]
+
+
+def test_resync_reads_archived_entries(app, make_vehicle):
+    vehicle_id, _ = make_vehicle()
+    [entry_id, _] = add_entries(vehicle_id, ('in', '2020-01-31T20:00:00'), ('in', '2020-03-01T08:00:00'))
+    db.session.commit()
+    gate_app.rebuild_vehicle_presence()
+    gate_app.rebuild_vehicle_visits()
+    db.session.commit()
+    gate_app.archive_entries(horizon_days=180)
+    assert db.session.get(gate_app.EntryLog, entry_id) is None
+
+    # A late exit for the archived entry, recorded in the hot table
+    [exit_id] = add_entries(vehicle_id, ('out', '2020-02-01T06:00:00'))
+    gate_app.resync_vehicle_visits(vehicle_id, at('2020-02-01T06:00:00'))
+
+    assert visits(vehicle_id)[0][1:] == (entry_id, exit_id, 10 * 3600)
+
+
+def test_live_scans_open_and_close_visits(client, auth_headers, make_vehicle):
+    vehicle_id, qr = make_vehicle()
+    for timestamp in ('2026-03-01T08:00:00Z', '2026-03-01T08:30:00Z'):
+        response = client.post('/api/scan', json={'qr_data': qr, 'location': 'Main Gate', 'timestamp': timestamp},
+                               headers=auth_headers)
+        assert response.status_code == 200
+
+    [visit] = visits(vehicle_id)
+    assert visit[3] == 1800
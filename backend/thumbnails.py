@@ -0,0 +1,43 @@
+import io
+
+# Pillow is imported on first use so the API doesn't load it at startup
+# (name, longest edge in pixels), smallest first. 'small' covers the scan result card and
+# list thumbnails at 2x density, 'medium' the vehicle card's main image.
+THUMBNAIL_SIZES = (('small', 320), ('medium', 800))
+
+
+def thumbnail_format():
+    """WebP when this Pillow build can encode it, otherwise JPEG."""
+    from PIL import features
+    if features.check('webp'):
+        return 'WEBP', 'image/webp'
+    return 'JPEG', 'image/jpeg'
+
+
+def render_thumbnails(data, sizes=THUMBNAIL_SIZES, quality=80):
+    """Resize image bytes to each size. Returns {name: (bytes, content_type)}.
+
+    Images are never enlarged, and EXIF orientation is applied so phone photos
+    come out upright.
+    """
+    from PIL import Image, ImageOps
+    image_format, content_type = thumbnail_format()
+    largest = max(edge for _, edge in sizes)
+    thumbnails = {}
+
+    with Image.open(io.BytesIO(data)) as source:
+        # Lets the JPEG decoder downscale by 2/4/8 while decoding, far cheaper than a full decode
+        source.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA') or image_format == 'JPEG':
+            image = image.convert('RGB')
+
+        # Largest first, each step resizing the previous result instead of the original
+        for name, edge in sorted(sizes, key=lambda size: size[1], reverse=True):
+            image = image.copy()
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, quality=quality)
+            thumbnails[name] = (buffer.getvalue(), content_type)
+
+    return thumbnails
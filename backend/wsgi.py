@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`python app.py` runs Flask's single-process development server instead. Create or
+upgrade the schema with `flask --app app init-db` before starting.
+"""
+from app import create_app
+
+app = create_app()
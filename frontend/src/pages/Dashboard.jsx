@@ -24,7 +24,7 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(true)
   const [chartData, setChartData] = useState([])
   const [filterPeriod, setFilterPeriod] = useState('today')
-  const [allEntries, setAllEntries] = useState([])
+  const [periodTotals, setPeriodTotals] = useState({ in: 0, out: 0 })
   const [entriesFilter, setEntriesFilter] = useState({ type: 'all', entryType: ['in', 'out'], fromDate: null, toDate: null })
   const [showFilterDropdown, setShowFilterDropdown] = useState(false)
 
@@ -32,6 +32,74 @@ const Dashboard = () => {
     fetchData()
   }, [])
 
+  // Live updates: the server pushes each new entry and the stat changes it causes
+  useEffect(() => {
+    const token = localStorage.getItem('token')
+    if (!token) {
+      return
+    }
+    let events = null
+    let retryTimer = null
+    let stopped = false
+
+    const retryLater = () => {
+      retryTimer = setTimeout(() => {
+        fetchData()
+        connect()
+      }, 15000)
+    }
+
+    const connect = async () => {
+      // EventSource can't send the Authorization header; a stream token goes in the URL
+      // instead, so the access token never ends up in server or proxy logs
+      let streamToken
+      try {
+        streamToken = (await axios.post('/api/events/token')).data.token
+      } catch (error) {
+        if (!stopped) {
+          retryLater()
+        }
+        return
+      }
+      if (stopped) {
+        return
+      }
+      events = new EventSource(`/api/events?token=${encodeURIComponent(streamToken)}`)
+
+      events.addEventListener('entry', (event) => {
+        const entry = JSON.parse(event.data)
+        setRecentEntries(prev => [entry, ...prev.filter(e => e.id !== entry.id)].slice(0, 10))
+      })
+      events.addEventListener('stats', (event) => {
+        const delta = JSON.parse(event.data)
+        setStats(prev => prev && Object.fromEntries(
+          Object.entries(prev).map(([key, value]) => [key, value + (delta[key] || 0)])
+        ))
+      })
+      // Sent after offline replays or when this client fell too far behind to apply deltas
+      events.addEventListener('resync', () => {
+        fetchData()
+      })
+      // The browser reconnects dropped streams itself but gives up on an error status: the
+      // 503 of a server with too many open streams, or a 401 once the stream token expired.
+      // Try again later with a new token and catch up
+      events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) {
+          retryLater()
+        }
+      }
+    }
+    connect()
+
+    return () => {
+      stopped = true
+      clearTimeout(retryTimer)
+      if (events) {
+        events.close()
+      }
+    }
+  }, [])
+
   useEffect(() => {
     const handleClickOutside = (event) => {
       if (showFilterDropdown) {
@@ -49,22 +117,18 @@ const Dashboard = () => {
   }, [showFilterDropdown])
 
   useEffect(() => {
-    if (allEntries.length > 0) {
-      processChartData()
-    }
-  }, [filterPeriod, allEntries])
+    fetchChartData()
+  }, [filterPeriod])
 
   const fetchData = async () => {
     try {
-      const [statsRes, entriesRes, allEntriesRes] = await Promise.all([
+      const [statsRes, entriesRes] = await Promise.all([
         axios.get('/api/stats'),
-        axios.get('/api/entries?per_page=10'),
-        axios.get('/api/entries?per_page=1000')
+        axios.get('/api/entries?per_page=10&count=none')
       ])
       
       setStats(statsRes.data)
       setRecentEntries(entriesRes.data.entries)
-      setAllEntries(allEntriesRes.data.entries)
     } catch (error) {
       console.error('Error fetching data:', error)
     } finally {
@@ -72,7 +136,7 @@ const Dashboard = () => {
     }
   }
 
-  const filterEntriesByPeriod = (entries) => {
+  const getPeriodStart = () => {
     const now = new Date()
     let startDate = new Date()
 
@@ -104,107 +168,59 @@ const Dashboard = () => {
         startDate.setHours(0, 0, 0, 0)
     }
 
-    return entries.filter(entry => {
-      const entryDate = new Date(entry.timestamp)
-      return entryDate >= startDate && entryDate <= now
-    })
+    return startDate
   }
 
-  const processChartData = () => {
-    const filteredEntries = filterEntriesByPeriod(allEntries)
-    
-    if (filterPeriod === 'today') {
-      // Hourly data for today
-      const hourlyData = {}
-      filteredEntries.forEach(entry => {
-        const hour = new Date(entry.timestamp).getHours()
-        if (!hourlyData[hour]) {
-          hourlyData[hour] = { hour: `${hour}:00`, in: 0, out: 0 }
-        }
-        hourlyData[hour][entry.entry_type]++
-      })
-      
-      setChartData(Object.values(hourlyData).sort((a, b) => {
-        const hourA = parseInt(a.hour.split(':')[0])
-        const hourB = parseInt(b.hour.split(':')[0])
-        return hourA - hourB
-      }))
-    } else if (filterPeriod === 'daily') {
-      // Daily data for last 7 days
-      const dailyData = {}
-      filteredEntries.forEach(entry => {
-        const date = new Date(entry.timestamp)
-        const dateKey = date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' })
-        if (!dailyData[dateKey]) {
-          dailyData[dateKey] = { hour: dateKey, in: 0, out: 0 }
-        }
-        dailyData[dateKey][entry.entry_type]++
-      })
-      setChartData(Object.values(dailyData).sort((a, b) => {
-        return new Date(a.hour) - new Date(b.hour)
-      }))
-    } else if (filterPeriod === 'weekly') {
-      // Weekly data for last 4 weeks
-      const weeklyData = {}
-      filteredEntries.forEach(entry => {
-        const date = new Date(entry.timestamp)
-        const weekStart = new Date(date)
-        weekStart.setDate(date.getDate() - date.getDay())
-        const weekKey = weekStart.toLocaleDateString('en-US', { month: 'short', day: 'numeric' })
-        if (!weeklyData[weekKey]) {
-          weeklyData[weekKey] = { hour: weekKey, in: 0, out: 0 }
-        }
-        weeklyData[weekKey][entry.entry_type]++
-      })
-      setChartData(Object.values(weeklyData).sort((a, b) => {
-        return new Date(a.hour) - new Date(b.hour)
-      }))
-    } else if (filterPeriod === 'monthly') {
-      // Monthly data for last 6 months
-      const monthlyData = {}
-      filteredEntries.forEach(entry => {
-        const date = new Date(entry.timestamp)
-        const monthKey = date.toLocaleDateString('en-US', { month: 'short', year: 'numeric' })
-        if (!monthlyData[monthKey]) {
-          monthlyData[monthKey] = { hour: monthKey, in: 0, out: 0 }
-        }
-        monthlyData[monthKey][entry.entry_type]++
-      })
-      setChartData(Object.values(monthlyData).sort((a, b) => {
-        return new Date(a.hour) - new Date(b.hour)
-      }))
-    } else if (filterPeriod === 'yearly') {
-      // Yearly data for last year
-      const yearlyData = {}
-      filteredEntries.forEach(entry => {
-        const date = new Date(entry.timestamp)
-        const yearKey = date.toLocaleDateString('en-US', { month: 'short' })
-        if (!yearlyData[yearKey]) {
-          yearlyData[yearKey] = { hour: yearKey, in: 0, out: 0 }
+  const periodBuckets = {
+    today: 'hour',
+    daily: 'day',
+    weekly: 'week',
+    monthly: 'month',
+    yearly: 'month'
+  }
+
+  const formatBucketLabel = (bucket) => {
+    const date = new Date(bucket)
+    switch (filterPeriod) {
+      case 'today':
+        return `${date.getHours()}:00`
+      case 'daily':
+      case 'weekly':
+        return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' })
+      case 'monthly':
+        return date.toLocaleDateString('en-US', { month: 'short', year: 'numeric' })
+      default:
+        return date.toLocaleDateString('en-US', { month: 'short' })
+    }
+  }
+
+  const fetchChartData = async () => {
+    try {
+      const response = await axios.get('/api/stats/timeseries', {
+        params: {
+          bucket: periodBuckets[filterPeriod] || 'hour',
+          start: getPeriodStart().toISOString(),
+          end: new Date().toISOString(),
+          // Bucket by this browser's calendar days rather than UTC days
+          utc_offset: -new Date().getTimezoneOffset()
         }
-        yearlyData[yearKey][entry.entry_type]++
       })
-      setChartData(Object.values(yearlyData).sort((a, b) => {
-        return new Date(a.hour) - new Date(b.hour)
-      }))
+
+      setChartData(response.data.series.map(point => ({
+        hour: formatBucketLabel(point.bucket),
+        in: point.in,
+        out: point.out
+      })))
+      setPeriodTotals(response.data.totals)
+    } catch (error) {
+      console.error('Error fetching chart data:', error)
     }
   }
-  
-  const getFilteredPieData = () => {
-    const filteredEntries = filterEntriesByPeriod(allEntries)
-    const typeData = { in: 0, out: 0 }
-    
-    filteredEntries.forEach(entry => {
-      typeData[entry.entry_type]++
-    })
-    
-    return [
-      { name: 'Entries', value: typeData.in || 0, color: '#4CAF50' },
-      { name: 'Exits', value: typeData.out || 0, color: '#FF4C4C' }
-    ].filter(item => item.value > 0)
-  }
 
-  const pieData = allEntries.length > 0 ? getFilteredPieData() : []
+  const pieData = [
+    { name: 'Entries', value: periodTotals.in || 0, color: '#4CAF50' },
+    { name: 'Exits', value: periodTotals.out || 0, color: '#FF4C4C' }
+  ].filter(item => item.value > 0)
 
   const getFilteredRecentEntries = () => {
     let filtered = [...recentEntries]
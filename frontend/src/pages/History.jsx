@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react'
 import axios from 'axios'
-import { FiLogIn, FiLogOut, FiFilter, FiTrash2, FiCalendar, FiX } from 'react-icons/fi'
+import { FiLogIn, FiLogOut, FiFilter, FiTrash2, FiCalendar, FiX, FiDownload } from 'react-icons/fi'
 import './History.css'
 
 const History = () => {
@@ -12,11 +12,11 @@ const History = () => {
   const [pagination, setPagination] = useState({})
   const [entriesFilter, setEntriesFilter] = useState({ type: 'all', entryType: ['in', 'out'], fromDate: null, toDate: null })
   const [showFilterDropdown, setShowFilterDropdown] = useState(false)
-  const [allEntries, setAllEntries] = useState([])
+  const [appliedFilter, setAppliedFilter] = useState(entriesFilter)
 
   useEffect(() => {
     fetchEntries()
-  }, [filters])
+  }, [filters, appliedFilter])
 
   useEffect(() => {
     const handleClickOutside = (event) => {
@@ -34,12 +34,58 @@ const History = () => {
     }
   }, [showFilterDropdown])
 
+  const toLocalDateString = (date) => {
+    const pad = (n) => String(n).padStart(2, '0')
+    return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}`
+  }
+
+  const getDateRange = (filter) => {
+    const now = new Date()
+    let startDate = new Date()
+    let endDate = new Date()
+
+    switch (filter.type) {
+      case 'daily':
+        startDate.setDate(now.getDate() - 1)
+        break
+      case 'weekly':
+        startDate.setDate(now.getDate() - 7)
+        break
+      case 'monthly':
+        startDate.setMonth(now.getMonth() - 1)
+        break
+      case 'yearly':
+        startDate.setFullYear(now.getFullYear() - 1)
+        break
+      case 'range':
+        if (!filter.fromDate || !filter.toDate) {
+          return {}
+        }
+        startDate = new Date(`${filter.fromDate}T00:00:00`)
+        endDate = new Date(`${filter.toDate}T00:00:00`)
+        break
+      default:
+        return {}
+    }
+
+    startDate.setHours(0, 0, 0, 0)
+    endDate.setHours(23, 59, 59, 999)
+    // Local days, sent as UTC instants to match the stored timestamps
+    return { start: startDate.toISOString(), end: endDate.toISOString() }
+  }
+
   const fetchEntries = async () => {
     try {
       setLoading(true)
       const params = {
         page: filters.page,
-        per_page: 50
+        per_page: 50,
+        ...getDateRange(appliedFilter)
+      }
+
+      // Both types selected means no type filter
+      if (appliedFilter.entryType && appliedFilter.entryType.length === 1) {
+        params.type = appliedFilter.entryType[0]
       }
       
       const response = await axios.get('/api/entries', { params })
@@ -49,9 +95,6 @@ const History = () => {
         pages: response.data.pages,
         current_page: response.data.current_page
       })
-
-      const allEntriesRes = await axios.get('/api/entries?per_page=10000')
-      setAllEntries(allEntriesRes.data.entries)
     } catch (error) {
       console.error('Error fetching entries:', error)
     } finally {
@@ -59,67 +102,31 @@ const History = () => {
     }
   }
 
-  const handlePageChange = (newPage) => {
-    setFilters({ ...filters, page: newPage })
-    window.scrollTo({ top: 0, behavior: 'smooth' })
-  }
-
-  const getFilteredEntries = () => {
-    let filtered = [...allEntries]
-
-    if (entriesFilter.type !== 'all') {
-      const now = new Date()
-      let startDate = new Date()
-      let endDate = new Date()
-
-      switch (entriesFilter.type) {
-        case 'daily':
-          startDate = new Date()
-          startDate.setDate(now.getDate() - 1)
-          startDate.setHours(0, 0, 0, 0)
-          endDate.setHours(23, 59, 59, 999)
-          break
-        case 'weekly':
-          startDate = new Date()
-          startDate.setDate(now.getDate() - 7)
-          startDate.setHours(0, 0, 0, 0)
-          endDate.setHours(23, 59, 59, 999)
-          break
-        case 'monthly':
-          startDate = new Date()
-          startDate.setMonth(now.getMonth() - 1)
-          startDate.setHours(0, 0, 0, 0)
-          endDate.setHours(23, 59, 59, 999)
-          break
-        case 'yearly':
-          startDate = new Date()
-          startDate.setFullYear(now.getFullYear() - 1)
-          startDate.setHours(0, 0, 0, 0)
-          endDate.setHours(23, 59, 59, 999)
-          break
-        case 'range':
-          if (entriesFilter.fromDate && entriesFilter.toDate) {
-            startDate = new Date(entriesFilter.fromDate)
-            startDate.setHours(0, 0, 0, 0)
-            endDate = new Date(entriesFilter.toDate)
-            endDate.setHours(23, 59, 59, 999)
-          }
-          break
-        default:
-          break
+  const handleExport = async () => {
+    try {
+      const params = { format: 'csv', ...getDateRange(appliedFilter) }
+      if (appliedFilter.entryType && appliedFilter.entryType.length === 1) {
+        params.type = appliedFilter.entryType[0]
       }
 
-      filtered = filtered.filter(entry => {
-        const entryDate = new Date(entry.timestamp)
-        return entryDate >= startDate && entryDate <= endDate
-      })
-    }
-
-    if (entriesFilter.entryType && Array.isArray(entriesFilter.entryType) && entriesFilter.entryType.length > 0) {
-      filtered = filtered.filter(entry => entriesFilter.entryType.includes(entry.entry_type))
+      const response = await axios.get('/api/entries/export', { params, responseType: 'blob' })
+      const url = URL.createObjectURL(response.data)
+      const link = document.createElement('a')
+      link.href = url
+      link.download = `entry_history_${toLocalDateString(new Date())}.csv`
+      document.body.appendChild(link)
+      link.click()
+      document.body.removeChild(link)
+      URL.revokeObjectURL(url)
+    } catch (error) {
+      console.error('Error exporting entries:', error)
+      alert('Failed to export entries')
     }
+  }
 
-    return filtered
+  const handlePageChange = (newPage) => {
+    setFilters({ ...filters, page: newPage })
+    window.scrollTo({ top: 0, behavior: 'smooth' })
   }
 
   const handleFilterChange = (type) => {
@@ -157,16 +164,21 @@ const History = () => {
   }
 
   const clearFilters = () => {
-    setEntriesFilter({ 
+    const cleared = { 
       type: 'all', 
       entryType: ['in', 'out'], 
       fromDate: null, 
       toDate: null 
-    })
+    }
+    setEntriesFilter(cleared)
+    setAppliedFilter(cleared)
+    setFilters({ ...filters, page: 1 })
     setShowFilterDropdown(false)
   }
 
   const applyFilters = () => {
+    setAppliedFilter(entriesFilter)
+    setFilters({ ...filters, page: 1 })
     setShowFilterDropdown(false)
   }
 
@@ -185,8 +197,6 @@ const History = () => {
     return count
   }
 
-  const filteredEntries = getFilteredEntries()
-
   if (loading && entries.length === 0) {
     return <div className="page-loading">Loading history...</div>
   }
@@ -200,9 +210,13 @@ const History = () => {
 
       <div className="filters-section">
         <div className="results-count">
-          Showing {filteredEntries.length} entries
+          Showing {entries.length} of {pagination.total || 0} entries
         </div>
         <div className="filter-group">
+          <button className="btn-secondary" onClick={handleExport} title="Export as CSV">
+            <FiDownload />
+            Export
+          </button>
           <div className="filter-dropdown-container">
             <button 
               className={`filter-button ${hasActiveFilters() ? 'active' : ''}`}
@@ -328,7 +342,7 @@ const History = () => {
       </div>
 
       <div className="entries-container">
-        {filteredEntries.length === 0 ? (
+        {entries.length === 0 ? (
           <div className="empty-state">
             <FiFilter className="empty-icon" />
             <p>{hasActiveFilters() ? 'No entries match your filters' : 'No entries found'}</p>
@@ -345,7 +359,7 @@ const History = () => {
         ) : (
           <>
             <div className="entries-list">
-              {filteredEntries.map((entry) => (
+              {entries.map((entry) => (
                 <div key={entry.id} className="entry-card">
                   <div className={`entry-icon ${entry.entry_type === 'in' ? 'icon-in' : 'icon-out'}`}>
                     {entry.entry_type === 'in' ? (
@@ -4,12 +4,35 @@ import axios from 'axios'
 import { FiCamera, FiCheckCircle, FiXCircle, FiAlertCircle, FiRefreshCw, FiSettings, FiMoreVertical, FiX, FiClock, FiMapPin, FiTruck, FiShield, FiCheck, FiImage, FiUser, FiHash, FiTag, FiCalendar } from 'react-icons/fi'
 import './QRScanner.css'
 
+// Scans made while the server is unreachable wait here and are replayed through /api/scan/batch
+const PENDING_SCANS_KEY = 'pendingScans'
+const SCAN_BATCH_SIZE = 500
+
+const loadPendingScans = () => {
+  try {
+    return JSON.parse(localStorage.getItem(PENDING_SCANS_KEY)) || []
+  } catch {
+    return []
+  }
+}
+
+const savePendingScans = (scans) => {
+  localStorage.setItem(PENDING_SCANS_KEY, JSON.stringify(scans))
+}
+
+const newScanId = () => (
+  window.crypto?.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+)
+
 const QRScanner = () => {
   const [scanning, setScanning] = useState(false)
   const [lastScan, setLastScan] = useState(null)
   const [error, setError] = useState('')
   const [success, setSuccess] = useState('')
   const [warning, setWarning] = useState('')
+  const [pendingScanCount, setPendingScanCount] = useState(() => loadPendingScans().length)
   const [scanCount, setScanCount] = useState(0)
   const [cameras, setCameras] = useState([])
   const [selectedCameraId, setSelectedCameraId] = useState(null)
@@ -27,6 +50,7 @@ const QRScanner = () => {
   const countdownRef = useRef(null)
   const lastScannedQrRef = useRef(null)
   const isProcessingScanRef = useRef(false)
+  const isFlushingRef = useRef(false)
 
   // Function to get available cameras with proper labels
   const getCameras = async (requestPermission = false) => {
@@ -168,6 +192,73 @@ const QRScanner = () => {
     }
   }
 
+  // Gate commands are delivered in the background; surface a failure once it is known
+  const watchGateCommand = async (commandId) => {
+    for (let attempt = 0; attempt < 15; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, 1000))
+      try {
+        const response = await axios.get(`/api/gate-commands/${commandId}`)
+        if (response.data.status === 'failed') {
+          setWarning(`Gate control failed (${response.data.error || 'ESP32 unreachable'})`)
+          return
+        }
+        if (response.data.status === 'delivered') {
+          return
+        }
+      } catch (error) {
+        console.error('Error checking gate command:', error)
+        return
+      }
+    }
+  }
+
+  // Send queued offline scans; the server skips IDs it already has, so resending is safe
+  const flushPendingScans = async () => {
+    if (isFlushingRef.current || loadPendingScans().length === 0) {
+      return
+    }
+    isFlushingRef.current = true
+    try {
+      while (loadPendingScans().length > 0) {
+        const batch = loadPendingScans().slice(0, SCAN_BATCH_SIZE)
+        const response = await axios.post('/api/scan/batch', { scans: batch })
+        const settled = new Set(batch.map(scan => scan.client_scan_id))
+        const remaining = loadPendingScans().filter(scan => !settled.has(scan.client_scan_id))
+        savePendingScans(remaining)
+        setPendingScanCount(remaining.length)
+
+        const rejected = response.data.results.filter(result => result.status === 'error')
+        if (rejected.length > 0) {
+          const scansById = Object.fromEntries(batch.map(scan => [scan.client_scan_id, scan]))
+          setErrorLog(prev => [
+            ...rejected.map(result => ({
+              id: `${Date.now()}-${result.client_scan_id}`,
+              message: `Offline scan rejected: ${result.message}`,
+              qrData: (scansById[result.client_scan_id]?.qr_data || 'N/A').substring(0, 50),
+              timestamp: scansById[result.client_scan_id]?.timestamp || new Date().toISOString()
+            })),
+            ...prev
+          ].slice(0, 50))
+        }
+        setScanCount(prev => prev + response.data.recorded)
+      }
+    } catch (err) {
+      console.error('Error sending queued scans:', err)
+    } finally {
+      isFlushingRef.current = false
+    }
+  }
+
+  useEffect(() => {
+    flushPendingScans()
+    window.addEventListener('online', flushPendingScans)
+    const interval = setInterval(flushPendingScans, 30000)
+    return () => {
+      window.removeEventListener('online', flushPendingScans)
+      clearInterval(interval)
+    }
+  }, [])
+
   const handleScan = async (qrData) => {
     // Prevent duplicate scans of the same QR code
     if (isProcessingScanRef.current) {
@@ -212,15 +303,16 @@ const QRScanner = () => {
       
       console.log('Scanning QR code:', qrData)
       console.log('QR data length:', qrData.length)
-      console.log('QR data starts with VEHICLE:', qrData.startsWith('VEHICLE:'))
+      console.log('QR data is a vehicle code:', qrData.startsWith('VEHICLE:') || qrData.startsWith('V2:'))
       
       // Validate QR format before sending to backend
       if (!qrData || typeof qrData !== 'string') {
         throw new Error('Invalid QR code data')
       }
       
-      if (!qrData.startsWith('VEHICLE:')) {
-        throw new Error(`Invalid QR code format. Expected VEHICLE:... but got: ${qrData.substring(0, 30)}`)
+      // V2:... codes are signed; the backend verifies the signature
+      if (!qrData.startsWith('VEHICLE:') && !qrData.startsWith('V2:')) {
+        throw new Error(`Invalid QR code format. Expected V2:... or VEHICLE:... but got: ${qrData.substring(0, 30)}`)
       }
       
       // Check if QR data has enough content
@@ -237,8 +329,15 @@ const QRScanner = () => {
       
       setSuccess(response.data.message)
       setWarning(response.data.warning || '')
+      if (response.data.gate_command) {
+        watchGateCommand(response.data.gate_command.id)
+      }
       setLastScan(response.data.entry)
-      setScanCount(prev => prev + 1)
+      // A repeat read inside the server's debounce window returns the earlier entry unchanged
+      if (!response.data.duplicate) {
+        setScanCount(prev => prev + 1)
+      }
+      flushPendingScans()
 
       // Clear any previous error
       setErrorDetails('')
@@ -275,6 +374,19 @@ const QRScanner = () => {
       }, 2000)
       
     } catch (err) {
+      // Server unreachable: keep the scan with its device time and replay it later
+      if (axios.isAxiosError(err) && !err.response) {
+        const queued = [...loadPendingScans(), {
+          client_scan_id: newScanId(),
+          qr_data: qrData,
+          location: 'Main Gate',
+          timestamp: err.config?.data ? JSON.parse(err.config.data).timestamp : new Date().toISOString()
+        }]
+        savePendingScans(queued)
+        setPendingScanCount(queued.length)
+        return
+      }
+
       const errorMessage = err.response?.data?.message || err.message || 'Failed to process QR code'
       const errorTime = new Date()
       
@@ -488,6 +600,15 @@ const QRScanner = () => {
               </button>
             )}
           </div>
+
+          {pendingScanCount > 0 && (
+            <div className="pending-scans">
+              <FiClock className="pending-scans-icon" />
+              <span>
+                {pendingScanCount} offline {pendingScanCount === 1 ? 'scan' : 'scans'} waiting to be sent
+              </span>
+            </div>
+          )}
         </div>
       </div>
 
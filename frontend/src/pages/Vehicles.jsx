@@ -1,12 +1,15 @@
 import React, { useState, useEffect } from 'react'
 import axios from 'axios'
 import { useAuth } from '../context/AuthContext'
-import { FiPlus, FiEdit, FiTrash2, FiMaximize2, FiTruck, FiDownload, FiX, FiUpload, FiImage, FiChevronLeft, FiChevronRight } from 'react-icons/fi'
+import { FiPlus, FiEdit, FiTrash2, FiMaximize2, FiTruck, FiDownload, FiX, FiUpload, FiImage, FiChevronLeft, FiChevronRight, FiPrinter } from 'react-icons/fi'
 import './Vehicles.css'
 
 const Vehicles = () => {
   const { user: currentUser } = useAuth()
   const [vehicles, setVehicles] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [plateSearch, setPlateSearch] = useState('')
+  const [loadingMore, setLoadingMore] = useState(false)
   const [users, setUsers] = useState([])
   const [loading, setLoading] = useState(true)
   const [showModal, setShowModal] = useState(false)
@@ -32,16 +35,26 @@ const Vehicles = () => {
   })
 
   useEffect(() => {
-    fetchVehicles()
     if (currentUser?.role === 'admin') {
       fetchUsers()
     }
   }, [currentUser])
 
-  const fetchVehicles = async () => {
+  useEffect(() => {
+    // Debounce the search box so typing doesn't fire a request per keystroke
+    const timer = setTimeout(() => fetchVehicles(), 300)
+    return () => clearTimeout(timer)
+  }, [currentUser, plateSearch])
+
+  const fetchVehicles = async (cursor = null) => {
     try {
-      const response = await axios.get('/api/vehicles')
-      setVehicles(response.data)
+      const params = { limit: 60 }
+      if (cursor) params.cursor = cursor
+      if (plateSearch.trim()) params.plate = plateSearch.trim()
+
+      const response = await axios.get('/api/vehicles', { params })
+      setVehicles(prev => cursor ? [...prev, ...response.data.vehicles] : response.data.vehicles)
+      setNextCursor(response.data.next_cursor)
     } catch (error) {
       console.error('Error fetching vehicles:', error)
     } finally {
@@ -49,6 +62,12 @@ const Vehicles = () => {
     }
   }
 
+  const handleLoadMore = async () => {
+    setLoadingMore(true)
+    await fetchVehicles(nextCursor)
+    setLoadingMore(false)
+  }
+
   const fetchUsers = async () => {
     try {
       const response = await axios.get('/api/users')
@@ -99,24 +118,39 @@ const Vehicles = () => {
     setUploadProgress(0)
   }
 
+  // Printable sticker sheets for every vehicle the user can see, rendered server-side as one PDF
+  const handlePrintSheets = async () => {
+    try {
+      const response = await axios.get('/api/vehicles/qr-sheet', { params: { format: 'pdf' }, responseType: 'blob' })
+      const url = URL.createObjectURL(response.data)
+      const link = document.createElement('a')
+      link.href = url
+      link.download = 'qr_sheets.pdf'
+      document.body.appendChild(link)
+      link.click()
+      document.body.removeChild(link)
+      URL.revokeObjectURL(url)
+    } catch (error) {
+      console.error('Error generating QR sheets:', error)
+      alert('Failed to generate QR sheets')
+    }
+  }
+
   const handleViewQR = (vehicle) => {
     setSelectedQR(vehicle)
     setShowQRModal(true)
   }
 
-  const handleDownloadQR = () => {
+  const handleDownloadQR = async () => {
     if (!selectedQR || !selectedQR.qr_code) return
     
     try {
-      // Convert base64 to blob
-      const base64Data = selectedQR.qr_code.replace(/^data:image\/png;base64,/, '')
-      const byteCharacters = atob(base64Data)
-      const byteNumbers = new Array(byteCharacters.length)
-      for (let i = 0; i < byteCharacters.length; i++) {
-        byteNumbers[i] = byteCharacters.charCodeAt(i)
+      // QR codes are served from the blob store; fetch the PNG bytes for download
+      const response = await fetch(selectedQR.qr_code)
+      if (!response.ok) {
+        throw new Error(`QR code request failed with status ${response.status}`)
       }
-      const byteArray = new Uint8Array(byteNumbers)
-      const blob = new Blob([byteArray], { type: 'image/png' })
+      const blob = await response.blob()
       
       // Create download link
       const url = URL.createObjectURL(blob)
@@ -199,7 +233,7 @@ const Vehicles = () => {
   const handleViewImages = (vehicle) => {
     const allImages = vehicle.images || []
     if (allImages.length > 0) {
-      setLightboxImages(allImages.map(img => img.image_data))
+      setLightboxImages(allImages.map(img => img.url))
       setCurrentImageIndex(0)
       setShowImageModal(true)
     }
@@ -294,10 +328,23 @@ const Vehicles = () => {
           <h1>Vehicle Management</h1>
           <p>Manage vehicles and generate QR codes</p>
         </div>
-        <button className="btn-primary" onClick={handleCreate}>
-          <FiPlus className="btn-icon" />
-          Add Vehicle
-        </button>
+        <div className="page-header-actions">
+          <input
+            type="search"
+            className="vehicle-search"
+            placeholder="Search plate number..."
+            value={plateSearch}
+            onChange={(e) => setPlateSearch(e.target.value)}
+          />
+          <button className="btn-secondary" onClick={handlePrintSheets} title="Download printable QR sticker sheets">
+            <FiPrinter className="btn-icon" />
+            Print QR Sheets
+          </button>
+          <button className="btn-primary" onClick={handleCreate}>
+            <FiPlus className="btn-icon" />
+            Add Vehicle
+          </button>
+        </div>
       </div>
 
       <div className="vehicles-grid">
@@ -318,7 +365,7 @@ const Vehicles = () => {
                     onClick={() => handleViewImages(vehicle)}
                   >
                     <img
-                      src={vehicle.images[0].image_data}
+                      src={vehicle.images[0].preview_url}
                       alt={`Vehicle ${vehicle.plate_number}`}
                       className="vehicle-image-main"
                     />
@@ -332,7 +379,7 @@ const Vehicles = () => {
                       {vehicle.images.slice(1, 4).map((image, idx) => (
                         <img
                           key={image.id}
-                          src={image.image_data}
+                          src={image.thumbnail_url}
                           alt={`Vehicle ${vehicle.plate_number} ${idx + 2}`}
                           className="vehicle-image-thumb"
                           onClick={() => handleViewImages(vehicle)}
@@ -404,9 +451,17 @@ const Vehicles = () => {
         ))}
       </div>
 
+      {nextCursor && (
+        <div className="load-more">
+          <button className="btn-secondary" onClick={handleLoadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
+
       {vehicles.length === 0 && (
         <div className="empty-state">
-          <p>No vehicles registered yet</p>
+          <p>{plateSearch ? 'No vehicles match your search' : 'No vehicles registered yet'}</p>
           <button className="btn-primary" onClick={handleCreate}>
             Add Your First Vehicle
           </button>
@@ -506,7 +561,7 @@ const Vehicles = () => {
                       .filter(img => !deleteImageIds.includes(img.id))
                       .map((image) => (
                         <div key={image.id} className="image-preview">
-                          <img src={image.image_data} alt="Vehicle" />
+                          <img src={image.thumbnail_url} alt="Vehicle" />
                           <div className="image-actions">
                             <button
                               type="button"